@@ -0,0 +1,65 @@
+"""process 수에 따른 data parallel 학습 scaling efficiency 측정
+
+launch.py로 학습 script를 1, 2, 4, 8 process로 실행해서 epoch throughput을 비교한다.
+efficiency = throughput(N) / (N * throughput(1))
+
+    cd main && python ../bench_scaling.py --nprocs 1 2 4 8 --max_steps 50 -- train.py --data_dir data/train_dataset
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+THROUGHPUT_PATTERN = re.compile(r"throughput: ([\d.]+) samples/s")
+
+
+def run(nproc, args):
+    cmd = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "launch.py"),
+        "--nproc_per_node", str(nproc),
+        "--master_port", str(args.master_port),
+    ]
+    if args.total_threads:
+        cmd += ["--num_threads", str(max(1, args.total_threads // nproc))]
+    cmd += args.training_script_args + [
+        "--num_train_epochs", "1",
+        "--max_steps", str(args.max_steps),
+    ]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    matches = THROUGHPUT_PATTERN.findall(output)
+    if not matches:
+        raise RuntimeError(f"throughput not found in output of {' '.join(cmd)}")
+    return float(matches[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nprocs", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--max_steps", type=int, default=50, help="process당 학습 step 수")
+    parser.add_argument("--total_threads", type=int, default=None,
+                        help="전체 thread 수. 지정하면 process 수로 나눠서 할당 (기본: launch.py가 core 수로 나눔)")
+    parser.add_argument("--master_port", type=int, default=29500)
+    parser.add_argument("--output", type=str, default=None, help="결과를 json으로 저장")
+    parser.add_argument("training_script_args", nargs=argparse.REMAINDER,
+                        help="학습 script와 argument (예: -- train.py --data_dir ...)")
+    args = parser.parse_args()
+    if args.training_script_args[:1] == ["--"]:
+        args.training_script_args = args.training_script_args[1:]
+
+    results = []
+    for nproc in args.nprocs:
+        throughput = run(nproc, args)
+        results.append({"nproc": nproc, "throughput": throughput})
+        print(results[-1])
+
+    base = next((r["throughput"] for r in results if r["nproc"] == 1), None)
+    for r in results:
+        if base:
+            r["efficiency"] = r["throughput"] / (r["nproc"] * base)
+        print(f"{r['nproc']} processes: {r['throughput']:.1f} samples/s" +
+              (f", efficiency {r['efficiency']:.1%}" if "efficiency" in r else ""))
+    if args.output:
+        json.dump(results, open(args.output, "w"), indent=2)
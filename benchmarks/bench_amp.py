@@ -0,0 +1,167 @@
+"""CPU에서 TRADE / SOM-DST training step의 fp32 vs bfloat16 autocast 비교
+
+각 (model, precision) 조합을 별도 process에서 실행해서 step time과 peak RSS를 잰다.
+model은 ydy8989/som-dst/의 models, TrainingEngine은 repo root의 train_engine.py를 쓴다.
+결과 형식이 다른 suite와 달라서 run_benchmarks.py에는 넣지 않고 따로 실행한다.
+
+    python benchmarks/bench_amp.py --models trade somdst --steps 20
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import time
+from argparse import Namespace
+
+from common import use_folder
+
+use_folder("")
+use_folder(os.path.join("ydy8989", "som-dst"))
+
+import torch  # noqa: E402
+import torch.nn as nn  # noqa: E402
+from transformers import AdamW  # noqa: E402
+
+from models import SOMDST, TRADE, masked_cross_entropy_for_value  # noqa: E402
+from train_engine import TrainingEngine, cpu_autocast_available  # noqa: E402
+
+N_SLOT = 45
+
+
+def trade_step_fn(args):
+    config = Namespace(
+        vocab_size=args.vocab_size,
+        hidden_size=768,
+        hidden_dropout_prob=0.1,
+        proj_dim=None,
+        n_gate=5,
+    )
+    tokenized_slot_meta = [[i + 1, i + 2] for i in range(N_SLOT)]
+    model = TRADE(config, tokenized_slot_meta)
+    input_ids = torch.randint(1, args.vocab_size, (args.batch_size, args.seq_length))
+    input_masks = torch.ones_like(input_ids)
+    target_ids = torch.randint(1, args.vocab_size, (args.batch_size, N_SLOT, 6))
+    gating_ids = torch.randint(0, config.n_gate, (args.batch_size, N_SLOT))
+    loss_fnc = nn.CrossEntropyLoss()
+
+    def loss_fn():
+        all_point_outputs, all_gate_outputs = model(
+            input_ids, input_ids, input_masks, target_ids.size(-1), target_ids
+        )
+        loss_1 = masked_cross_entropy_for_value(
+            all_point_outputs.contiguous(), target_ids.contiguous().view(-1)
+        )
+        loss_2 = loss_fnc(
+            all_gate_outputs.contiguous().view(-1, config.n_gate),
+            gating_ids.contiguous().view(-1),
+        )
+        return loss_1 + loss_2
+
+    return model, loss_fn
+
+
+def somdst_step_fn(args):
+    config = Namespace(
+        model_name_or_path=args.model_name_or_path,
+        vocab_size=args.vocab_size,
+        hidden_size=768,
+        hidden_dropout_prob=0.1,
+    )
+    model = SOMDST(config, 5, 6, 1)
+    input_ids = torch.randint(1, args.vocab_size, (args.batch_size, args.seq_length))
+    segment_ids = torch.zeros_like(input_ids)
+    input_masks = torch.ones_like(input_ids)
+    slot_position_ids = torch.arange(N_SLOT).repeat(args.batch_size, 1) * 4 + 1
+    gating_ids = torch.full((args.batch_size, N_SLOT), 3, dtype=torch.long)
+    gating_ids[:, :2] = 1  # update 2개
+    domain_ids = torch.randint(0, 5, (args.batch_size,))
+    target_ids = torch.randint(1, args.vocab_size, (args.batch_size, 2, 6))
+    loss_fnc = nn.CrossEntropyLoss()
+
+    def loss_fn():
+        domain_scores, state_scores, gen_scores = model(
+            input_ids=input_ids,
+            token_type_ids=segment_ids,
+            slot_positions=slot_position_ids,
+            attention_mask=input_masks,
+            max_value=target_ids.size(-1),
+            op_ids=gating_ids,
+            max_update=target_ids.size(1),
+            teacher=target_ids,
+        )
+        loss_1 = masked_cross_entropy_for_value(gen_scores.contiguous(), target_ids.contiguous())
+        loss_2 = loss_fnc(state_scores.contiguous().view(-1, 6), gating_ids.contiguous().view(-1))
+        loss_3 = loss_fnc(domain_scores.view(-1, 5), domain_ids.view(-1))
+        return loss_1 + loss_2 + loss_3
+
+    return model, loss_fn
+
+
+STEP_FNS = {"trade": trade_step_fn, "somdst": somdst_step_fn}
+
+
+def run(model_name, use_amp, args, queue):
+    torch.manual_seed(42)
+    torch.set_num_threads(args.num_threads)
+    model, loss_fn = STEP_FNS[model_name](args)
+    model.train()
+    optimizer = AdamW(model.parameters(), lr=1e-4)
+    engine = TrainingEngine(model, optimizer, device="cpu", use_amp=use_amp, max_grad_norm=1.0)
+
+    step_times = []
+    for step in range(args.warmup_steps + args.steps):
+        start = time.perf_counter()
+        with engine.autocast():
+            loss = loss_fn()
+        engine.backward(loss)
+        if step >= args.warmup_steps:
+            step_times.append(time.perf_counter() - start)
+
+    queue.put(
+        {
+            "model": model_name,
+            "precision": "bf16" if engine.amp_dtype is not None else "fp32",
+            "step_time_ms": 1000 * sum(step_times) / len(step_times),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "loss": loss.item(),
+        }
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=["trade", "somdst"], choices=list(STEP_FNS))
+    parser.add_argument("--model_name_or_path", type=str, default="dsksd/bert-ko-small-minimal")
+    parser.add_argument("--vocab_size", type=int, default=35003)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--seq_length", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup_steps", type=int, default=3)
+    parser.add_argument("--num_threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", type=str, default=None, help="결과를 json으로 저장")
+    args = parser.parse_args()
+
+    if not cpu_autocast_available():
+        print("torch.cpu.amp is not available (torch>=1.10 needed). bf16 runs fall back to fp32")
+
+    ctx = mp.get_context("spawn")
+    results = []
+    for model_name in args.models:
+        for use_amp in [False, True]:
+            queue = ctx.Queue()
+            p = ctx.Process(target=run, args=(model_name, use_amp, args, queue))
+            p.start()
+            results.append(queue.get())
+            p.join()
+            print(results[-1])
+
+    for model_name in args.models:
+        fp32, bf16 = [r for r in results if r["model"] == model_name]
+        print(
+            f"{model_name}: step {fp32['step_time_ms']:.1f}ms -> {bf16['step_time_ms']:.1f}ms "
+            f"(x{fp32['step_time_ms'] / bf16['step_time_ms']:.2f}), "
+            f"peak rss {fp32['peak_rss_mb']:.0f}MB -> {bf16['peak_rss_mb']:.0f}MB"
+        )
+    if args.output:
+        json.dump(results, open(args.output, "w"), indent=2)
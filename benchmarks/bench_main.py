@@ -0,0 +1,154 @@
+"""main/ 폴더 benchmark: example 생성, TRADE feature 변환 / collate / forward, DSTEvaluator (loop / vectorized)"""
+import argparse
+import random
+import tempfile
+from argparse import Namespace
+
+from common import add_common_args, make_corpus, measure, use_folder, write_results, write_vocab
+
+use_folder("main")
+
+import torch  # noqa: E402
+import torch.nn as nn  # noqa: E402
+from transformers import BertTokenizer  # noqa: E402
+
+from data_utils import get_examples_from_dialogues  # noqa: E402
+from eval_utils import DSTEvaluator, VectorizedDSTEvaluator  # noqa: E402
+from model import TRADE, masked_cross_entropy_for_value  # noqa: E402
+from preprocessor import TRADEPreprocessor  # noqa: E402
+
+
+def perturb_state(state, slot_meta, rng, error_rate=0.2):
+    """DSTEvaluator 입력용 prediction: gold에서 일부 slot을 빼거나 틀린 value로 바꾼다"""
+    pred = []
+    for sv in state:
+        r = rng.random()
+        if r < error_rate / 2:
+            continue
+        if r < error_rate:
+            sv = sv.rsplit("-", 1)[0] + "-wrong"
+        pred.append(sv)
+    if rng.random() < error_rate:
+        pred.append(f"{rng.choice(slot_meta)}-extra")
+    return pred
+
+
+def run(args):
+    data, slot_meta, ontology = make_corpus(args.scale, args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="dst_bench_")
+    # do_lower_case=True면 NFD 정규화로 한글이 자모로 분해된다
+    tokenizer = BertTokenizer(write_vocab(data, slot_meta, workdir), do_lower_case=False)
+    processor = TRADEPreprocessor(slot_meta, tokenizer)
+    results = []
+
+    examples = get_examples_from_dialogues(data, user_first=False, dialogue_level=False)
+    results.append(measure(
+        "main/get_examples_from_dialogues",
+        lambda: get_examples_from_dialogues(data, user_first=False, dialogue_level=False),
+        items=len(examples), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    features = processor.convert_examples_to_features(examples)
+    results.append(measure(
+        "main/trade_convert_examples_to_features",
+        lambda: processor.convert_examples_to_features(examples),
+        items=len(examples), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    batches = [features[i: i + args.batch_size] for i in range(0, len(features), args.batch_size)]
+    results.append(measure(
+        "main/trade_collate_fn",
+        lambda: [processor.collate_fn(b) for b in batches],
+        items=len(features), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    # TRADE forward (train: teacher forcing + loss + backward, infer: greedy decoding)
+    tokenized_slot_meta = [
+        tokenizer.encode(slot.replace("-", " "), add_special_tokens=False) for slot in slot_meta
+    ]
+    config = Namespace(
+        vocab_size=len(tokenizer),
+        hidden_size=args.hidden_size,
+        hidden_dropout_prob=0.1,
+        proj_dim=None,
+        n_gate=len(processor.gating2id),
+    )
+    torch.manual_seed(args.seed)
+    model = TRADE(config, tokenized_slot_meta)
+    input_ids, segment_ids, input_masks, gating_ids, target_ids, _ = processor.collate_fn(
+        features[: args.batch_size]
+    )
+    loss_fnc = nn.CrossEntropyLoss()
+
+    def train_step():
+        model.zero_grad()
+        all_point_outputs, all_gate_outputs = model(
+            input_ids, segment_ids, input_masks, target_ids.size(-1), target_ids
+        )
+        loss_1 = masked_cross_entropy_for_value(
+            all_point_outputs.contiguous(), target_ids.contiguous().view(-1), tokenizer.pad_token_id
+        )
+        loss_2 = loss_fnc(all_gate_outputs.contiguous().view(-1, config.n_gate), gating_ids.contiguous().view(-1))
+        (loss_1 + loss_2).backward()
+
+    model.train()
+    results.append(measure(
+        "main/trade_forward_train", train_step,
+        items=len(input_ids), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    eval_input_ids, eval_segment_ids, eval_input_masks, _, _, _ = processor.collate_fn(
+        features[: args.eval_batch_size]
+    )
+
+    def infer_step():
+        with torch.no_grad():
+            model(eval_input_ids, eval_segment_ids, eval_input_masks, 9)
+
+    model.eval()
+    results.append(measure(
+        "main/trade_forward_infer", infer_step,
+        items=len(eval_input_ids), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    # DSTEvaluator
+    rng = random.Random(args.seed)
+    golds = [e.label for e in examples]
+    preds = [perturb_state(g, slot_meta, rng) for g in golds]
+    evaluator = DSTEvaluator(slot_meta)
+
+    def evaluate():
+        evaluator.init()
+        for gold, pred in zip(golds, preds):
+            evaluator.update(gold, pred)
+        evaluator.compute()
+
+    results.append(measure(
+        "main/dst_evaluator_update", evaluate,
+        items=len(golds), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    vectorized = VectorizedDSTEvaluator(slot_meta)
+
+    def evaluate_vectorized():
+        vectorized.init()
+        for gold, pred in zip(golds, preds):
+            vectorized.update(gold, pred)
+        vectorized.compute()
+
+    results.append(measure(
+        "main/vectorized_dst_evaluator", evaluate_vectorized,
+        items=len(golds), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+    return results
+
+
+if __name__ == "__main__":
+    parser = add_common_args(argparse.ArgumentParser())
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--eval_batch_size", type=int, default=32)
+    parser.add_argument("--hidden_size", type=int, default=768)
+    args = parser.parse_args()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    write_results(run(args), args.output)
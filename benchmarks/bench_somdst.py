@@ -0,0 +1,120 @@
+"""ydy8989/som-dst/ 폴더 benchmark: SOMDSTPreprocessor feature 변환 / collate, SOM-DST forward
+
+SOMDST는 AutoModel.from_pretrained로 BERT를 불러오므로, random init된 작은 BERT를 workdir에 저장해서 쓴다.
+"""
+import argparse
+import os
+import tempfile
+from argparse import Namespace
+
+from common import (add_common_args, make_corpus, measure, save_tiny_bert, use_folder, write_results,
+                    write_vocab)
+
+use_folder(os.path.join("ydy8989", "som-dst"))
+
+import torch  # noqa: E402
+import torch.nn as nn  # noqa: E402
+from transformers import BertTokenizer  # noqa: E402
+
+from data_utils import get_examples_from_dialogues  # noqa: E402
+from inference_somdst import inference  # noqa: E402
+from models import SOMDST, masked_cross_entropy_for_value  # noqa: E402
+from preprocessor import SOMDSTPreprocessor  # noqa: E402
+
+SPECIAL_TOKENS = ["[SLOT]", "[NULL]", "[EOS]"]
+
+
+def run(args):
+    data, slot_meta, ontology = make_corpus(args.scale, args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="dst_bench_")
+    # do_lower_case=True면 NFD 정규화로 한글이 자모로 분해된다
+    tokenizer = BertTokenizer(write_vocab(data, slot_meta, workdir), do_lower_case=False)
+    added_token_num = tokenizer.add_special_tokens({"additional_special_tokens": SPECIAL_TOKENS})
+    processor = SOMDSTPreprocessor(slot_meta, tokenizer, max_seq_length=args.max_seq_length)
+    results = []
+
+    examples = get_examples_from_dialogues(data, user_first=False, dialogue_level=False)
+    features = processor.convert_examples_to_features(examples)
+    results.append(measure(
+        "somdst/convert_examples_to_features",
+        lambda: processor.convert_examples_to_features(examples),
+        items=len(examples), unit="turns", repeat=args.repeat, warmup=args.warmup,
+        setup=processor.reset_state,
+    ))
+
+    batches = [features[i: i + args.batch_size] for i in range(0, len(features), args.batch_size)]
+    results.append(measure(
+        "somdst/collate_fn",
+        lambda: [processor.collate_fn(b) for b in batches],
+        items=len(features), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    # SOM-DST forward (train: teacher forcing + loss + backward, infer: turn 단위 순차 inference)
+    config = Namespace(
+        model_name_or_path=save_tiny_bert(
+            os.path.join(workdir, "tiny_bert"), tokenizer.vocab_size, args.hidden_size, args.num_layers
+        ),
+        vocab_size=tokenizer.vocab_size + added_token_num,
+        hidden_size=args.hidden_size,
+        hidden_dropout_prob=0.1,
+    )
+    torch.manual_seed(args.seed)
+    model = SOMDST(config, 5, 6, processor.op2id["update"])
+    (
+        input_ids,
+        input_masks,
+        segment_ids,
+        slot_position_ids,
+        gating_ids,
+        domain_ids,
+        target_ids,
+        max_update,
+        max_value,
+        _,
+    ) = processor.collate_fn(features[: args.batch_size])
+    loss_fnc = nn.CrossEntropyLoss()
+
+    def train_step():
+        model.zero_grad()
+        domain_scores, state_scores, gen_scores = model(
+            input_ids=input_ids,
+            token_type_ids=segment_ids,
+            slot_positions=slot_position_ids,
+            attention_mask=input_masks,
+            max_value=max_value,
+            op_ids=gating_ids,
+            max_update=max_update,
+            teacher=target_ids,
+        )
+        loss_1 = masked_cross_entropy_for_value(gen_scores.contiguous(), target_ids.contiguous(), tokenizer.pad_token_id)
+        loss_2 = loss_fnc(state_scores.contiguous().view(-1, 6), gating_ids.contiguous().view(-1))
+        loss_3 = loss_fnc(domain_scores.view(-1, 5), domain_ids.view(-1))
+        (loss_1 + loss_2 + loss_3).backward()
+
+    model.train()
+    results.append(measure(
+        "somdst/forward_train", train_step,
+        items=len(input_ids), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    eval_examples = examples[: args.num_infer_turns]
+    model.eval()
+    results.append(measure(
+        "somdst/forward_infer",
+        lambda: inference(model, eval_examples, processor, torch.device("cpu")),
+        items=len(eval_examples), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+    return results
+
+
+if __name__ == "__main__":
+    parser = add_common_args(argparse.ArgumentParser())
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--max_seq_length", type=int, default=512)
+    parser.add_argument("--hidden_size", type=int, default=256)
+    parser.add_argument("--num_layers", type=int, default=4)
+    parser.add_argument("--num_infer_turns", type=int, default=32)
+    args = parser.parse_args()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    write_results(run(args), args.output)
@@ -0,0 +1,97 @@
+"""ydy8989/ 폴더 benchmark: SUMBTPreprocessor feature 변환 / collate, SUMBT utterance encoding
+
+utterance encoding은 dummy turn을 건너뛰는 현재 방식 (encode_utterance(num_turns))과
+모든 turn을 BERT에 넣던 이전 방식 (num_turns=max_turn_length)을 같은 batch로 비교한다.
+"""
+import argparse
+import os
+import tempfile
+from argparse import Namespace
+
+from common import (add_common_args, make_corpus, measure, save_tiny_bert, use_folder, write_results,
+                    write_vocab)
+
+use_folder("ydy8989")
+
+import torch  # noqa: E402
+from transformers import BertTokenizer  # noqa: E402
+
+from data_utils import get_examples_from_dialogues  # noqa: E402
+from model import SUMBT  # noqa: E402
+from preprocessor import SUMBTPreprocessor  # noqa: E402
+
+
+def run(args):
+    data, slot_meta, ontology = make_corpus(args.scale, args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="dst_bench_")
+    # do_lower_case=True면 NFD 정규화로 한글이 자모로 분해된다
+    tokenizer = BertTokenizer(write_vocab(data, slot_meta, workdir), do_lower_case=False)
+    max_turn = max(len(d["dialogue"]) for d in data)
+    processor = SUMBTPreprocessor(
+        slot_meta, tokenizer, ontology=ontology, max_seq_length=64, max_turn_length=max_turn
+    )
+    results = []
+
+    examples = get_examples_from_dialogues(data, user_first=True, dialogue_level=True)
+    num_turns = sum(len(e) for e in examples)
+    features = processor.convert_examples_to_features(examples)
+    results.append(measure(
+        "sumbt/convert_examples_to_features",
+        lambda: processor.convert_examples_to_features(examples),
+        items=num_turns, unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    batches = [features[i: i + args.batch_size] for i in range(0, len(features), args.batch_size)]
+    results.append(measure(
+        "sumbt/collate_fn",
+        lambda: [processor.collate_fn(b) for b in batches],
+        items=len(features), unit="dialogues", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    # utterance encoding: dummy turn skip (after) vs 모든 turn encoding (before)
+    config = Namespace(
+        model_name_or_path=save_tiny_bert(
+            os.path.join(workdir, "tiny_bert"), tokenizer.vocab_size, args.hidden_size, args.num_layers
+        ),
+        hidden_dim=args.hidden_size,
+        num_rnn_layers=1,
+        zero_init_rnn=False,
+        max_seq_length=processor.max_seq_length,
+        max_label_length=12,
+        attn_head=4,
+        fix_utterance_encoder=False,
+    )
+    torch.manual_seed(args.seed)
+    model = SUMBT(config, [len(v) for v in ontology.values()], "cpu").eval()
+    encode_batches = [processor.collate_fn(b)[:5] for b in batches]
+    num_real_turns = sum(f.num_turn for f in features)
+
+    def encode(skip_dummy):
+        with torch.no_grad():
+            for input_ids, segment_ids, input_masks, _, num_turns in encode_batches:
+                if not skip_dummy:
+                    num_turns = [input_ids.size(1)] * input_ids.size(0)
+                model.encode_utterance(input_ids, segment_ids, input_masks, num_turns)
+
+    results.append(measure(
+        "sumbt/encode_utterance_all_turns",
+        lambda: encode(False),
+        items=num_real_turns, unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+    results.append(measure(
+        "sumbt/encode_utterance",
+        lambda: encode(True),
+        items=num_real_turns, unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+    return results
+
+
+if __name__ == "__main__":
+    parser = add_common_args(argparse.ArgumentParser())
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--hidden_size", type=int, default=256)
+    parser.add_argument("--num_layers", type=int, default=4)
+    args = parser.parse_args()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    write_results(run(args), args.output)
@@ -0,0 +1,89 @@
+"""hardvote_v2 benchmark: 여러 voter의 prediction을 turn마다 hard voting"""
+import argparse
+import random
+
+from common import add_common_args, make_corpus, measure, use_folder, write_results
+
+use_folder("")
+
+from hardvote_v2 import CRITERION, hardvoting, sum_predictions, voter_meta  # noqa: E402
+from vote_engine import VoteEngine  # noqa: E402
+from vote_report import build_report  # noqa: E402
+
+
+def make_predictions(data, slot_meta, num_voters, seed, error_rate=0.2):
+    """dialogue의 state를 gold로 두고, voter마다 일부 slot을 빼거나 바꾼 prediction 생성"""
+    rng = random.Random(seed)
+    golds = {}
+    for dialogue in data:
+        d_idx = 0
+        for turn in dialogue["dialogue"]:
+            if turn["role"] != "user":
+                continue
+            golds[f"{dialogue['dialogue_idx']}-{d_idx}"] = turn["state"]
+            d_idx += 1
+
+    predictions = []
+    for _ in range(num_voters):
+        voter = {}
+        for guid, state in golds.items():
+            pred = []
+            for sv in state:
+                r = rng.random()
+                if r < error_rate / 2:
+                    continue
+                if r < error_rate:
+                    sv = f"{sv.rsplit('-', 1)[0]}-오답{rng.randint(0, 3)}"
+                pred.append(sv)
+            if rng.random() < error_rate:
+                pred.append(f"{rng.choice(slot_meta)}-추가{rng.randint(0, 3)}")
+            voter[guid] = pred
+        predictions.append(voter)
+    return predictions
+
+
+def run(args):
+    data, slot_meta, _ = make_corpus(args.scale, args.seed)
+    predictions = make_predictions(data, slot_meta, args.num_voters, args.seed)
+    turns = list(predictions[0].keys())
+    n_voter = len(predictions)
+    results = []
+
+    for criterion in [CRITERION.SV_MAJORITY1, CRITERION.SV_MAJORITY2, CRITERION.SLOT_FIRST_AND_TOP_VALUE]:
+        def vote():
+            return {t: hardvoting(sum_predictions(predictions, turn=t), n_voter, criterion=criterion) for t in turns}
+
+        results.append(measure(
+            f"vote/hardvoting_{criterion}_{n_voter}voters", vote,
+            items=len(turns), unit="turns", repeat=args.repeat, warmup=args.warmup,
+        ))
+
+    voted = {t: hardvoting(sum_predictions(predictions, turn=t), n_voter) for t in turns}
+    results.append(measure(
+        f"vote/voter_meta_{n_voter}voters", lambda: voter_meta(predictions, voted),
+        items=len(turns), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+
+    # vote_engine: interning (VoteEngine 생성)과 criterion별 voting을 따로 측정
+    results.append(measure(
+        f"vote/vote_engine_build_{n_voter}voters", lambda: VoteEngine(predictions),
+        items=len(turns), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+    engine = VoteEngine(predictions)
+    for criterion in [CRITERION.SV_MAJORITY1, CRITERION.SV_MAJORITY2, CRITERION.SLOT_FIRST_AND_TOP_VALUE]:
+        results.append(measure(
+            f"vote/vote_engine_{criterion}_{n_voter}voters", lambda: engine.vote(criterion),
+            items=len(turns), unit="turns", repeat=args.repeat, warmup=args.warmup,
+        ))
+    results.append(measure(
+        f"vote/disagreement_report_{n_voter}voters", lambda: build_report(engine),
+        items=len(turns), unit="turns", repeat=args.repeat, warmup=args.warmup,
+    ))
+    return results
+
+
+if __name__ == "__main__":
+    parser = add_common_args(argparse.ArgumentParser())
+    parser.add_argument("--num_voters", type=int, default=9)
+    args = parser.parse_args()
+    write_results(run(args), args.output)
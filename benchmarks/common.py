@@ -0,0 +1,159 @@
+"""benchmark suite 공통 함수: 시간 측정, synthetic corpus, offline tokenizer, 결과 저장
+
+각 suite (bench_*.py)는 대상 폴더의 module 이름이 서로 겹치므로 (data_utils, preprocessor 등)
+run_benchmarks.py가 suite마다 별도 process로 실행한다.
+"""
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+def use_folder(folder):
+    """folder (repo root 기준)의 module을 import 할 수 있게 sys.path 맨 앞에 추가"""
+    path = os.path.join(REPO_ROOT, folder)
+    sys.path.insert(0, path)
+    return path
+
+
+def add_common_args(parser):
+    parser.add_argument("--scale", type=float, default=1.0, help="synthetic corpus 크기 배율")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--workdir", type=str, default=None, help="tokenizer / tiny model 임시 저장 경로")
+    parser.add_argument("--output", type=str, default=None, help="결과 json 경로 (없으면 stdout)")
+    return parser
+
+
+def measure(name, fn, items=None, unit="items", repeat=5, warmup=1, setup=None):
+    """fn을 repeat번 실행한 시간 통계. setup은 매 실행 전에 호출되며 측정에서 빠진다"""
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    result = {
+        "name": name,
+        "median_ms": 1000 * statistics.median(times),
+        "min_ms": 1000 * min(times),
+        "mean_ms": 1000 * statistics.mean(times),
+        "repeat": repeat,
+    }
+    if items is not None:
+        result["items"] = items
+        result["unit"] = unit
+        result[f"{unit}_per_sec"] = items / statistics.median(times)
+    print(f"{name}: {result['median_ms']:.2f}ms (median of {repeat})", file=sys.stderr)
+    return result
+
+
+def _load_synthetic_data_module():
+    spec = importlib.util.spec_from_file_location(
+        "synthetic_data", os.path.join(REPO_ROOT, "main", "synthetic_data.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_corpus(scale=1.0, seed=42, num_dialogues=200):
+    """main/synthetic_data.py로 WOS 형식 corpus 생성. (data, slot_meta, ontology) 반환"""
+    synthetic_data = _load_synthetic_data_module()
+    slot_meta, ontology = synthetic_data.build_schema()
+    generator = synthetic_data.SyntheticDialogueGenerator(slot_meta, ontology, seed=seed)
+    data = generator.generate(max(1, int(num_dialogues * scale)))
+    return data, slot_meta, ontology
+
+
+def write_vocab(data, slot_meta, workdir, extra_tokens=()):
+    """corpus의 단어 + 글자로 만든 작은 wordpiece vocab (network 없이 BertTokenizer 생성용)"""
+    words = set()
+    for dialogue in data:
+        for turn in dialogue["dialogue"]:
+            words.update(turn["text"].split())
+            for sv in turn.get("state", []):
+                words.update(sv.replace("-", " ").split())
+    for slot in slot_meta:
+        words.update(slot.replace("-", " ").split())
+    chars = sorted({c for w in words for c in w})
+    vocab = SPECIAL_TOKENS + list(extra_tokens) + ["-", ";", "none", "dontcare", "yes", "no"]
+    vocab += sorted(words) + chars + [f"##{c}" for c in chars]
+    vocab = list(dict.fromkeys(vocab))
+
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, "vocab.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab) + "\n")
+    return path
+
+
+def save_tiny_bert(path, vocab_size, hidden_size, num_layers):
+    """random init된 작은 BERT를 저장 (from_pretrained로 BERT를 불러오는 model을 network 없이 만들기 위해)"""
+    from transformers import BertConfig, BertModel
+
+    config = BertConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        num_hidden_layers=num_layers,
+        num_attention_heads=max(1, hidden_size // 64),
+        intermediate_size=4 * hidden_size,
+    )
+    BertModel(config).save_pretrained(path)
+    return path
+
+
+def machine_info():
+    info = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    info["cpu_model"] = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    try:
+        import torch
+
+        info["torch"] = torch.__version__
+        info["torch_num_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    try:
+        info["git_commit"] = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True,
+        ).stdout.strip()
+    except OSError:
+        pass
+    return info
+
+
+def write_results(results, path=None):
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if path is None:
+        print(text)
+    else:
+        with open(path, "w") as f:
+            f.write(text)
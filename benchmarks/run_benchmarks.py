@@ -0,0 +1,116 @@
+"""CPU benchmark 실행 + baseline 비교
+
+synthetic data (main/synthetic_data.py)와 offline tokenizer로 network / 실제 data 없이 실행된다.
+suite마다 별도 process로 실행해서 (폴더마다 module 이름이 겹침) 결과를 하나의 json으로 합친다.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --output results.json --save_baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --threshold 0.1
+
+baseline과 비교해서 median 시간이 threshold (기본 10%) 이상 늘어난 benchmark는 regression으로 표시하고
+--fail_on_regression이면 exit code 1을 반환한다.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import machine_info, write_results
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SUITES = {
+    "main": "bench_main.py",
+    "sumbt": "bench_sumbt.py",
+    "somdst": "bench_somdst.py",
+    "vote": "bench_vote.py",
+}
+
+
+def run_suite(suite, args, workdir):
+    output = os.path.join(workdir, f"{suite}.json")
+    cmd = [
+        sys.executable,
+        os.path.join(BENCH_DIR, SUITES[suite]),
+        "--scale", str(args.scale),
+        "--repeat", str(args.repeat),
+        "--warmup", str(args.warmup),
+        "--seed", str(args.seed),
+        "--workdir", os.path.join(workdir, suite),
+        "--output", output,
+    ]
+    if args.num_threads:
+        cmd += ["--num_threads", str(args.num_threads)]
+    subprocess.run(cmd, check=True, cwd=BENCH_DIR)
+    return json.load(open(output))
+
+
+def compare(results, baseline, threshold):
+    """benchmark별 median 시간 비율 (current / baseline)"""
+    baseline_by_name = {r["name"]: r for r in baseline["results"]}
+    comparison = []
+    for r in results:
+        base = baseline_by_name.get(r["name"])
+        if base is None:
+            continue
+        ratio = r["median_ms"] / base["median_ms"]
+        comparison.append({
+            "name": r["name"],
+            "baseline_ms": base["median_ms"],
+            "current_ms": r["median_ms"],
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold,
+        })
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--suites", nargs="+", default=list(SUITES), choices=list(SUITES))
+    parser.add_argument("--scale", type=float, default=1.0, help="synthetic corpus 크기 배율")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--output", type=str, default=None, help="결과 json 경로")
+    parser.add_argument("--baseline", type=str, default=None, help="비교할 baseline json")
+    parser.add_argument("--save_baseline", type=str, default=None, help="이번 결과를 baseline으로 저장")
+    parser.add_argument("--threshold", type=float, default=0.1, help="regression으로 볼 시간 증가 비율")
+    parser.add_argument("--fail_on_regression", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dst_bench_")
+    results = []
+    for suite in args.suites:
+        print(f"# suite: {suite}", file=sys.stderr)
+        results.extend(run_suite(suite, args, workdir))
+
+    report = {
+        "machine": machine_info(),
+        "config": {k: getattr(args, k) for k in ["suites", "scale", "repeat", "warmup", "seed", "num_threads"]},
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        baseline = json.load(open(args.baseline))
+        report["baseline_machine"] = baseline.get("machine")
+        report["comparison"] = compare(results, baseline, args.threshold)
+        for c in report["comparison"]:
+            mark = "REGRESSION" if c["regression"] else ""
+            print(f"{c['name']:<55} {c['baseline_ms']:>10.2f}ms -> {c['current_ms']:>10.2f}ms (x{c['ratio']:.2f}) {mark}")
+        regressions = [c["name"] for c in report["comparison"] if c["regression"]]
+    else:
+        for r in results:
+            print(f"{r['name']:<55} {r['median_ms']:>10.2f}ms")
+
+    if args.output:
+        write_results(report, args.output)
+    if args.save_baseline:
+        write_results({"machine": report["machine"], "config": report["config"], "results": results}, args.save_baseline)
+
+    if regressions:
+        print(f"{len(regressions)} regressions: {regressions}")
+        if args.fail_on_regression:
+            sys.exit(1)
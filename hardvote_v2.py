@@ -3,7 +3,8 @@ from collections import Counter, defaultdict
 from tqdm import tqdm
 import os
 from dataclasses import dataclass
-from time import sleep
+
+from prediction_io import load_predictions  # predictions.csv (json) / predictions.jsonl 둘 다 읽는다
 
 ############################################## region 재료 ########################################################
 
@@ -26,16 +27,6 @@ class CRITERION:
     default = SV_MAJORITY2
 
 
-@dataclass
-class VERBOSE:
-    # [progress bar, discord, discord_contents]
-    FULL = (1, 1, 1)
-    PROGRESS = (1, 1, 0)
-    CONTENTS = (0, 0, 1)
-
-    default = FULL
-
-
 def sum_predictions(predictions: list, turn: str):
     slot_votes = []
     slotvalue_votes = []
@@ -145,51 +136,6 @@ def svs2s_v(state):
     return retList
 
 
-def show_democarcy(turns, predictions, n_voter, voted_predictions, verbose, delay):
-    prev_guid = ""
-    if verbose[0] == 1:
-        gen = tqdm(turns)
-    else:
-        gen = turns
-    for t in gen:
-        if prev_guid == t.split('-')[-2]:
-            continue
-        sum_preds_at_t = sum_predictions(predictions, turn=t)
-        for v in sum_preds_at_t['slotvalue_counts'].values():
-            if v != n_voter:
-                states = [p[t] for p in predictions]
-                allSet = set()
-                for s in states:
-                    # print(s);sleep(1)
-                    allSet.update(s)
-                negatives = [set() for _ in range(len(states))]
-                for i in range(len(states)):
-                    s = states[i]
-                    negatives[i] = allSet - set(s)
-                uncommon = set()
-                for n in negatives:
-                    uncommon.update(n)
-                common = allSet - uncommon
-                if verbose[1] == 1:
-                    print()
-                    print(f"discord found at turn : {t} | common values : {len(common)}")
-                    sleep(delay)
-                for s in states:
-                    uncommon_vote = set(s) - common
-                    msgList = []
-                    for u in uncommon_vote:
-                        if u in voted_predictions[t]:
-                            msgList.append(u + "(accepted)")
-                        else:
-                            msgList.append(u)
-                    if verbose[2] == 1:
-                        print(msgList)
-                print()
-                sleep(delay)
-                prev_guid = t.split('-')[-2]
-                break
-
-
 # endregion
 
 ######################################## region 테스트 ########################################################
@@ -231,29 +177,28 @@ def debug():
     results[example_turn] = hardvoting_for_turn
 
 
-def do_test(csv_dir=".", criterion=CRITERION.SLOT_FIRST_AND_TOP_VALUE, verbose=VERBOSE.default, delay=1):
+def do_test(csv_dir=".", criterion=CRITERION.SLOT_FIRST_AND_TOP_VALUE, report_path="./hardvoting_report.html"):
+    """voting 결과는 저장하지 않고, voter 간 불일치 report (vote_report.py)와 voter 통계만 만든다
+
+    예전의 turn별 불일치 출력 (show_democarcy, verbose / delay)은 이 report로 대체되었다.
+    """
+    # vote_engine이 이 module을 import 하므로 함수 안에서 import
+    from vote_engine import VoteEngine
+    from vote_report import build_report, write_report
+
     cwd = os.getcwd()
     print(f"currently working in {cwd}")
 
-    prediction_files = [file for file in os.listdir(csv_dir) if file.endswith(".csv")]
+    prediction_files = [file for file in os.listdir(csv_dir) if file.endswith((".csv", ".jsonl"))]
     print(f"{len(prediction_files)} csv files : {prediction_files} are found at {cwd}")
 
-    predictions = [json.load(open(p, "r")) for p in prediction_files]
-
-    n_voter = len(predictions)
-
-    turns = list(predictions[0].keys())
-
-    results = defaultdict(dict)
-
-    for t in tqdm(turns):
-        sum_preds_at_t = sum_predictions(predictions, turn=t)
-        results[t] = hardvoting(sum_preds_at_t, n_voter, criterion=criterion)
-
-    voter_statistics = voter_meta(predictions, results)
-    voted_predictions = voting2preds(results)
+    predictions = [load_predictions(os.path.join(csv_dir, p)) for p in prediction_files]
 
-    show_democarcy(turns, predictions, n_voter, voted_predictions, verbose, delay)
+    engine = VoteEngine(predictions)
+    report = build_report(engine, criterion, prediction_files)
+    write_report(report, report_path)
+    voter_statistics = engine.voter_meta(criterion)
+    print(f"disagreement report is saved at {report_path} : {report['summary']}")
 
     # save_csv(voted_predictions, save_dir)
     print(f"voted_predictions are not saved in testing")
@@ -269,23 +214,34 @@ def csvs_to_hardvoted_csv(csv_dir, criterion=CRITERION.SLOT_FIRST_AND_TOP_VALUE,
     cwd = os.getcwd()
     print(f"currently working in {cwd}")
 
-    prediction_files = [file for file in os.listdir(csv_dir) if file.endswith(".csv")]
+    prediction_files = [file for file in os.listdir(csv_dir) if file.endswith((".csv", ".jsonl"))]
     print(f"{len(prediction_files)} csv files : {prediction_files} are found at {cwd}")
 
-    predictions = [json.load(open(p, "r")) for p in prediction_files]
+    predictions = [load_predictions(os.path.join(csv_dir, p)) for p in prediction_files]
 
-    n_voter = len(predictions)
+    try:
+        # numpy가 있으면 vote_engine으로 turn 전체를 한 번에 (결과는 아래 turn별 voting과 같다)
+        from vote_engine import VoteEngine
+    except ImportError:
+        VoteEngine = None
 
-    turns = list(predictions[0].keys())
+    if VoteEngine is not None:
+        engine = VoteEngine(predictions)
+        voted_predictions = engine.vote(criterion)
+        voter_statistics = engine.voter_meta(criterion)
+    else:
+        n_voter = len(predictions)
 
-    results = defaultdict(dict)
+        turns = list(predictions[0].keys())
+
+        results = defaultdict(dict)
 
-    for t in tqdm(turns):
-        sum_preds_at_t = sum_predictions(predictions, turn=t)
-        results[t] = hardvoting(sum_preds_at_t, n_voter, criterion=criterion)
+        for t in tqdm(turns):
+            sum_preds_at_t = sum_predictions(predictions, turn=t)
+            results[t] = hardvoting(sum_preds_at_t, n_voter, criterion=criterion)
 
-    voter_statistics = voter_meta(predictions, results)
-    voted_predictions = voting2preds(results)
+        voter_statistics = voter_meta(predictions, results)
+        voted_predictions = voting2preds(results)
 
     save_csv(voted_predictions, save_dir)
     print(f"voted_predictions are saved at {save_dir}")
@@ -296,5 +252,5 @@ def csvs_to_hardvoted_csv(csv_dir, criterion=CRITERION.SLOT_FIRST_AND_TOP_VALUE,
 # endregion
 
 if __name__ == "__main__":
-    # do_test(csv_dir = ".", criterion = CRITERION.SLOT_FIRST_AND_TOP_VALUE, verbose = VERBOSE.FULL, delay = 1)
+    # do_test(csv_dir = ".", criterion = CRITERION.SLOT_FIRST_AND_TOP_VALUE)
     csvs_to_hardvoted_csv(csv_dir=".", criterion=CRITERION.SLOT_FIRST_AND_TOP_VALUE, save_dir="./hardvoting_result")
@@ -0,0 +1,77 @@
+"""CPU multi process (gloo) 학습 launcher
+
+main / ydy8989 / ydy8989/som-dst 의 학습 script 모두 이 launcher 하나로 실행한다.
+학습 script는 현재 경로 기준으로 주고, script가 있는 폴더에서 실행하면 된다 (sibling module import).
+
+한 머신에서 4 process:
+    cd main && python ../launch.py --nproc_per_node 4 train.py --data_dir data/train_dataset
+    cd ydy8989/som-dst && python ../../launch.py --nproc_per_node 4 train_somdst.py ...
+
+머신 2대 (각각 실행):
+    python launch.py --nnodes 2 --node_rank 0 --master_addr 10.0.0.1 --nproc_per_node 4 train.py ...
+    python launch.py --nnodes 2 --node_rank 1 --master_addr 10.0.0.1 --nproc_per_node 4 train.py ...
+
+학습 script는 train_engine.init_distributed() (각 폴더의 train_utils)로 RANK / WORLD_SIZE 등을 읽는다.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def launch(args):
+    world_size = args.nnodes * args.nproc_per_node
+    # 한 머신의 core를 process끼리 나눠 쓰도록 thread 수 제한
+    num_threads = args.num_threads or max(1, (os.cpu_count() or 1) // args.nproc_per_node)
+
+    processes = []
+    for local_rank in range(args.nproc_per_node):
+        env = dict(os.environ)
+        env.update(
+            {
+                "MASTER_ADDR": args.master_addr,
+                "MASTER_PORT": str(args.master_port),
+                "WORLD_SIZE": str(world_size),
+                "RANK": str(args.node_rank * args.nproc_per_node + local_rank),
+                "LOCAL_RANK": str(local_rank),
+                "OMP_NUM_THREADS": str(num_threads),
+                "MKL_NUM_THREADS": str(num_threads),
+            }
+        )
+        cmd = [sys.executable, "-u", args.training_script] + args.training_script_args
+        processes.append(subprocess.Popen(cmd, env=env))
+
+    # 하나라도 실패하면 나머지를 종료 (gloo collective에서 영원히 대기하지 않도록)
+    returncode = 0
+    try:
+        while processes:
+            for p in list(processes):
+                ret = p.poll()
+                if ret is None:
+                    continue
+                processes.remove(p)
+                if ret != 0:
+                    returncode = ret
+                    for other in processes:
+                        other.terminate()
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+        raise
+    return returncode
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nnodes", type=int, default=1)
+    parser.add_argument("--node_rank", type=int, default=0)
+    parser.add_argument("--nproc_per_node", type=int, default=1)
+    parser.add_argument("--master_addr", type=str, default="127.0.0.1")
+    parser.add_argument("--master_port", type=int, default=29500)
+    parser.add_argument("--num_threads", type=int, default=None, help="process당 intra-op thread 수")
+    parser.add_argument("training_script", type=str)
+    parser.add_argument("training_script_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    sys.exit(launch(args))
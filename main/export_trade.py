@@ -0,0 +1,239 @@
+"""TRADE greedy decoding graph export (TorchScript / ONNX) 및 runner
+
+encoder + decoder의 greedy decoding (max_len step을 펼친 graph)을 (input_ids, attention_mask) ->
+(point_ids, gate_ids) 하나의 graph로 export한다. slot index는 buffer라 graph에 상수로 들어간다.
+
+    python export_trade.py export --model_dir results --checkpoint model-29.bin --output_dir exported
+    python export_trade.py compare --data_dir data/train_dataset --model_dir results --checkpoint model-29.bin \
+        --graph exported/trade.onnx
+
+ONNX는 copy (scatter_add)가 중복 index를 더하는 ScatterElements(reduction="add")가 필요해서 opset 16 이상,
+즉 torch 1.13 이상에서만 export 된다. 그보다 낮은 torch (requirements의 1.7 포함)에서는 --formats onnx가
+바로 오류로 끝나고, 기본 --formats는 TorchScript만 export 한다.
+runner 실행에는 onnxruntime이 필요하다.
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, SequentialSampler
+
+from data_utils import WOSDataset, get_examples_from_dialogues, load_dataset, set_seed
+from evaluation import _evaluation
+from inference import postprocess_state
+from model_artifact import load_artifact, load_legacy
+from preprocessor import TRADEPreprocessor
+from train_utils import select_eval_dialogues
+
+INPUT_NAMES = ["input_ids", "attention_mask"]
+OUTPUT_NAMES = ["point_ids", "gate_ids"]
+# ScatterElements(reduction="add") (opset 16) export를 지원하는 최소 torch 버전
+ONNX_MIN_TORCH = (1, 13)
+
+
+def onnx_export_available():
+    major, minor = (int(v) for v in re.match(r"(\d+)\.(\d+)", torch.__version__).groups())
+    return (major, minor) >= ONNX_MIN_TORCH
+
+
+class TRADEGreedyGraph(nn.Module):
+    """export용 wrapper: (input_ids, attention_mask) -> (point_ids B,J,max_len / gate_ids B,J)"""
+
+    def __init__(self, model, max_len=9):
+        super(TRADEGreedyGraph, self).__init__()
+        self.model = model
+        self.max_len = max_len
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.greedy_decode(input_ids, attention_mask, self.max_len)
+
+
+def _example_inputs(vocab_size, batch_size=2, seq_len=32):
+    input_ids = torch.randint(1, vocab_size, (batch_size, seq_len))
+    attention_mask = torch.ones(batch_size, seq_len, dtype=torch.long)
+    attention_mask[-1, seq_len // 2:] = 0
+    input_ids[-1, seq_len // 2:] = 0
+    return input_ids, attention_mask
+
+
+def export_torchscript(model, path, max_len=9):
+    graph = TRADEGreedyGraph(model, max_len).cpu().eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(graph, _example_inputs(model.decoder.vocab_size), check_trace=False)
+    traced.save(path)
+    return path
+
+
+def export_onnx(model, path, max_len=9, opset_version=16):
+    if not onnx_export_available():
+        raise RuntimeError(
+            f"ONNX export needs torch>={'.'.join(map(str, ONNX_MIN_TORCH))} (opset 16 ScatterElements add), "
+            f"but torch {torch.__version__} is installed. Use --formats torchscript"
+        )
+    if opset_version < 16:
+        raise ValueError(f"opset {opset_version} has no ScatterElements reduction; use --opset 16 or higher")
+    graph = TRADEGreedyGraph(model, max_len).cpu().eval()
+    dynamic_axes = {
+        "input_ids": {0: "batch", 1: "seq_len"},
+        "attention_mask": {0: "batch", 1: "seq_len"},
+        "point_ids": {0: "batch"},
+        "gate_ids": {0: "batch"},
+    }
+    with torch.no_grad():
+        torch.onnx.export(
+            graph,
+            _example_inputs(model.decoder.vocab_size),
+            path,
+            input_names=INPUT_NAMES,
+            output_names=OUTPUT_NAMES,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+        )
+    return path
+
+
+class EagerRunner:
+    def __init__(self, model, max_len=9):
+        self.model = model.cpu().eval()
+        self.max_len = max_len
+
+    def __call__(self, input_ids, attention_mask):
+        with torch.no_grad():
+            return self.model.greedy_decode(input_ids, attention_mask.long(), self.max_len)
+
+
+class TorchScriptRunner:
+    def __init__(self, path):
+        self.graph = torch.jit.load(path, map_location="cpu").eval()
+
+    def __call__(self, input_ids, attention_mask):
+        with torch.no_grad():
+            return self.graph(input_ids, attention_mask.long())
+
+
+class ONNXRunner:
+    def __init__(self, path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("ONNX runner requires onnxruntime: pip install onnxruntime")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, attention_mask):
+        point_ids, gate_ids = self.session.run(
+            OUTPUT_NAMES,
+            {"input_ids": input_ids.numpy(), "attention_mask": attention_mask.long().numpy()},
+        )
+        return torch.from_numpy(point_ids), torch.from_numpy(gate_ids)
+
+
+def load_runner(path, num_threads=None):
+    if path.endswith(".onnx"):
+        return ONNXRunner(path, num_threads)
+    return TorchScriptRunner(path)
+
+
+def inference_graph(runner, eval_loader, processor):
+    """inference.inference와 같은 prediction을 runner로 만든다. (predictions, batch별 latency(초))"""
+    predictions, latencies = {}, []
+    for batch in eval_loader:
+        input_ids, _, input_masks, _, _, guids = batch
+        start = time.perf_counter()
+        point_ids, gate_ids = runner(input_ids, input_masks)
+        latencies.append(time.perf_counter() - start)
+        for guid, gate, gen in zip(guids, gate_ids.tolist(), point_ids.tolist()):
+            predictions[guid] = postprocess_state(processor.recover_state(gate, gen))
+    return predictions, latencies
+
+
+def _load_model(args):
+    if args.artifact:
+        model, tokenizer, slot_meta, _ = load_artifact(args.artifact)
+    else:
+        model, tokenizer, slot_meta, _, _ = load_legacy(args.model_dir, args.checkpoint)
+    return model, tokenizer, slot_meta
+
+
+def _summary(predictions, latencies, dev_labels, slot_meta):
+    latencies = sorted(latencies)
+    return {
+        "joint_goal_accuracy": _evaluation(predictions, dev_labels, slot_meta)["joint_goal_accuracy"],
+        "latency_ms_p50": latencies[len(latencies) // 2] * 1000,
+        "latency_ms_p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "turns_per_sec": len(predictions) / sum(latencies),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["export", "compare"])
+    parser.add_argument("--model_dir", type=str, default=None, help="exp_config.json / slot_meta.json이 있는 경로")
+    parser.add_argument("--checkpoint", type=str, default=None, help="model_dir 안의 state dict (model-{epoch}.bin)")
+    parser.add_argument("--artifact", type=str, default=None, help="model_artifact.py로 export한 파일 (model_dir 대신)")
+    parser.add_argument("--max_len", type=int, default=9, help="slot value 당 generate할 token 수 (graph에 고정)")
+    # export
+    parser.add_argument("--output_dir", type=str, default="exported")
+    parser.add_argument("--formats", nargs="+", default=None, choices=["torchscript", "onnx"],
+                        help="기본: torchscript + (torch>=1.13이면) onnx")
+    parser.add_argument("--opset", type=int, default=16)
+    # compare
+    parser.add_argument("--graph", type=str, default=None, help="비교할 .onnx / .pt graph")
+    parser.add_argument("--data_dir", type=str, default="data/train_dataset")
+    parser.add_argument("--random_seed", type=int, default=42, help="train.py와 같아야 같은 dev split")
+    parser.add_argument("--eval_batch_size", type=int, default=32)
+    parser.add_argument("--eval_subset", type=int, default=None, help="dev set에서 이 수만큼의 dialogue만 사용")
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.formats is None:
+        args.formats = ["torchscript"] + (["onnx"] if onnx_export_available() else [])
+    if args.command == "export" and "onnx" in args.formats and not onnx_export_available():
+        parser.error(
+            f"--formats onnx needs torch>={'.'.join(map(str, ONNX_MIN_TORCH))}, "
+            f"installed torch is {torch.__version__} (requirements.txt pins 1.7.0). Use --formats torchscript"
+        )
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+
+    model, tokenizer, slot_meta = _load_model(args)
+
+    if args.command == "export":
+        os.makedirs(args.output_dir, exist_ok=True)
+        if "torchscript" in args.formats:
+            print("TorchScript:", export_torchscript(model, f"{args.output_dir}/trade.pt", args.max_len))
+        if "onnx" in args.formats:
+            print("ONNX:", export_onnx(model, f"{args.output_dir}/trade.onnx", args.max_len, args.opset))
+    else:
+        set_seed(args.random_seed)
+        _, dev_data, dev_labels = load_dataset(f"{args.data_dir}/train_dials.json")
+        processor = TRADEPreprocessor(slot_meta, tokenizer)
+        dev_examples = get_examples_from_dialogues(dev_data, user_first=False, dialogue_level=False)
+        dev_examples = select_eval_dialogues(dev_examples, args.eval_subset, args.random_seed)
+        dev_labels = {e.guid: dev_labels[e.guid] for e in dev_examples}
+        eval_data = WOSDataset(processor.convert_examples_to_features(dev_examples))
+        eval_loader = DataLoader(
+            eval_data,
+            batch_size=args.eval_batch_size,
+            sampler=SequentialSampler(eval_data),
+            collate_fn=processor.collate_fn,
+        )
+        print("# dev:", len(eval_data))
+
+        eager_preds, eager_latencies = inference_graph(EagerRunner(model, args.max_len), eval_loader, processor)
+        graph_preds, graph_latencies = inference_graph(load_runner(args.graph, args.num_threads), eval_loader, processor)
+
+        mismatch = [guid for guid in eager_preds if sorted(eager_preds[guid]) != sorted(graph_preds[guid])]
+        results = {
+            "eager": _summary(eager_preds, eager_latencies, dev_labels, slot_meta),
+            "graph": _summary(graph_preds, graph_latencies, dev_labels, slot_meta),
+            "prediction_match_rate": 1 - len(mismatch) / len(eager_preds),
+            "mismatched_guids": mismatch[:20],
+        }
+        print(json.dumps(results, indent=2))
@@ -1,6 +1,7 @@
 import argparse
 import os
 import json
+import sys
 
 import torch
 from torch.utils.data import DataLoader, SequentialSampler
@@ -8,7 +9,13 @@ from tqdm import tqdm
 from transformers import BertTokenizer
 
 from data_utils import (WOSDataset, get_examples_from_dialogues)
+from eval_utils import StreamingDSTEvaluator
 from model import TRADE
+from model_artifact import load_artifact
+# prediction_io.py (prediction jsonl 읽기 / 쓰기)와 quantization.py는 repo root의 것을 같이 쓴다
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from prediction_io import PredictionWriter, iter_predictions, jsonl_to_csv
+from quantization import quantize_dynamic_int8
 from preprocessor import TRADEPreprocessor
 
 
@@ -22,10 +29,15 @@ def postprocess_state(state):
     return state
 
 
-def inference(model, eval_loader, processor, device):
+def inference(model, eval_loader, processor, device, writer=None, evaluator=None):
+    """writer (PredictionWriter)가 주어지면 batch마다 jsonl에 쓰고 memory에는 모으지 않는다
+
+    evaluator (StreamingDSTEvaluator)가 주어지면 batch마다 update하고 running JGA를 progress bar에 표시한다.
+    """
     model.eval()
     predictions = {}
-    for batch in tqdm(eval_loader):
+    pbar = tqdm(eval_loader)
+    for batch in pbar:
         input_ids, segment_ids, input_masks, gating_ids, target_ids, guids = [
             b.to(device) if not isinstance(b, list) else b for b in batch
         ]
@@ -36,10 +48,18 @@ def inference(model, eval_loader, processor, device):
             _, generated_ids = o.max(-1)
             _, gated_ids = g.max(-1)
 
+        batch_predictions = {}
         for guid, gate, gen in zip(guids, gated_ids.tolist(), generated_ids.tolist()):
             prediction = processor.recover_state(gate, gen)
             prediction = postprocess_state(prediction)
-            predictions[guid] = prediction
+            batch_predictions[guid] = prediction
+        if evaluator is not None:
+            evaluator.update(batch_predictions)
+            pbar.set_postfix(jga=f"{evaluator.compute()['joint_goal_accuracy']:.4f}")
+        if writer is not None:
+            writer.write(batch_predictions)
+        else:
+            predictions.update(batch_predictions)
     return predictions
 
 
@@ -49,24 +69,62 @@ if __name__ == "__main__":
     parser.add_argument("--model_dir", type=str, default=None)
     parser.add_argument("--output_dir", type=str, default=None)
     parser.add_argument("--eval_batch_size", type=int, default=32)
+    parser.add_argument(
+        "--artifact", type=str, default=None,
+        help="model_artifact.py로 export한 단일 파일 (주어지면 SM_CHANNEL_MODEL 대신 사용)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="output_dir/predictions.jsonl에 이미 있는 guid는 건너뛰고 이어서 inference",
+    )
+    parser.add_argument(
+        "--quantize", action="store_true",
+        help="Linear / GRU / vocab projection을 dynamic int8로 quantize해서 CPU에서 inference",
+    )
+    parser.add_argument(
+        "--gt_path", type=str, default=None,
+        help="label json (dev). 주어지면 inference 중에 평가하고 output_dir/eval_state.json에 저장",
+    )
+    parser.add_argument("--num_shards", type=int, default=1, help="dialogue 단위로 나눠서 여러 process로 inference")
+    parser.add_argument("--shard_id", type=int, default=0)
     args = parser.parse_args()
     args.data_dir = os.environ['SM_CHANNEL_EVAL']
-    args.model_dir = os.environ['SM_CHANNEL_MODEL']
     args.output_dir = os.environ['SM_OUTPUT_DATA_DIR']
-    
-    model_dir_path = os.path.dirname(args.model_dir)
     eval_data = json.load(open(f"{args.data_dir}/eval_dials.json", "r"))
-    config = json.load(open(f"{model_dir_path}/exp_config.json", "r"))
-    config = argparse.Namespace(**config)
-    slot_meta = json.load(open(f"{model_dir_path}/slot_meta.json", "r"))
 
-    tokenizer = BertTokenizer.from_pretrained(config.model_name_or_path)
+    if args.artifact:
+        model, tokenizer, slot_meta, config = load_artifact(args.artifact, device)
+    else:
+        args.model_dir = os.environ['SM_CHANNEL_MODEL']
+        model_dir_path = os.path.dirname(args.model_dir)
+        config = json.load(open(f"{model_dir_path}/exp_config.json", "r"))
+        config = argparse.Namespace(**config)
+        slot_meta = json.load(open(f"{model_dir_path}/slot_meta.json", "r"))
+        tokenizer = BertTokenizer.from_pretrained(config.model_name_or_path)
     processor = TRADEPreprocessor(slot_meta, tokenizer)
 
+    # shard: dialogue 단위로 나눠서 파일 이름에 shard 번호를 붙인다 (eval_state는 evaluation.py --merge로 합친다)
+    eval_data = eval_data[args.shard_id::args.num_shards]
+    suffix = f".shard{args.shard_id}" if args.num_shards > 1 else ""
     eval_examples = get_examples_from_dialogues(
         eval_data, user_first=False, dialogue_level=False
     )
 
+    # prediction은 batch마다 predictions.jsonl에 쓰고, 끝나면 predictions.csv로 변환
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+    pred_path = f"{args.output_dir}/predictions{suffix}.jsonl"
+    writer = PredictionWriter(pred_path, resume=args.resume)
+    eval_examples = [e for e in eval_examples if e.guid not in writer.done]
+    print(f"# skipped (already predicted): {len(writer.done)}")
+
+    evaluator = None
+    if args.gt_path:
+        evaluator = StreamingDSTEvaluator(slot_meta, json.load(open(args.gt_path, "r")))
+        if writer.done:
+            # resume: 이미 쓴 prediction부터 다시 반영
+            evaluator.update(dict(iter_predictions(pred_path)))
+
     # Extracting Featrues
     eval_features = processor.convert_examples_to_features(eval_examples)
     eval_data = WOSDataset(eval_features)
@@ -79,26 +137,26 @@ if __name__ == "__main__":
     )
     print("# eval:", len(eval_data))
 
-    tokenized_slot_meta = []
-    for slot in slot_meta:
-        tokenized_slot_meta.append(
-            tokenizer.encode(slot.replace("-", " "), add_special_tokens=False)
-        )
-
-    model = TRADE(config, tokenized_slot_meta)
-    ckpt = torch.load(args.model_dir, map_location="cpu")
-    model.load_state_dict(ckpt)
-    model.to(device)
+    if not args.artifact:
+        tokenized_slot_meta = []
+        for slot in slot_meta:
+            tokenized_slot_meta.append(
+                tokenizer.encode(slot.replace("-", " "), add_special_tokens=False)
+            )
+
+        model = TRADE(config, tokenized_slot_meta)
+        ckpt = torch.load(args.model_dir, map_location="cpu")
+        model.load_state_dict(ckpt)
+        model.to(device)
+    if args.quantize:
+        device = torch.device("cpu")
+        model = quantize_dynamic_int8(model, inplace=True)
     print("Model is loaded")
 
-    predictions = inference(model, eval_loader, processor, device)
-    
-    if not os.path.exists(args.output_dir):
-        os.mkdir(args.output_dir)
-    
-    json.dump(
-        predictions,
-        open(f"{args.output_dir}/predictions.csv", "w"),
-        indent=2,
-        ensure_ascii=False,
-    )
+    with writer:
+        inference(model, eval_loader, processor, device, writer=writer, evaluator=evaluator)
+
+    jsonl_to_csv(pred_path, f"{args.output_dir}/predictions{suffix}.csv")
+    if evaluator is not None:
+        evaluator.save(f"{args.output_dir}/eval_state{suffix}.json")
+        print(evaluator.compute())
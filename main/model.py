@@ -67,6 +67,18 @@ class TRADE(nn.Module):
 
         return all_point_outputs, all_gate_outputs
 
+    def greedy_decode(self, input_ids, attention_mask, max_len=9):
+        """inference용: generate한 token id (B,J,max_len)와 gate id (B,J)"""
+        encoder_outputs, pooled_output = self.encoder(input_ids=input_ids)
+        point_ids, gate_logits = self.decoder.greedy_decode(
+            input_ids,
+            encoder_outputs,
+            pooled_output.unsqueeze(0),
+            attention_mask,
+            max_len,
+        )
+        return point_ids, gate_logits.max(-1)[1]
+
 
 class GRUEncoder(nn.Module):
     def __init__(self, vocab_size, d_model, n_layer, dropout, proj_dim=None, pad_idx=0):
@@ -127,6 +139,8 @@ class SlotGenerator(nn.Module):
         self.w_gen = nn.Linear(self.hidden_size * 3, 1)
         self.sigmoid = nn.Sigmoid()
         self.w_gate = nn.Linear(self.hidden_size, n_gate)
+        # hidden -> vocab score. None이면 embed.weight와 matmul (quantization.py에서 int8 Linear로 교체)
+        self.vocab_proj = None
 
     def set_slot_idx(self, slot_vocab_idx):
         whole = []
@@ -136,7 +150,8 @@ class SlotGenerator(nn.Module):
                 gap = max_length - len(idx)
                 idx.extend([self.pad_idx] * gap)
             whole.append(idx)
-        self.slot_embed_idx = whole  # torch.LongTensor(whole)
+        # J x max_length, model과 같이 device를 옮기도록 buffer로 (checkpoint에는 저장하지 않음)
+        self.register_buffer("slot_embed_idx", torch.LongTensor(whole), persistent=False)
 
     def embedding(self, x):
         x = self.embed(x)
@@ -144,6 +159,54 @@ class SlotGenerator(nn.Module):
             x = self.proj_layer(x)
         return x
 
+    def _expand_slots(self, input_ids, encoder_output, hidden, input_masks):
+        """Parallel Decoding: batch x slot (B*J)개의 sequence로 펼친다"""
+        batch_size, seq_len, d = encoder_output.size()
+        slot_e = torch.sum(self.embedding(self.slot_embed_idx), 1)  # J,d
+        J = slot_e.size(0)
+
+        # repeat_interleave와 같은 결과 (export 시 graph가 단순해지도록 expand + reshape)
+        w = slot_e.repeat(batch_size, 1).unsqueeze(1)
+        hidden = hidden.unsqueeze(2).expand(-1, -1, J, -1).reshape(1, batch_size * J, -1)
+        encoder_output = encoder_output.unsqueeze(1).expand(-1, J, -1, -1).reshape(batch_size * J, seq_len, d)
+        input_ids = input_ids.unsqueeze(1).expand(-1, J, -1).reshape(batch_size * J, seq_len)
+        input_masks = input_masks.unsqueeze(1).expand(-1, J, -1).reshape(batch_size * J, seq_len)
+        return w, hidden, encoder_output, input_ids, input_masks
+
+    def _decode_step(self, w, hidden, encoder_output, input_ids, input_masks):
+        w = self.dropout(w)
+        _, hidden = self.gru(w, hidden)  # 1,B,D
+
+        # B,T,D * B,D,1 => B,T
+        attn_e = torch.bmm(encoder_output, hidden.permute(1, 2, 0))  # B,T,1
+        attn_e = attn_e.squeeze(-1).masked_fill(input_masks, -1e9)
+        attn_history = F.softmax(attn_e, -1)  # B,T
+
+        if self.proj_layer:
+            hidden_proj = torch.matmul(hidden, self.proj_layer.weight)
+        else:
+            hidden_proj = hidden
+
+        # B,D * D,V => B,V
+        if self.vocab_proj is not None:
+            attn_v = self.vocab_proj(hidden_proj.squeeze(0))  # B,V
+        else:
+            attn_v = torch.matmul(
+                hidden_proj.squeeze(0), self.embed.weight.transpose(0, 1)
+            )  # B,V
+        attn_vocab = F.softmax(attn_v, -1)
+
+        # B,1,T * B,T,D => B,1,D
+        context = torch.bmm(attn_history.unsqueeze(1), encoder_output)  # B,1,D
+        p_gen = self.sigmoid(
+            self.w_gen(torch.cat([w, hidden.transpose(0, 1), context], -1))
+        )  # B,1
+        p_gen = p_gen.squeeze(-1)
+
+        p_context_ptr = torch.zeros_like(attn_vocab).scatter_add(1, input_ids, attn_history)  # copy B,V
+        p_final = p_gen * attn_vocab + (1 - p_gen) * p_context_ptr  # B,V
+        return p_final, hidden, context
+
     def forward(
         self, input_ids, encoder_output, hidden, input_masks, max_len, teacher=None
     ):
@@ -151,50 +214,20 @@ class SlotGenerator(nn.Module):
         # J, slot_meta : key : [domain, slot] ex> LongTensor([1,2])
         # J,2
         batch_size = encoder_output.size(0)
-        slot = torch.LongTensor(self.slot_embed_idx).to(input_ids.device)  ##
-        slot_e = torch.sum(self.embedding(slot), 1)  # J,d
-        J = slot_e.size(0)
+        J = self.slot_embed_idx.size(0)
 
         all_point_outputs = torch.zeros(batch_size, J, max_len, self.vocab_size).to(
             input_ids.device
         )
         
         # Parallel Decoding
-        w = slot_e.repeat(batch_size, 1).unsqueeze(1)
-        hidden = hidden.repeat_interleave(J, dim=1)
-        encoder_output = encoder_output.repeat_interleave(J, dim=0)
-        input_ids = input_ids.repeat_interleave(J, dim=0)
-        input_masks = input_masks.repeat_interleave(J, dim=0)
+        w, hidden, encoder_output, input_ids, input_masks = self._expand_slots(
+            input_ids, encoder_output, hidden, input_masks
+        )
         for k in range(max_len):
-            w = self.dropout(w)
-            _, hidden = self.gru(w, hidden)  # 1,B,D
-
-            # B,T,D * B,D,1 => B,T
-            attn_e = torch.bmm(encoder_output, hidden.permute(1, 2, 0))  # B,T,1
-            attn_e = attn_e.squeeze(-1).masked_fill(input_masks, -1e9)
-            attn_history = F.softmax(attn_e, -1)  # B,T
-
-            if self.proj_layer:
-                hidden_proj = torch.matmul(hidden, self.proj_layer.weight)
-            else:
-                hidden_proj = hidden
-
-            # B,D * D,V => B,V
-            attn_v = torch.matmul(
-                hidden_proj.squeeze(0), self.embed.weight.transpose(0, 1)
-            )  # B,V
-            attn_vocab = F.softmax(attn_v, -1)
-
-            # B,1,T * B,T,D => B,1,D
-            context = torch.bmm(attn_history.unsqueeze(1), encoder_output)  # B,1,D
-            p_gen = self.sigmoid(
-                self.w_gen(torch.cat([w, hidden.transpose(0, 1), context], -1))
-            )  # B,1
-            p_gen = p_gen.squeeze(-1)
-
-            p_context_ptr = torch.zeros_like(attn_vocab).to(input_ids.device)
-            p_context_ptr.scatter_add_(1, input_ids, attn_history)  # copy B,V
-            p_final = p_gen * attn_vocab + (1 - p_gen) * p_context_ptr  # B,V
+            p_final, hidden, context = self._decode_step(
+                w, hidden, encoder_output, input_ids, input_masks
+            )
             _, w_idx = p_final.max(-1)
 
             if teacher is not None:
@@ -207,3 +240,27 @@ class SlotGenerator(nn.Module):
             all_point_outputs[:, :, k, :] = p_final.view(batch_size, J, self.vocab_size)
 
         return all_point_outputs, all_gate_outputs
+
+    def greedy_decode(self, input_ids, encoder_output, hidden, input_masks, max_len):
+        """teacher 없이 generate한 token id (B,J,max_len)와 gate logit (B,J,n_gate)만 반환
+
+        forward와 같은 결과지만 B,J,max_len,V 확률 tensor를 만들지 않는다 (inference / export용).
+        """
+        input_masks = input_masks.ne(1)
+        batch_size = encoder_output.size(0)
+        J = self.slot_embed_idx.size(0)
+
+        w, hidden, encoder_output, input_ids, input_masks = self._expand_slots(
+            input_ids, encoder_output, hidden, input_masks
+        )
+        point_ids = []
+        for k in range(max_len):
+            p_final, hidden, context = self._decode_step(
+                w, hidden, encoder_output, input_ids, input_masks
+            )
+            _, w_idx = p_final.max(-1)
+            w = self.embedding(w_idx).unsqueeze(1)
+            if k == 0:
+                gate_logits = self.w_gate(context.squeeze(1)).view(batch_size, J, self.n_gate)
+            point_ids.append(w_idx.view(batch_size, J))
+        return torch.stack(point_ids, -1), gate_logits
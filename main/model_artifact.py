@@ -0,0 +1,266 @@
+"""TRADE 단일 파일 artifact (export / load)
+
+inference에 필요한 것을 한 파일에 묶는다: config, slot_meta, tokenized_slot_meta, tokenizer vocab / special token, weight.
+weight는 64 byte 단위로 정렬된 raw tensor로 저장하고 load할 때 np.memmap으로 복사 없이 바로 parameter로 쓴다.
+(실제로 접근한 page만 disk에서 읽히고, 여러 worker가 같은 파일을 load하면 page cache를 공유한다)
+
+파일 구조: MAGIC (8 byte) | header 길이 (8 byte, little endian) | header (json) | padding | tensor data ...
+
+    python model_artifact.py export --model_dir results --checkpoint model-29.bin --output results/trade.dst
+    python model_artifact.py bench --artifact results/trade.dst --model_dir results --checkpoint model-29.bin
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import reduce
+
+import numpy as np
+import torch
+import torch.nn as nn
+from transformers import BertTokenizer
+
+from model import TRADE
+
+MAGIC = b"DSTPACK1"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# tokenizer init kwargs 중 artifact에 저장하지 않는 것 (파일 경로 등)
+TOKENIZER_SKIP_KWARGS = {"vocab_file", "name_or_path", "model_max_length", "special_tokens_map_file"}
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def tokenizer_to_dict(tokenizer):
+    vocab = sorted(tokenizer.vocab.items(), key=lambda x: x[1])
+    added = sorted(tokenizer.added_tokens_encoder.items(), key=lambda x: x[1])
+    init_kwargs = {
+        k: v for k, v in tokenizer.init_kwargs.items()
+        if k not in TOKENIZER_SKIP_KWARGS and isinstance(v, (str, int, float, bool, list))
+    }
+    return {
+        # vocab 파일에 중복 줄이 있으면 id에 빈 곳이 생기므로 줄 위치가 아니라 (token, id)로 저장
+        "vocab": [[token, i] for token, i in vocab],
+        "init_kwargs": init_kwargs,
+        "added_tokens": [token for token, _ in added],
+        "additional_special_tokens": tokenizer.additional_special_tokens,
+    }
+
+
+def _vocab_lines(vocab):
+    """(token, id) -> id 번째 줄에 token이 오는 vocab 파일의 줄
+
+    빈 id (원래 파일의 중복 줄)는 바로 뒤에 나오는 token으로 채운다. load_vocab은 같은 token이면 마지막 줄 번호를
+    쓰므로 채운 줄은 덮어써지고, 원래 tokenizer와 같은 token -> id가 된다.
+    이전 artifact의 token list (줄 위치 = id)도 그대로 읽는다.
+    """
+    if vocab and isinstance(vocab[0], str):
+        return list(vocab)
+    lines = [None] * (max(i for _, i in vocab) + 1)
+    for token, i in vocab:
+        lines[i] = token
+    for i in range(len(lines) - 2, -1, -1):
+        if lines[i] is None:
+            lines[i] = lines[i + 1]
+    return lines
+
+
+def tokenizer_from_dict(spec):
+    # BertTokenizer는 vocab 파일 경로만 받으므로 임시 파일로 쓰고 바로 지운다
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8", delete=False) as f:
+        f.write("\n".join(_vocab_lines(spec["vocab"])) + "\n")
+    try:
+        tokenizer = BertTokenizer(f.name, **spec["init_kwargs"])
+    finally:
+        os.remove(f.name)
+    # 추가된 token은 원래 id 순서대로 다시 추가해야 id가 같아진다
+    special = set(spec["additional_special_tokens"])
+    for token in spec["added_tokens"]:
+        tokenizer.add_tokens([token], special_tokens=token in special)
+    tokenizer.additional_special_tokens = spec["additional_special_tokens"]
+    return tokenizer
+
+
+def export_artifact(path, model, config, slot_meta, tokenizer, tokenized_slot_meta):
+    """model weight와 inference에 필요한 메타 정보를 하나의 파일로 저장"""
+    tokenizer_spec = tokenizer_to_dict(tokenizer)
+    # load 했을 때 token id가 하나라도 밀리면 embedding row와 어긋나서 prediction이 조용히 틀어진다
+    reloaded = tokenizer_from_dict(tokenizer_spec)
+    if dict(reloaded.vocab) != dict(tokenizer.vocab):  # load_vocab 순서는 중복 줄에 따라 다를 수 있어 dict로 비교
+        raise ValueError("tokenizer vocab does not survive the artifact round trip")
+    if reloaded.added_tokens_encoder != tokenizer.added_tokens_encoder:
+        raise ValueError("added token ids do not survive the artifact round trip")
+
+    tensors, aliases, offsets, seen = {}, {}, {}, {}
+    data_offset = 0
+    for name, tensor in model.state_dict(keep_vars=False).items():
+        key = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape))
+        # tie_weight로 공유된 weight (encoder / decoder embedding 등)는 한 번만 저장
+        if key in seen:
+            aliases[name] = seen[key]
+            continue
+        seen[key] = name
+        array = tensor.detach().cpu().contiguous().numpy()
+        tensors[name] = array
+        offsets[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": data_offset,
+            "nbytes": array.nbytes,
+        }
+        data_offset = _align(data_offset + array.nbytes)
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "model_type": "trade",
+        "config": {k: v for k, v in vars(config).items() if isinstance(v, (str, int, float, bool, list, type(None)))},
+        "slot_meta": slot_meta,
+        "tokenized_slot_meta": tokenized_slot_meta,
+        "tokenizer": tokenizer_spec,
+        "tensors": offsets,
+        "aliases": aliases,
+    }
+    header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in tensors.items():
+            f.seek(data_start + offsets[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + data_offset)
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a DST model artifact")
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"unsupported artifact version {header['format_version']}")
+    header["data_start"] = _align(len(MAGIC) + 8 + header_len)
+    return header
+
+
+def load_tensors(path, header):
+    """weight를 memmap view로 반환 (copy-on-write라 in-place 연산을 해도 파일은 바뀌지 않는다)"""
+    buffer = np.memmap(path, dtype=np.uint8, mode="c")
+    tensors = {}
+    for name, meta in header["tensors"].items():
+        start = header["data_start"] + meta["offset"]
+        array = buffer[start: start + meta["nbytes"]].view(np.dtype(meta["dtype"])).reshape(meta["shape"])
+        tensors[name] = torch.from_numpy(array)
+    for name, source in header["aliases"].items():
+        tensors[name] = tensors[source]
+    return tensors
+
+
+def _assign(model, name, tensor, params):
+    module_name, _, attr = name.rpartition(".")
+    module = reduce(getattr, module_name.split("."), model) if module_name else model
+    if attr in module._parameters:
+        # 같은 tensor를 공유하는 parameter는 같은 nn.Parameter 객체로 (tie_weight 유지)
+        if tensor.data_ptr() not in params:
+            params[tensor.data_ptr()] = nn.Parameter(tensor, requires_grad=False)
+        setattr(module, attr, params[tensor.data_ptr()])
+    else:
+        module._buffers[attr] = tensor
+
+
+@contextmanager
+def skip_init():
+    """module 생성 시 random init (torch.nn.init.*_)을 건너뛴다
+
+    parameter는 torch.empty로 할당만 되고 (page를 건드리지 않음) 바로 artifact tensor로 교체된다.
+    torch 1.7에는 meta device / nn.utils.skip_init이 없어서 init 함수를 잠시 no-op으로 바꾼다.
+    """
+    names = [name for name in dir(nn.init) if name.endswith("_") and not name.startswith("_")]
+    originals = {name: getattr(nn.init, name) for name in names}
+    for name in names:
+        setattr(nn.init, name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        yield
+    finally:
+        for name, fn in originals.items():
+            setattr(nn.init, name, fn)
+
+
+def load_artifact(path, device="cpu", init_weights=False):
+    """artifact에서 (model, processor 생성에 필요한 tokenizer, slot_meta, config) 반환
+
+    state_dict를 load_state_dict로 복사하지 않고 memmap tensor를 parameter로 그대로 쓴다.
+    어차피 덮어쓸 weight라 random init은 건너뛴다 (init_weights=True면 기존처럼 init, bench 비교용).
+    device가 cpu가 아니면 그때 한 번 복사된다.
+    """
+    header = read_header(path)
+    config = argparse.Namespace(**header["config"])
+    tokenizer = tokenizer_from_dict(header["tokenizer"])
+
+    tokenized_slot_meta = [list(idx) for idx in header["tokenized_slot_meta"]]
+    if init_weights:
+        model = TRADE(config, tokenized_slot_meta)
+    else:
+        with skip_init():
+            model = TRADE(config, tokenized_slot_meta)
+    tensors = load_tensors(path, header)
+    # init을 건너뛰었으므로 artifact에 없는 weight가 남으면 안 된다
+    missing = set(model.state_dict()) - set(tensors)
+    if missing:
+        raise ValueError(f"artifact {path} has no tensors for {sorted(missing)}")
+    params = {}
+    for name, tensor in tensors.items():
+        _assign(model, name, tensor, params)
+    model.to(device)
+    model.eval()
+    return model, tokenizer, header["slot_meta"], config
+
+
+def load_legacy(model_dir, checkpoint, device="cpu"):
+    """기존 inference.py 방식 (exp_config.json + slot_meta.json + tokenizer + torch.load)"""
+    config = argparse.Namespace(**json.load(open(f"{model_dir}/exp_config.json", "r")))
+    slot_meta = json.load(open(f"{model_dir}/slot_meta.json", "r"))
+    tokenizer = BertTokenizer.from_pretrained(config.model_name_or_path)
+    tokenized_slot_meta = [
+        tokenizer.encode(slot.replace("-", " "), add_special_tokens=False) for slot in slot_meta
+    ]
+    model = TRADE(config, tokenized_slot_meta)
+    model.load_state_dict(torch.load(os.path.join(model_dir, checkpoint), map_location="cpu"))
+    model.to(device)
+    model.eval()
+    return model, tokenizer, slot_meta, config, tokenized_slot_meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["export", "bench"])
+    parser.add_argument("--model_dir", type=str, default=None, help="exp_config.json / slot_meta.json이 있는 경로")
+    parser.add_argument("--checkpoint", type=str, default=None, help="model_dir 안의 state dict (model-{epoch}.bin)")
+    parser.add_argument("--output", type=str, default=None, help="export할 artifact 경로")
+    parser.add_argument("--artifact", type=str, default=None, help="bench할 artifact 경로")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        model, tokenizer, slot_meta, config, tokenized_slot_meta = load_legacy(args.model_dir, args.checkpoint)
+        export_artifact(args.output, model, config, slot_meta, tokenizer, tokenized_slot_meta)
+        print(f"Exported to {args.output} ({os.path.getsize(args.output) / 2 ** 20:.1f}MB)")
+    else:
+        start = time.perf_counter()
+        load_artifact(args.artifact, args.device)
+        print(f"artifact load:             {time.perf_counter() - start:.3f}s")
+        start = time.perf_counter()
+        load_artifact(args.artifact, args.device, init_weights=True)
+        print(f"artifact load (with init): {time.perf_counter() - start:.3f}s")
+        if args.model_dir:
+            start = time.perf_counter()
+            load_legacy(args.model_dir, args.checkpoint, args.device)
+            print(f"legacy load:               {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,87 @@
+"""fp32 vs dynamic int8 TRADE 비교 (dev split)
+
+train.py와 같은 seed로 dev split을 만들고 두 model로 같은 inference()를 돌려서
+joint goal accuracy, latency, throughput, model 크기를 비교한다.
+
+    python quantize_eval.py --data_dir data/train_dataset --model_dir results --checkpoint model-29.bin
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+from torch.utils.data import DataLoader, SequentialSampler
+
+from data_utils import WOSDataset, get_examples_from_dialogues, load_dataset, set_seed
+from evaluation import _evaluation
+from inference import inference
+from model_artifact import load_artifact, load_legacy
+from preprocessor import TRADEPreprocessor
+# dynamic int8 quantization은 repo root의 quantization.py 하나를 같이 쓴다
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from quantization import model_size_mb, quantize_dynamic_int8
+from train_utils import select_eval_dialogues
+
+
+def run(model, eval_loader, processor, dev_labels, slot_meta):
+    start = time.perf_counter()
+    predictions = inference(model, eval_loader, processor, torch.device("cpu"))
+    elapsed = time.perf_counter() - start
+    result = _evaluation(predictions, dev_labels, slot_meta)
+    return {
+        "joint_goal_accuracy": result["joint_goal_accuracy"],
+        "turn_slot_f1": result["turn_slot_f1"],
+        "latency_ms_per_batch": elapsed / len(eval_loader) * 1000,
+        "turns_per_sec": len(predictions) / elapsed,
+        "model_size_mb": model_size_mb(model),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data/train_dataset")
+    parser.add_argument("--model_dir", type=str, default=None, help="exp_config.json / slot_meta.json이 있는 경로")
+    parser.add_argument("--checkpoint", type=str, default=None, help="model_dir 안의 state dict (model-{epoch}.bin)")
+    parser.add_argument("--artifact", type=str, default=None, help="model_artifact.py로 export한 파일 (model_dir 대신)")
+    parser.add_argument("--random_seed", type=int, default=42, help="train.py와 같아야 같은 dev split")
+    parser.add_argument("--eval_batch_size", type=int, default=32)
+    parser.add_argument("--eval_subset", type=int, default=None, help="dev set에서 이 수만큼의 dialogue만 사용")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--max_jga_drop", type=float, default=0.01, help="허용하는 joint goal accuracy 하락 폭")
+    parser.add_argument("--output", type=str, default=None, help="결과 json 경로")
+    args = parser.parse_args()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+
+    set_seed(args.random_seed)
+    _, dev_data, dev_labels = load_dataset(f"{args.data_dir}/train_dials.json")
+    if args.artifact:
+        model, tokenizer, slot_meta, _ = load_artifact(args.artifact)
+    else:
+        model, tokenizer, slot_meta, _, _ = load_legacy(args.model_dir, args.checkpoint)
+    processor = TRADEPreprocessor(slot_meta, tokenizer)
+
+    dev_examples = get_examples_from_dialogues(dev_data, user_first=False, dialogue_level=False)
+    dev_examples = select_eval_dialogues(dev_examples, args.eval_subset, args.random_seed)
+    dev_labels = {e.guid: dev_labels[e.guid] for e in dev_examples}
+    eval_data = WOSDataset(processor.convert_examples_to_features(dev_examples))
+    eval_loader = DataLoader(
+        eval_data,
+        batch_size=args.eval_batch_size,
+        sampler=SequentialSampler(eval_data),
+        collate_fn=processor.collate_fn,
+    )
+    print("# dev:", len(eval_data))
+
+    results = {"fp32": run(model, eval_loader, processor, dev_labels, slot_meta)}
+    results["int8"] = run(quantize_dynamic_int8(model), eval_loader, processor, dev_labels, slot_meta)
+    results["delta"] = {k: results["int8"][k] - results["fp32"][k] for k in results["fp32"]}
+
+    for k in results["fp32"]:
+        print(f"{k:<22} fp32 {results['fp32'][k]:>10.4f}  int8 {results['int8'][k]:>10.4f}  delta {results['delta'][k]:>+10.4f}")
+    if args.output:
+        json.dump(results, open(args.output, "w"), indent=2)
+    if -results["delta"]["joint_goal_accuracy"] > args.max_jga_drop:
+        raise SystemExit(f"joint goal accuracy dropped by more than {args.max_jga_drop}")
@@ -0,0 +1,242 @@
+"""WOS 형식의 synthetic dialogue 생성기 (scale / load test, 실제 data 없는 CI용)
+
+생성되는 파일은 실제 WOS와 같은 schema를 따른다.
+    train_dials.json: [{"dialogue_idx", "domains", "dialogue": [{"role", "text", "state"}, ...]}, ...]
+    slot_meta.json:   ["관광-경치 좋은", ...]
+    ontology.json:    {"관광-경치 좋은": ["none", "dontcare", ...], ...}
+
+slot meta / ontology를 주면 그 slot과 value로, 주지 않으면 synthetic domain / slot / value로 만든다.
+
+    # 실제 schema로 10배 크기
+    python synthetic_data.py --slot_meta data/train_dataset/slot_meta.json \
+        --ontology data/train_dataset/ontology.json --num_dialogues 70000 --output_dir data/synthetic
+
+    # data 없이
+    python synthetic_data.py --num_dialogues 500 --output_dir data/synthetic
+"""
+import argparse
+import json
+import os
+import random
+from collections import defaultdict
+
+SPECIAL_VALUES = ("none", "dontcare")
+# SOMDSTPreprocessor.domain2id처럼 domain 이름을 가정하는 코드가 있어서 실제 WOS domain 이름을 먼저 쓴다
+WOS_DOMAINS = ["관광", "숙소", "식당", "지하철", "택시"]
+FILLER_WORDS = [
+    "혹시", "그럼", "그리고", "좀", "알려주세요", "찾고", "있어요", "괜찮은", "곳으로", "부탁드려요",
+    "네", "감사합니다", "예약", "가능한가요", "어디", "있을까요", "좋아요", "그걸로", "할게요", "추천",
+    "해주실", "수", "있나요", "가격대는", "상관없어요", "위치가", "어떻게", "되나요", "시간", "정도",
+]
+SYSTEM_WORDS = [
+    "네", "고객님", "말씀하신", "조건으로", "찾아보겠습니다", "확인", "결과", "있습니다", "어떠신가요",
+    "예약", "도와드릴까요", "추가로", "필요하신", "것", "있으신가요", "잠시만", "기다려주세요",
+]
+
+
+def build_schema(num_domains=5, slots_per_domain=8, values_per_slot=20):
+    """slot meta / ontology가 없을 때 쓰는 synthetic schema"""
+    slot_meta, ontology = [], {}
+    for d in range(num_domains):
+        domain = WOS_DOMAINS[d] if d < len(WOS_DOMAINS) else f"도메인{d}"
+        for s in range(slots_per_domain):
+            slot = f"{domain}-슬롯{s}"
+            slot_meta.append(slot)
+            ontology[slot] = list(SPECIAL_VALUES) + [f"값{d}_{s}_{v}" for v in range(values_per_slot)]
+    return slot_meta, ontology
+
+
+def parse_weights(text, n):
+    """"0.3,0.4,0.3" 형식. 부족한 자리는 0"""
+    weights = [float(w) for w in text.split(",")] if text else [1.0]
+    return (weights + [0.0] * n)[:n]
+
+
+class SyntheticDialogueGenerator:
+    """cumulative state를 가진 WOS 형식 dialogue 생성
+
+    num_domains_weights: dialogue 당 domain 개수 (1, 2, 3, ...)의 비율
+    domain_weights: domain별 등장 비율 (기본: 균등)
+    min_turns / max_turns: dialogue 당 user turn 수
+    min_words / max_words: utterance 당 단어 수 (slot value 제외)
+    state_change_rate: user turn에서 state가 바뀌는 확률
+    new_slot_rate: state가 바뀔 때 새 slot을 채우는 확률 (나머지는 기존 slot의 value 변경)
+    dontcare_rate: 채우는 value가 dontcare일 확률
+    """
+
+    def __init__(
+        self,
+        slot_meta,
+        ontology,
+        num_domains_weights=(0.3, 0.4, 0.3),
+        domain_weights=None,
+        min_turns=3,
+        max_turns=10,
+        min_words=5,
+        max_words=20,
+        state_change_rate=0.7,
+        new_slot_rate=0.8,
+        dontcare_rate=0.05,
+        seed=42,
+    ):
+        self.slot_meta = slot_meta
+        self.domain_slots = defaultdict(list)
+        for slot in slot_meta:
+            self.domain_slots[slot.split("-")[0]].append(slot)
+        self.domains = list(self.domain_slots)
+        self.values = {
+            slot: [v for v in ontology.get(slot, []) if v not in SPECIAL_VALUES] or [f"{slot.split('-')[1]}값"]
+            for slot in slot_meta
+        }
+        self.num_domains_weights = list(num_domains_weights)[: len(self.domains)]
+        self.domain_weights = domain_weights or [1.0] * len(self.domains)
+        self.min_turns = min_turns
+        self.max_turns = max_turns
+        self.min_words = min_words
+        self.max_words = max_words
+        self.state_change_rate = state_change_rate
+        self.new_slot_rate = new_slot_rate
+        self.dontcare_rate = dontcare_rate
+        self.rng = random.Random(seed)
+
+    def _sample_domains(self):
+        num_domains = self.rng.choices(
+            range(1, len(self.num_domains_weights) + 1), weights=self.num_domains_weights
+        )[0]
+        domains = []
+        candidates = list(zip(self.domains, self.domain_weights))
+        for _ in range(num_domains):
+            names, weights = zip(*candidates)
+            domain = self.rng.choices(names, weights=weights)[0]
+            domains.append(domain)
+            candidates = [(d, w) for d, w in candidates if d != domain]
+        return domains
+
+    def _words(self, vocab):
+        return self.rng.choices(vocab, k=self.rng.randint(self.min_words, self.max_words))
+
+    def _utterance(self, vocab, values):
+        words = self._words(vocab)
+        for value in values:
+            words.insert(self.rng.randint(0, len(words)), value)
+        return " ".join(words)
+
+    def _update_state(self, state, domain, force=False):
+        """state (slot -> value)를 바꾸고, utterance에 들어갈 value 목록 반환"""
+        if not force and self.rng.random() >= self.state_change_rate:
+            return []
+        empty = [s for s in self.domain_slots[domain] if s not in state]
+        filled = [s for s in self.domain_slots[domain] if s in state]
+        if empty and (not filled or self.rng.random() < self.new_slot_rate):
+            slot = self.rng.choice(empty)
+        elif filled:
+            slot = self.rng.choice(filled)
+        else:
+            return []
+        if self.rng.random() < self.dontcare_rate:
+            state[slot] = "dontcare"
+            return []
+        state[slot] = self.rng.choice(self.values[slot])
+        return [state[slot]]
+
+    def generate_dialogue(self, idx, with_state=True):
+        domains = self._sample_domains()
+        num_turns = self.rng.randint(max(self.min_turns, len(domains)), max(self.max_turns, len(domains)))
+        # 앞에서부터 domain을 하나씩 다룬다
+        boundaries = sorted(self.rng.sample(range(1, num_turns), len(domains) - 1))
+
+        state, turns = {}, []
+        for t in range(num_turns):
+            domain = domains[sum(t >= b for b in boundaries)]
+            # domain이 시작되는 turn에서는 항상 slot을 채운다 (실제 WOS처럼 첫 발화에 요청 조건이 있음)
+            mentioned = self._update_state(state, domain, force=t == 0 or t in boundaries)
+            user_turn = {"role": "user", "text": self._utterance(FILLER_WORDS, mentioned)}
+            if with_state:
+                user_turn["state"] = [f"{slot}-{value}" for slot, value in state.items()]
+            turns.append(user_turn)
+            turns.append({"role": "sys", "text": self._utterance(SYSTEM_WORDS, [])})
+        return {
+            "dialogue_idx": f"synthetic-{idx}:{'_'.join(domains)}_{idx}",
+            "domains": domains,
+            "dialogue": turns,
+        }
+
+    def generate(self, num_dialogues, with_state=True):
+        return [self.generate_dialogue(i, with_state) for i in range(num_dialogues)]
+
+
+def check_dev_split(data, dev_split=0.1):
+    """load_dataset은 domain 개수별로 같은 수의 dev dialogue를 뽑으므로 그룹이 너무 작으면 실패한다"""
+    counts = defaultdict(int)
+    for d in data:
+        counts[len(d["domains"])] += 1
+    num_per_group = int(int(len(data) * dev_split) / 3)
+    small = {k: v for k, v in counts.items() if v < num_per_group}
+    if small:
+        print(
+            f"Warning: load_dataset needs {num_per_group} dialogues per domain count, "
+            f"but got {dict(small)}. Increase --num_dialogues or adjust --num_domains_weights"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output_dir", type=str, default="data/synthetic")
+    parser.add_argument("--slot_meta", type=str, default=None, help="slot_meta.json (없으면 synthetic schema)")
+    parser.add_argument("--ontology", type=str, default=None, help="slot별 value 목록 (ontology.json)")
+    parser.add_argument("--num_dialogues", type=int, default=7000)
+    parser.add_argument("--num_domains_weights", type=str, default="0.3,0.4,0.3",
+                        help="dialogue 당 domain 개수 1, 2, 3...의 비율")
+    parser.add_argument("--domain_weights", type=str, default=None,
+                        help="domain별 비율 (slot meta의 domain 순서, 기본: 균등)")
+    parser.add_argument("--min_turns", type=int, default=3, help="dialogue 당 최소 user turn 수")
+    parser.add_argument("--max_turns", type=int, default=10, help="dialogue 당 최대 user turn 수")
+    parser.add_argument("--min_words", type=int, default=5, help="utterance 당 최소 단어 수")
+    parser.add_argument("--max_words", type=int, default=20, help="utterance 당 최대 단어 수")
+    parser.add_argument("--state_change_rate", type=float, default=0.7)
+    parser.add_argument("--new_slot_rate", type=float, default=0.8)
+    parser.add_argument("--dontcare_rate", type=float, default=0.05)
+    parser.add_argument("--num_domains", type=int, default=5, help="synthetic schema의 domain 수")
+    parser.add_argument("--slots_per_domain", type=int, default=8, help="synthetic schema의 domain 당 slot 수")
+    parser.add_argument("--values_per_slot", type=int, default=20, help="synthetic schema의 slot 당 value 수")
+    parser.add_argument("--eval_file", type=str, default=None,
+                        help="지정하면 state 없는 평가용 dialogue도 이 이름으로 저장 (예: eval_dials.json)")
+    parser.add_argument("--num_eval_dialogues", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.slot_meta:
+        slot_meta = json.load(open(args.slot_meta))
+        ontology = json.load(open(args.ontology)) if args.ontology else {}
+        # value 목록이 없는 slot도 ontology에는 none / dontcare가 있어야 한다
+        ontology = {s: ontology.get(s, list(SPECIAL_VALUES)) for s in slot_meta}
+    else:
+        slot_meta, ontology = build_schema(args.num_domains, args.slots_per_domain, args.values_per_slot)
+
+    generator = SyntheticDialogueGenerator(
+        slot_meta,
+        ontology,
+        num_domains_weights=parse_weights(args.num_domains_weights, len({s.split("-")[0] for s in slot_meta})),
+        domain_weights=[float(w) for w in args.domain_weights.split(",")] if args.domain_weights else None,
+        min_turns=args.min_turns,
+        max_turns=args.max_turns,
+        min_words=args.min_words,
+        max_words=args.max_words,
+        state_change_rate=args.state_change_rate,
+        new_slot_rate=args.new_slot_rate,
+        dontcare_rate=args.dontcare_rate,
+        seed=args.seed,
+    )
+    data = generator.generate(args.num_dialogues)
+    check_dev_split(data)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    json.dump(data, open(f"{args.output_dir}/train_dials.json", "w"), indent=2, ensure_ascii=False)
+    json.dump(slot_meta, open(f"{args.output_dir}/slot_meta.json", "w"), indent=2, ensure_ascii=False)
+    json.dump(ontology, open(f"{args.output_dir}/ontology.json", "w"), indent=2, ensure_ascii=False)
+    if args.eval_file:
+        eval_data = generator.generate(args.num_eval_dialogues, with_state=False)
+        json.dump(eval_data, open(f"{args.output_dir}/{args.eval_file}", "w"), indent=2, ensure_ascii=False)
+
+    num_turns = sum(len(d["dialogue"]) // 2 for d in data)
+    print(f"{len(data)} dialogues, {num_turns} user turns are saved to {args.output_dir}")
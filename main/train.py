@@ -2,10 +2,12 @@ import argparse
 import json
 import os
 import random
+import time
+from functools import partial
 
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
+from torch.utils.data import DataLoader, SequentialSampler
 from tqdm import tqdm
 from transformers import AdamW, BertTokenizer, get_linear_schedule_with_warmup
 
@@ -16,8 +18,46 @@ from evaluation import _evaluation
 from inference import inference
 from model import TRADE, masked_cross_entropy_for_value
 from preprocessor import TRADEPreprocessor
+from train_utils import (BackgroundEvaluator, CheckpointManager, ResumableSampler,
+                         StepProfiler, TrainingEngine, all_reduce_sum, barrier,
+                         init_distributed, is_main_process, load_checkpoint,
+                         select_eval_dialogues, unwrap_model, wrap_distributed)
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+_eval_model = None
+
+
+def evaluate_checkpoint(model_path, args, tokenized_slot_meta, processor, eval_features, eval_labels, slot_meta,
+                        device="cpu"):
+    """background evaluation process에서 저장된 model-{epoch}.bin을 dev set으로 평가"""
+    global _eval_model
+    if _eval_model is None:
+        _eval_model = TRADE(args, tokenized_slot_meta).to(device)
+    _eval_model.load_state_dict(torch.load(model_path, map_location=device))
+
+    eval_data = WOSDataset(eval_features)
+    eval_loader = DataLoader(
+        eval_data,
+        batch_size=args.eval_batch_size,
+        sampler=SequentialSampler(eval_data),
+        collate_fn=processor.collate_fn,
+    )
+    predictions = inference(_eval_model, eval_loader, processor, device)
+    return _evaluation(predictions, eval_labels, slot_meta)
+
+
+def report_evaluation(epoch, eval_result, best_score, best_checkpoint):
+    """evaluation 결과를 출력하고 best checkpoint 갱신 (출력은 rank 0만)"""
+    if is_main_process():
+        print(f"Evaluation of epoch {epoch}")
+        for k, v in eval_result.items():
+            print(f"{k}: {v}")
+    if best_score < eval_result['joint_goal_accuracy']:
+        if is_main_process():
+            print("Update Best checkpoint!")
+        best_score = eval_result['joint_goal_accuracy']
+        best_checkpoint = epoch
+    return best_score, best_checkpoint
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -50,12 +90,35 @@ if __name__ == "__main__":
     parser.add_argument("--proj_dim", type=int,
                         help="만약 지정되면 기존의 hidden_size는 embedding dimension으로 취급되고, proj_dim이 GRU의 hidden_size로 사용됨. hidden_size보다 작아야 함.", default=None)
     parser.add_argument("--teacher_forcing_ratio", type=float, default=0.5)
+    parser.add_argument("--amp", action="store_true", help="GPU에서는 fp16, CPU에서는 bfloat16 autocast")
+    parser.add_argument("--gradient_accumulation_steps", type=int, default=1)
+    parser.add_argument("--max_steps", type=int, default=None, help="epoch당 최대 step 수 (throughput 측정용)")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="학습 state checkpoint 경로 또는 latest ({model_dir}/checkpoints의 최근 checkpoint)")
+    parser.add_argument("--save_steps", type=int, default=None, help="epoch 중간에도 N step마다 학습 state 저장")
+    parser.add_argument("--keep_best", type=int, default=3, help="joint goal accuracy 상위 몇 개의 checkpoint를 남길지")
+    parser.add_argument("--keep_last", type=int, default=2, help="최근 몇 개의 checkpoint를 남길지")
+    parser.add_argument("--eval_every", type=int, default=1, help="N epoch마다 dev set evaluation")
+    parser.add_argument("--eval_subset", type=int, default=None, help="evaluation에 쓸 dev dialogue 수 (기본: 전체)")
+    parser.add_argument("--eval_threads", type=int, default=2, help="background evaluation process의 thread 수")
+    parser.add_argument("--eval_device", type=str, default="cpu", help="background evaluation process의 device")
+    parser.add_argument("--sync_eval", action="store_true",
+                        help="evaluation을 background process가 아니라 학습 loop 안에서 실행")
+    parser.add_argument("--profile", action="store_true",
+                        help="step의 phase별 시간, throughput, peak memory를 tensorboard ({model_dir})에 기록")
+    parser.add_argument("--profile_log_steps", type=int, default=50, help="profile 결과를 몇 step마다 기록할지")
+    parser.add_argument("--trace_steps", type=int, default=0, help="N step 동안 chrome trace ({model_dir}/trace.json) 저장")
+    parser.add_argument("--trace_start", type=int, default=10, help="chrome trace를 시작할 step (warmup 이후)")
     args = parser.parse_args()
+
+    # launch.py로 실행하면 gloo backend로 여러 process가 하나의 model을 학습
+    rank, world_size = init_distributed()
     
     # args.data_dir = os.environ['SM_CHANNEL_TRAIN']
     # args.model_dir = os.environ['SM_MODEL_DIR']
-    print(args.data_dir)
-    print(args.model_dir)
+    if is_main_process():
+        print(args.data_dir)
+        print(args.model_dir)
 
     # random seed 고정
     set_seed(args.random_seed)
@@ -92,20 +155,45 @@ if __name__ == "__main__":
     # Model 선언
     model = TRADE(args, tokenized_slot_meta)
     model.set_subword_embedding(args.model_name_or_path)  # Subword Embedding 초기화
-    print(f"Subword Embeddings is loaded from {args.model_name_or_path}")
     model.to(device)
-    print("Model is initialized")
+    model = wrap_distributed(model)
+    if is_main_process():
+        print(f"Subword Embeddings is loaded from {args.model_name_or_path}")
+        print("Model is initialized")
+
+    # step의 phase별 시간 측정 (--profile) / chrome trace (--trace_steps)
+    profile_logger = None
+    profile_enabled = (args.profile or args.trace_steps > 0) and is_main_process()
+    if profile_enabled:
+        from torch.utils.tensorboard import SummaryWriter
+
+        profile_logger = SummaryWriter(log_dir=args.model_dir)
+    profiler = StepProfiler(
+        enabled=profile_enabled,
+        device=device,
+        logger=profile_logger,
+        log_every=args.profile_log_steps,
+        trace_path=f"{args.model_dir}/trace.json",
+        trace_start=args.trace_start,
+        trace_steps=args.trace_steps,
+    )
+    profiler.attach(unwrap_model(model).encoder, "encoder")
+    profiler.attach(unwrap_model(model).decoder, "decoder")
 
     train_data = WOSDataset(train_features)
-    train_sampler = RandomSampler(train_data)
+    train_sampler = ResumableSampler(train_data, seed=args.random_seed)
     train_loader = DataLoader(
         train_data,
         batch_size=args.train_batch_size,
         sampler=train_sampler,
-        collate_fn=processor.collate_fn,
+        collate_fn=profiler.wrap(processor.collate_fn, "collate"),
     )
-    print("# train:", len(train_data))
+    if is_main_process():
+        print("# train:", len(train_data))
 
+    # dev set 일부만으로 evaluation (dialogue 단위로 선택)
+    dev_features = select_eval_dialogues(dev_features, args.eval_subset, args.random_seed)
+    dev_labels = {f.guid: dev_labels[f.guid] for f in dev_features}
     dev_data = WOSDataset(dev_features)
     dev_sampler = SequentialSampler(dev_data)
     dev_loader = DataLoader(
@@ -114,44 +202,104 @@ if __name__ == "__main__":
         sampler=dev_sampler,
         collate_fn=processor.collate_fn,
     )
-    print("# dev:", len(dev_data))
+    if is_main_process():
+        print("# dev:", len(dev_data))
     
     # Optimizer 및 Scheduler 선언
     n_epochs = args.num_train_epochs
-    t_total = len(train_loader) * n_epochs
+    t_total = len(train_loader) * n_epochs // args.gradient_accumulation_steps
     warmup_steps = int(t_total * args.warmup_ratio)
     optimizer = AdamW(model.parameters(), lr=args.learning_rate, eps=args.adam_epsilon)
     scheduler = get_linear_schedule_with_warmup(
         optimizer, num_warmup_steps=warmup_steps, num_training_steps=t_total
     )
 
+    engine = TrainingEngine(
+        model,
+        optimizer,
+        scheduler,
+        device=device,
+        use_amp=args.amp,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        max_grad_norm=args.max_grad_norm,
+    )
+    engine.profiler = profiler
+
     loss_fnc_1 = masked_cross_entropy_for_value  # generation
     loss_fnc_2 = nn.CrossEntropyLoss()  # gating
 
-    if not os.path.exists(args.model_dir):
-        os.mkdir(args.model_dir)
+    if is_main_process():
+        if not os.path.exists(args.model_dir):
+            os.mkdir(args.model_dir)
 
-    json.dump(
-        vars(args),
-        open(f"{args.model_dir}/exp_config.json", "w"),
-        indent=2,
-        ensure_ascii=False,
-    )
-    json.dump(
-        slot_meta,
-        open(f"{args.model_dir}/slot_meta.json", "w"),
-        indent=2,
-        ensure_ascii=False,
-    )
-    
+        json.dump(
+            vars(args),
+            open(f"{args.model_dir}/exp_config.json", "w"),
+            indent=2,
+            ensure_ascii=False,
+        )
+        json.dump(
+            slot_meta,
+            open(f"{args.model_dir}/slot_meta.json", "w"),
+            indent=2,
+            ensure_ascii=False,
+        )
+
+    # checkpoint 저장 / retention은 rank 0만, 재개는 모든 process가 같은 checkpoint에서
+    checkpoint_manager = None
+    if is_main_process():
+        checkpoint_manager = CheckpointManager(
+            f"{args.model_dir}/checkpoints", keep_best=args.keep_best, keep_last=args.keep_last
+        )
     best_score, best_checkpoint = 0, 0
-    for epoch in range(n_epochs):
+    start_epoch, start_step = 0, 0
+    if args.resume:
+        start_epoch, start_step, extra = load_checkpoint(
+            f"{args.model_dir}/checkpoints", args.resume, model, optimizer, scheduler, engine
+        )
+        best_score, best_checkpoint = extra["best_score"], extra["best_checkpoint"]
+        if is_main_process():
+            # 저장 이후에 끝난 background evaluation 결과가 manifest에 남아 있을 수 있다
+            best = checkpoint_manager.best()
+            if best is not None and best_score < best["score"]:
+                best_score, best_checkpoint = best["score"], best["epoch"] - 1
+            print(f"Resume from epoch {start_epoch} step {start_step}")
+
+    # 저장된 checkpoint를 별도 process에서 평가해서 다음 epoch 학습과 겹치게 한다
+    evaluator = None
+    if not args.sync_eval and is_main_process():
+        evaluator = BackgroundEvaluator(
+            partial(
+                evaluate_checkpoint,
+                args=args,
+                tokenized_slot_meta=tokenized_slot_meta,
+                processor=processor,
+                eval_features=dev_features,
+                eval_labels=dev_labels,
+                slot_meta=slot_meta,
+                device=args.eval_device,
+            ),
+            num_threads=args.eval_threads,
+        )
+        # 재개 전에 평가가 끝나지 않은 checkpoint는 다시 요청
+        for entry in checkpoint_manager.waiting_for_score():
+            evaluator.submit(entry)
+
+    steps_per_epoch = len(train_loader)
+    for epoch in range(start_epoch, n_epochs):
         model.train()
-        for step, batch in enumerate(train_loader):
-            input_ids, segment_ids, input_masks, gating_ids, target_ids, guids = [
-                b.to(device) if not isinstance(b, list) else b for b in batch
-            ]
-            
+        # 재개한 epoch은 이미 학습한 batch를 건너뜀
+        skip_steps = start_step if epoch == start_epoch else 0
+        train_sampler.set_epoch(epoch, skip_steps * args.train_batch_size)
+        epoch_start, num_samples = time.time(), 0
+        for step, batch in enumerate(profiler.iter(train_loader), start=skip_steps):
+            if args.max_steps is not None and step >= args.max_steps:
+                break
+            with profiler.phase("h2d"):
+                input_ids, segment_ids, input_masks, gating_ids, target_ids, guids = [
+                    b.to(device) if not isinstance(b, list) else b for b in batch
+                ]
+
             # teacher forcing
             if (
                 args.teacher_forcing_ratio > 0.0
@@ -161,44 +309,92 @@ if __name__ == "__main__":
             else:
                 tf = None
 
-            all_point_outputs, all_gate_outputs = model(
-                input_ids, segment_ids, input_masks, target_ids.size(-1), tf
-            )
-            
-            # generation loss
-            loss_1 = loss_fnc_1(
-                all_point_outputs.contiguous(),
-                target_ids.contiguous().view(-1),
-                tokenizer.pad_token_id,
-            )
-            
-            # gating loss
-            loss_2 = loss_fnc_2(
-                all_gate_outputs.contiguous().view(-1, args.n_gate),
-                gating_ids.contiguous().view(-1),
-            )
-            loss = loss_1 + loss_2
+            with engine.autocast():
+                with profiler.phase("forward"):
+                    all_point_outputs, all_gate_outputs = model(
+                        input_ids, segment_ids, input_masks, target_ids.size(-1), tf
+                    )
 
-            loss.backward()
-            nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
-            optimizer.step()
-            scheduler.step()
-            optimizer.zero_grad()
+                with profiler.phase("loss"):
+                    # generation loss
+                    loss_1 = loss_fnc_1(
+                        all_point_outputs.contiguous(),
+                        target_ids.contiguous().view(-1),
+                        tokenizer.pad_token_id,
+                    )
 
-            if step % 100 == 0:
+                    # gating loss
+                    loss_2 = loss_fnc_2(
+                        all_gate_outputs.contiguous().view(-1, args.n_gate),
+                        gating_ids.contiguous().view(-1),
+                    )
+                    loss = loss_1 + loss_2
+
+            engine.backward(loss)
+            num_samples += len(guids)
+            profiler.step(len(guids), int(input_masks.sum()) if profiler.enabled else 0)
+
+            if step % 100 == 0 and is_main_process():
                 print(
-                    f"[{epoch}/{n_epochs}] [{step}/{len(train_loader)}] loss: {loss.item()} gen: {loss_1.item()} gate: {loss_2.item()}"
+                    f"[{epoch}/{n_epochs}] [{step}/{steps_per_epoch}] loss: {loss.item()} gen: {loss_1.item()} gate: {loss_2.item()}"
                 )
 
-        predictions = inference(model, dev_loader, processor, device)
-        eval_result = _evaluation(predictions, dev_labels, slot_meta)
-        for k, v in eval_result.items():
-            print(f"{k}: {v}")
+            # accumulation 중간이 아닐 때만 (optimizer step 직후) 저장
+            if (
+                args.save_steps
+                and (step + 1) % args.save_steps == 0
+                and engine.num_backward % args.gradient_accumulation_steps == 0
+                and is_main_process()
+            ):
+                checkpoint_manager.save(
+                    f"checkpoint-{epoch}-{step + 1}", model, optimizer, scheduler, engine,
+                    epoch=epoch, step=step + 1,
+                    extra={"best_score": best_score, "best_checkpoint": best_checkpoint},
+                )
+        engine.flush()
 
-        if best_score < eval_result['joint_goal_accuracy']:
-            print("Update Best checkpoint!")
-            best_score = eval_result['joint_goal_accuracy']
-            best_checkpoint = epoch
+        # 모든 process가 처리한 sample 수로 throughput 계산
+        num_samples = all_reduce_sum(num_samples)
+        if is_main_process():
+            print(f"throughput: {num_samples / (time.time() - epoch_start):.1f} samples/s ({world_size} processes)")
+
+        # evaluation과 checkpoint 저장은 rank 0만, 나머지 process는 barrier에서 대기
+        if is_main_process():
+            do_eval = (epoch + 1) % args.eval_every == 0 or epoch == n_epochs - 1
+            if do_eval and args.sync_eval:
+                predictions = inference(unwrap_model(model), dev_loader, processor, device)
+                eval_result = _evaluation(predictions, dev_labels, slot_meta)
+                best_score, best_checkpoint = report_evaluation(epoch, eval_result, best_score, best_checkpoint)
 
-        torch.save(model.state_dict(), f"{args.model_dir}/model-{epoch}.bin")
-    print(f"Best checkpoint: {args.model_dir}/model-{best_checkpoint}.bin")
+            # 파일 쓰기는 background thread에서, 다음 epoch 학습과 겹쳐서 진행
+            # background evaluation은 model-{epoch}.bin 쓰기가 끝나면 요청된다
+            checkpoint_manager.save(
+                f"checkpoint-{epoch}", model, optimizer, scheduler, engine,
+                epoch=epoch + 1, step=0,
+                extra={"best_score": best_score, "best_checkpoint": best_checkpoint},
+                model_path=f"{args.model_dir}/model-{epoch}.bin",
+                wait_for_score=do_eval,
+                on_saved=evaluator.submit if do_eval and evaluator is not None else None,
+            )
+            if do_eval and args.sync_eval:
+                checkpoint_manager.set_score(f"checkpoint-{epoch}", eval_result['joint_goal_accuracy'])
+
+            # 이전 epoch들의 background evaluation 중 끝난 것 반영
+            for entry, eval_result in evaluator.poll() if evaluator is not None else []:
+                best_score, best_checkpoint = report_evaluation(
+                    entry["epoch"] - 1, eval_result, best_score, best_checkpoint
+                )
+                checkpoint_manager.set_score(entry["name"], eval_result['joint_goal_accuracy'])
+        barrier()
+
+    if is_main_process():
+        checkpoint_manager.wait()
+        if evaluator is not None:
+            for entry, eval_result in evaluator.poll(block=True):
+                best_score, best_checkpoint = report_evaluation(
+                    entry["epoch"] - 1, eval_result, best_score, best_checkpoint
+                )
+                checkpoint_manager.set_score(entry["name"], eval_result['joint_goal_accuracy'])
+            evaluator.close()
+        checkpoint_manager.close()
+        print(f"Best checkpoint: {args.model_dir}/model-{best_checkpoint}.bin")
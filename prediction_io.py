@@ -0,0 +1,154 @@
+"""prediction을 guid 단위로 jsonl에 바로 쓰고 읽기 (inference / evaluation / voting script 공용)
+
+한 줄에 한 turn: {"guid": "<dialogue_idx>-<turn_idx>", "state": ["도메인-슬롯-값", ...]}
+inference가 중간에 죽어도 그때까지 쓴 prediction은 남고, resume하면 이미 쓴 guid는 건너뛴다.
+predictions.csv ({guid: state} json)도 iter_prediction_file로 memory에 다 올리지 않고 순서대로 읽을 수 있다.
+
+    python prediction_io.py --input predictions.jsonl --output predictions.csv   # 제출용 json 형식으로 변환
+"""
+import argparse
+import json
+import os
+
+_decoder = json.JSONDecoder()
+
+
+def _truncate_partial_line(path):
+    """마지막 줄이 끝까지 쓰이지 않았으면 (쓰는 도중 종료) 그 줄을 잘라낸다"""
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+def iter_predictions(path):
+    """jsonl에서 (guid, state)를 순서대로 반환 (같은 guid가 여러 번 있으면 모두 반환)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break  # 쓰는 도중 종료된 마지막 줄
+            if line.strip():
+                record = json.loads(line)
+                yield record["guid"], record["state"]
+
+
+class _JSONObjectReader:
+    """{"key": value, ...} 파일을 앞에서부터 token 단위로 읽는다 (value 하나씩 raw_decode)"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf, self.pos = "", 0
+
+    def _read_more(self):
+        data = self.f.read(self.chunk_size)
+        if not data:
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """공백을 건너뛴 다음 글자 (파일 끝이면 "")"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read_more():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at {self.f.name}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, self.pos = _decoder.raw_decode(self.buf, self.pos)
+                return value
+            except json.JSONDecodeError:
+                # value가 buffer 끝에서 잘림 -> 더 읽어서 다시
+                if not self._read_more():
+                    raise
+
+
+def iter_json_object(path, chunk_size=1 << 20):
+    """predictions.csv ({guid: state} json)에서 (guid, state)를 파일 순서대로"""
+    with open(path, "r", encoding="utf-8") as f:
+        reader = _JSONObjectReader(f, chunk_size)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            guid = reader.value()
+            reader.expect(":")
+            yield guid, reader.value()
+            if reader.peek() != ",":
+                reader.expect("}")
+                return
+            reader.pos += 1
+
+
+def iter_prediction_file(path):
+    """jsonl (streaming) / json (predictions.csv) 어느 쪽이든 (guid, state)를 파일 순서대로"""
+    return iter_predictions(path) if path.endswith(".jsonl") else iter_json_object(path)
+
+
+def load_predictions(path):
+    """jsonl (streaming) / json (predictions.csv) 어느 쪽이든 {guid: state} dict로 읽는다"""
+    if path.endswith(".jsonl"):
+        return dict(iter_predictions(path))
+    return json.load(open(path, "r"))
+
+
+def jsonl_to_csv(jsonl_path, csv_path):
+    """제출용 predictions.csv (guid -> state json) 로 변환"""
+    json.dump(load_predictions(jsonl_path), open(csv_path, "w"), indent=2, ensure_ascii=False)
+
+
+class PredictionWriter:
+    """batch가 끝날 때마다 prediction을 jsonl에 append
+
+    resume=True면 기존 파일의 guid를 읽어서 done에 두고 이어서 쓴다. done에 있는 guid는 다시 쓰지 않는다.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = set()
+        if resume and os.path.exists(path):
+            _truncate_partial_line(path)
+            self.done = {guid for guid, _ in iter_predictions(path)}
+        self.f = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def write(self, predictions):
+        lines = []
+        for guid, state in predictions.items():
+            if guid in self.done:
+                continue
+            self.done.add(guid)
+            lines.append(json.dumps({"guid": guid, "state": state}, ensure_ascii=False) + "\n")
+        self.f.write("".join(lines))
+        self.f.flush()
+
+    def close(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, required=True, help="inference가 쓴 predictions.jsonl")
+    parser.add_argument("--output", type=str, required=True, help="저장할 predictions.csv")
+    args = parser.parse_args()
+    jsonl_to_csv(args.input, args.output)
@@ -0,0 +1,44 @@
+"""CPU inference용 dynamic int8 quantization
+
+Linear / GRU weight를 int8로 바꾸고 activation은 실행 시점에 quantize 한다 (torch.quantization.quantize_dynamic).
+decoder의 vocab projection (hidden x embed.weight^T)은 matmul이라 그대로는 대상이 아니므로
+embed.weight를 공유하는 nn.Linear (vocab_proj)로 바꿔서 같이 quantize 한다. embedding lookup은 fp32 그대로.
+"""
+import copy
+import io
+
+import torch
+import torch.nn as nn
+
+# weight를 직접 꺼내 쓰는 (matmul) module은 quantize 하면 안 된다 (TRADE decoder의 proj_layer)
+SKIP_MODULES = {"decoder.proj_layer"}
+
+
+def attach_vocab_proj(model):
+    """vocab_proj 속성이 있는 decoder에 embed.weight를 공유하는 Linear를 붙인다"""
+    for module in model.modules():
+        if hasattr(module, "vocab_proj") and module.vocab_proj is None:
+            vocab_size, hidden_size = module.embed.weight.size()
+            vocab_proj = nn.Linear(hidden_size, vocab_size, bias=False)
+            vocab_proj.weight = module.embed.weight
+            module.vocab_proj = vocab_proj
+    return model
+
+
+def quantize_dynamic_int8(model, inplace=False):
+    """Linear / GRU / vocab projection을 dynamic int8로 quantize한 model 반환 (CPU 전용)"""
+    if not inplace:
+        model = copy.deepcopy(model)
+    model = attach_vocab_proj(model.cpu().eval())
+    targets = {
+        name for name, module in model.named_modules()
+        if isinstance(module, (nn.Linear, nn.GRU)) and name not in SKIP_MODULES
+    }
+    return torch.quantization.quantize_dynamic(model, targets, dtype=torch.qint8, inplace=True)
+
+
+def model_size_mb(model):
+    """state_dict를 저장했을 때의 크기 (MB)"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# root의 voting module (hardvote_v2 / vote_engine ...)을 import 하기 위해
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
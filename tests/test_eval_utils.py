@@ -0,0 +1,132 @@
+import importlib.util
+import json
+import os
+import random
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 세 폴더의 eval_utils.py는 같은 내용이어야 한다 (module 이름이 같아서 file 경로로 따로 load)
+COPIES = ["main", "ydy8989", os.path.join("ydy8989", "som-dst")]
+
+SLOT_META = ["관광-종류", "관광-지역", "숙소-지역", "숙소-주차 가능", "식당-종류", "식당-가격대"]
+VALUES = ["서울", "부산", "박물관", "양식당", "한식당", "yes", "no", "dontcare"]
+
+
+def load_eval_utils(folder):
+    path = os.path.join(REPO_ROOT, folder, "eval_utils.py")
+    spec = importlib.util.spec_from_file_location(f"eval_utils_{folder.replace(os.sep, '_')}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_state(rng):
+    slots = rng.sample(SLOT_META, rng.randint(0, 4))
+    return [f"{slot}-{rng.choice(VALUES)}" for slot in slots]
+
+
+def random_dataset(seed, num_dialogues=30):
+    """gold를 조금씩 바꾼 pred (맞음 / value 틀림 / 누락 / 추가)를 섞은 (labels, predictions)"""
+    rng = random.Random(seed)
+    labels, predictions = {}, {}
+    for d in range(num_dialogues):
+        for t in range(rng.randint(1, 6)):
+            guid = f"dial{d}-{t}"
+            gold = random_state(rng)
+            pred = [sv for sv in gold if rng.random() > 0.2]
+            pred = [sv.rsplit("-", 1)[0] + "-" + rng.choice(VALUES) if rng.random() < 0.15 else sv for sv in pred]
+            if rng.random() < 0.3:
+                extra = rng.choice(SLOT_META)
+                if all(not sv.startswith(extra + "-") for sv in pred):
+                    pred.append(f"{extra}-{rng.choice(VALUES)}")
+            labels[guid], predictions[guid] = gold, pred
+    return labels, predictions
+
+
+def reference_breakdown(labels, predictions):
+    """turn 별로 slot -> value dict를 비교하는 직접 계산"""
+    slot_errors = {slot: 0 for slot in SLOT_META}
+    domain, per_turn = {}, {}
+    for guid, gold in labels.items():
+        g = dict(sv.rsplit("-", 1) for sv in gold)
+        p = dict(sv.rsplit("-", 1) for sv in predictions[guid])
+        wrong = {slot for slot in set(g) | set(p) if g.get(slot) != p.get(slot)}
+        for slot in wrong:
+            slot_errors[slot] += 1
+        for d in {slot.split("-")[0] for slot in set(g) | set(p)}:
+            hit, count = domain.get(d, (0, 0))
+            domain[d] = (hit + all(not slot.startswith(d + "-") for slot in wrong), count + 1)
+        t = int(guid.rsplit("-", 1)[1])
+        hit, count = per_turn.get(t, (0, 0))
+        per_turn[t] = (hit + (not wrong), count + 1)
+    n = len(labels)
+    return {
+        "per_slot": {slot: 1 - errors / n for slot, errors in slot_errors.items()},
+        "per_domain": {d: {"joint_goal_accuracy": h / c, "turns": c} for d, (h, c) in sorted(domain.items())},
+        "per_turn": {t: {"joint_goal_accuracy": h / c, "turns": c} for t, (h, c) in sorted(per_turn.items())},
+    }
+
+
+@pytest.mark.parametrize("folder", COPIES)
+@pytest.mark.parametrize("seed", range(5))
+def test_vectorized_evaluator_matches_dst_evaluator(folder, seed):
+    eval_utils = load_eval_utils(folder)
+    labels, predictions = random_dataset(seed)
+    reference = eval_utils.DSTEvaluator(SLOT_META)
+    vectorized = eval_utils.VectorizedDSTEvaluator(SLOT_META)
+    for guid, gold in labels.items():
+        reference.update(gold, predictions[guid])
+        vectorized.update(gold, predictions[guid], int(guid.rsplit("-", 1)[1]))
+
+    expected = reference.compute()
+    result = vectorized.compute()
+    assert result.keys() == expected.keys()
+    for k, v in expected.items():
+        assert result[k] == pytest.approx(v, abs=1e-12)
+    breakdown, expected = vectorized.breakdown(), reference_breakdown(labels, predictions)
+    assert breakdown["per_slot"] == pytest.approx(expected["per_slot"])
+    for key in ["per_domain", "per_turn"]:
+        assert breakdown[key].keys() == expected[key].keys()
+        for k, v in expected[key].items():
+            assert breakdown[key][k] == pytest.approx(v)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_streaming_evaluator_matches_vectorized(seed):
+    eval_utils = load_eval_utils("main")
+    labels, predictions = random_dataset(seed)
+    vectorized = eval_utils.VectorizedDSTEvaluator(SLOT_META)
+    for guid, gold in labels.items():
+        vectorized.update(gold, predictions[guid], int(guid.rsplit("-", 1)[1]))
+
+    streaming = eval_utils.StreamingDSTEvaluator(SLOT_META, labels)
+    guids = list(predictions)
+    for i in range(0, len(guids), 7):
+        streaming.update({guid: predictions[guid] for guid in guids[i: i + 7]})
+    # 합계가 정수 / 분수라서 batch로 나눠도 값이 정확히 같다
+    assert streaming.compute() == vectorized.compute()
+    assert streaming.breakdown() == vectorized.breakdown()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_sharded_merge_equals_full(seed, tmp_path):
+    eval_utils = load_eval_utils("main")
+    labels, predictions = random_dataset(seed)
+    full = eval_utils.StreamingDSTEvaluator(SLOT_META, labels)
+    full.update(predictions)
+
+    # dialogue가 섞이도록 guid를 shuffle 해서 3개 shard로 나누고, 각 shard는 json으로 저장했다가 merge
+    guids = list(predictions)
+    random.Random(seed).shuffle(guids)
+    paths = []
+    for shard in range(3):
+        evaluator = eval_utils.StreamingDSTEvaluator(SLOT_META, labels)
+        evaluator.update({guid: predictions[guid] for guid in guids[shard::3]})
+        paths.append(str(tmp_path / f"eval_state_{shard}.json"))
+        evaluator.save(paths[-1])
+
+    merged = eval_utils.StreamingDSTEvaluator.merge_files(paths)
+    assert merged.compute() == full.compute()
+    assert merged.breakdown() == full.breakdown()
+    assert json.loads(json.dumps(merged.to_dict())) == json.loads(json.dumps(full.to_dict()))
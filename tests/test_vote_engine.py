@@ -0,0 +1,34 @@
+import numpy as np
+
+from vote_engine import VoteEngine, _gold_cells, scheme_weights, voter_slot_accuracy
+
+LABELS = {
+    "d-0": ["식당-종류-양식당"],
+    "d-1": ["식당-종류-한식당"],
+    "d-2": [],
+}
+PREDICTIONS = [
+    # 1, 3번 turn만 맞음 (2번 turn은 다른 value)
+    {"d-0": ["식당-종류-양식당"], "d-1": ["식당-종류-중식당"], "d-2": []},
+    # 항상 틀림 (gold가 없는 3번 turn에도 예측)
+    {"d-0": ["식당-종류-중식당"], "d-1": ["식당-종류-중식당"], "d-2": ["식당-종류-중식당"]},
+    # 식당-종류는 모두 맞고, gold가 없는 숙소-지역을 한 번 예측
+    {"d-0": ["식당-종류-양식당"], "d-1": ["식당-종류-한식당"], "d-2": ["숙소-지역-서울"]},
+]
+
+
+def test_voter_slot_accuracy_exact():
+    engine = VoteEngine(PREDICTIONS)
+    accuracy = voter_slot_accuracy(engine, _gold_cells(engine, LABELS))
+    food, region = engine.slot2id["식당-종류"], engine.slot2id["숙소-지역"]
+    np.testing.assert_allclose(accuracy[:, food], [2 / 3, 0.0, 1.0])
+    np.testing.assert_allclose(accuracy[:, region], [1.0, 1.0, 2 / 3])
+
+
+def test_log_odds_weights_follow_accuracy():
+    engine = VoteEngine(PREDICTIONS)
+    accuracy = voter_slot_accuracy(engine, _gold_cells(engine, LABELS))
+    weights = scheme_weights(accuracy, "log_odds")[:, engine.slot2id["식당-종류"]]
+    # 정확도 순서대로 weight가 커지고, 항상 틀린 voter만 0 (uniform으로 돌아가지 않음)
+    assert weights[2] > weights[0] > weights[1] == 0
+    np.testing.assert_allclose(weights[0], np.log(2))
@@ -0,0 +1,96 @@
+import json
+import random
+from collections import defaultdict
+
+import pytest
+
+from hardvote_v2 import CRITERION, hardvoting, save_csv, sum_predictions, voter_meta, voting2preds
+from vote_engine import VoteEngine
+from vote_stream import stream_vote
+
+CRITERIA = [CRITERION.SV_MAJORITY1, CRITERION.SV_MAJORITY2, CRITERION.SLOT_FIRST_AND_TOP_VALUE]
+SLOTS = ["관광-종류", "관광-지역", "숙소-지역", "식당-종류", "식당-가격대"]
+VALUES = ["서울", "부산", "박물관", "양식당", "dontcare"]
+
+
+def random_predictions(seed, n_voter, n_turns=40):
+    """voter들이 자주 겹치고 가끔 갈리도록 공통 state에서 조금씩 바꾼 prediction"""
+    rng = random.Random(seed)
+    predictions = [{} for _ in range(n_voter)]
+    for t in range(n_turns):
+        guid = f"dial{t // 5}-{t % 5}"
+        base = {slot: rng.choice(VALUES) for slot in rng.sample(SLOTS, rng.randint(0, 4))}
+        for voter in predictions:
+            state = {slot: value for slot, value in base.items() if rng.random() > 0.2}
+            for slot in rng.sample(SLOTS, rng.randint(0, 2)):
+                state[slot] = rng.choice(VALUES)
+            voter[guid] = [f"{slot}-{value}" for slot, value in state.items()]
+    return predictions
+
+
+def legacy_vote(predictions, criterion):
+    """hardvote_v2의 turn별 voting (VoteEngine 이전 경로)"""
+    results = defaultdict(dict)
+    for t in predictions[0]:
+        results[t] = hardvoting(sum_predictions(predictions, turn=t), len(predictions), criterion=criterion)
+    return results
+
+
+def assert_same_votes(voted, expected, criterion):
+    assert list(voted) == list(expected)
+    if criterion == CRITERION.SLOT_FIRST_AND_TOP_VALUE:
+        # 채택 순서가 slot_counts (list Counter) 순서라 state 순서까지 같다
+        assert voted == expected
+    else:
+        # sum_predictions가 voter의 slot-value를 set으로 모으므로 legacy의 state 순서는 hash seed에 따라 바뀐다
+        assert {t: sorted(s) for t, s in voted.items()} == {t: sorted(s) for t, s in expected.items()}
+
+
+@pytest.mark.parametrize("criterion", CRITERIA)
+@pytest.mark.parametrize("n_voter", [1, 2, 3, 4, 5])
+@pytest.mark.parametrize("seed", range(3))
+def test_vote_engine_matches_hardvoting(criterion, n_voter, seed):
+    predictions = random_predictions(seed, n_voter)
+    results = legacy_vote(predictions, criterion)
+    engine = VoteEngine(predictions)
+    assert_same_votes(engine.vote(criterion), voting2preds(results), criterion)
+    assert engine.voter_meta(criterion) == voter_meta(predictions, results)
+
+
+def write_voter_file(path, prediction):
+    """.jsonl은 inference의 streaming 출력, 그 외는 predictions.csv (json) 형식"""
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for guid, state in prediction.items():
+                f.write(json.dumps({"guid": guid, "state": state}, ensure_ascii=False) + "\n")
+        else:
+            json.dump(prediction, f, indent=2, ensure_ascii=False)
+
+
+@pytest.mark.parametrize("criterion", CRITERIA)
+@pytest.mark.parametrize("n_voter", [1, 3, 4])
+@pytest.mark.parametrize("seed", range(3))
+def test_stream_vote_matches_save_csv(criterion, n_voter, seed, tmp_path):
+    predictions = random_predictions(seed, n_voter)
+    results = legacy_vote(predictions, criterion)
+    save_csv(voting2preds(results), str(tmp_path))
+    expected_path = tmp_path / "hardvoting_result.csv"
+
+    paths = []
+    for n, prediction in enumerate(predictions):
+        if n == 1:
+            # 첫 번째 voter와 turn 순서가 다른 파일 (iter_aligned의 buffer 경로)
+            guids = list(prediction)
+            random.Random(seed).shuffle(guids)
+            prediction = {guid: prediction[guid] for guid in guids}
+        paths.append(str(tmp_path / f"voter{n}.{'jsonl' if n % 2 else 'csv'}"))
+        write_voter_file(paths[-1], prediction)
+
+    output_path = tmp_path / "voted.csv"
+    stats = stream_vote(paths, str(output_path), criterion, chunk_size=7)
+    assert stats == voter_meta(predictions, results)
+    if criterion == CRITERION.SLOT_FIRST_AND_TOP_VALUE:
+        assert output_path.read_text(encoding="utf-8") == expected_path.read_text(encoding="utf-8")
+    else:
+        voted = json.loads(output_path.read_text(encoding="utf-8"))
+        assert_same_votes(voted, json.loads(expected_path.read_text(encoding="utf-8")), criterion)
@@ -0,0 +1,701 @@
+"""학습 공용 코드: TrainingEngine / ResumableSampler / CheckpointManager / BackgroundEvaluator 등
+
+main, ydy8989, ydy8989/som-dst 의 학습 script가 모두 이 파일 하나를 쓴다 (각 폴더의 train_utils.py가 다시 export).
+"""
+import contextlib
+import json
+import math
+import multiprocessing as mp
+import os
+import queue
+import random
+import resource
+import threading
+import time
+import traceback
+from collections import defaultdict
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Sampler
+
+
+def init_distributed(backend="gloo"):
+    """launch.py (또는 torch.distributed.launch)가 넘겨준 환경변수로 process group 초기화
+
+    WORLD_SIZE가 없거나 1이면 single process로 동작한다. (rank, world_size) 반환
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group(backend=backend, init_method="env://")
+    return get_rank(), world_size
+
+
+def get_rank():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank()
+    return 0
+
+
+def get_world_size():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_world_size()
+    return 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if get_world_size() > 1:
+        dist.barrier()
+
+
+def all_reduce_sum(value):
+    """모든 process의 python number를 더한다 (logging / throughput 집계용)"""
+    if get_world_size() == 1:
+        return value
+    tensor = torch.tensor(value, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.item()
+
+
+def wrap_distributed(model, find_unused_parameters=False):
+    """multi process일 때 gradient all-reduce를 위해 DistributedDataParallel로 감싼다"""
+    if get_world_size() == 1:
+        return model
+    device_ids = None
+    if next(model.parameters()).is_cuda:
+        device_ids = [torch.cuda.current_device()]
+    return DistributedDataParallel(
+        model, device_ids=device_ids, find_unused_parameters=find_unused_parameters
+    )
+
+
+def unwrap_model(model):
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def cpu_autocast_available():
+    # torch.cpu.amp.autocast (bfloat16)는 torch 1.10부터 지원
+    return hasattr(torch, "cpu") and hasattr(torch.cpu, "amp")
+
+
+class TrainingEngine:
+    """mixed precision, gradient accumulation, clipping, scheduler step을 처리하는 training step
+
+    - GPU: fp16 autocast + GradScaler
+    - CPU: bfloat16 autocast (loss scaling 불필요)
+
+    사용법:
+        with engine.autocast():
+            loss = ...
+        engine.backward(loss)  # backward는 autocast 밖에서
+
+    DistributedDataParallel model이면 accumulation 중간 step은 no_sync로 gradient all-reduce를 미룬다.
+    """
+
+    def __init__(
+        self,
+        model,
+        optimizer,
+        scheduler=None,
+        device="cpu",
+        use_amp=False,
+        gradient_accumulation_steps=1,
+        max_grad_norm=None,
+    ):
+        self.model = model
+        self.optimizer = optimizer
+        self.scheduler = scheduler
+        self.device = torch.device(device)
+        self.gradient_accumulation_steps = gradient_accumulation_steps
+        self.max_grad_norm = max_grad_norm
+
+        self.amp_dtype = None
+        if use_amp and self.device.type == "cuda":
+            self.amp_dtype = torch.float16
+        elif use_amp and cpu_autocast_available():
+            self.amp_dtype = torch.bfloat16
+        self.scaler = torch.cuda.amp.GradScaler(enabled=self.amp_dtype == torch.float16)
+        self.num_backward = 0
+        self.profiler = None  # StepProfiler를 넣으면 backward / optimizer 시간을 따로 잰다
+
+    def _phase(self, name):
+        return self.profiler.phase(name) if self.profiler is not None else contextlib.nullcontext()
+
+    def autocast(self):
+        stack = contextlib.ExitStack()
+        if self.amp_dtype == torch.float16:
+            stack.enter_context(torch.cuda.amp.autocast())
+        elif self.amp_dtype == torch.bfloat16:
+            stack.enter_context(torch.cpu.amp.autocast(dtype=torch.bfloat16))
+
+        # 다음 backward가 optimizer step이 아니면 all-reduce 생략 (forward부터 no_sync 안에 있어야 함)
+        is_sync_step = (self.num_backward + 1) % self.gradient_accumulation_steps == 0
+        if isinstance(self.model, DistributedDataParallel) and not is_sync_step:
+            stack.enter_context(self.model.no_sync())
+        return stack
+
+    def backward(self, loss):
+        """loss를 backward 하고, accumulation step이 다 차면 optimizer step. step 했으면 True"""
+        with self._phase("backward"):
+            self.scaler.scale(loss / self.gradient_accumulation_steps).backward()
+        self.num_backward += 1
+        if self.num_backward % self.gradient_accumulation_steps:
+            return False
+        with self._phase("optimizer"):
+            return self.step()
+
+    def step(self):
+        if self.max_grad_norm:
+            self.scaler.unscale_(self.optimizer)
+            nn.utils.clip_grad_norm_(self.model.parameters(), self.max_grad_norm)
+
+        scale = self.scaler.get_scale()
+        self.scaler.step(self.optimizer)
+        self.scaler.update()
+        self.optimizer.zero_grad()
+
+        # inf/nan gradient로 optimizer step이 skip 되면 scale이 줄어든다 => scheduler도 skip
+        stepped = self.scaler.get_scale() >= scale
+        if stepped and self.scheduler is not None:
+            self.scheduler.step()
+        return stepped
+
+    def state_dict(self):
+        return {"scaler": self.scaler.state_dict(), "num_backward": self.num_backward}
+
+    def load_state_dict(self, state_dict):
+        self.scaler.load_state_dict(state_dict["scaler"])
+        self.num_backward = state_dict["num_backward"]
+
+    def flush(self):
+        """epoch 끝에 accumulation 중인 gradient가 남아 있으면 step"""
+        if self.num_backward % self.gradient_accumulation_steps:
+            self.num_backward = 0
+            if isinstance(self.model, DistributedDataParallel):
+                # no_sync로 미뤄둔 gradient를 직접 평균
+                for p in self.model.parameters():
+                    if p.grad is not None:
+                        dist.all_reduce(p.grad)
+                        p.grad.div_(get_world_size())
+            return self.step()
+        return False
+
+
+class ResumableSampler(Sampler):
+    """epoch마다 seed + epoch으로 섞는 random sampler. 학습 중간부터 재개할 수 있다
+
+    multi process면 DistributedSampler처럼 index를 rank별로 나눈다.
+    set_epoch(epoch, start_index)로 이미 학습한 sample을 건너뛴다.
+    """
+
+    def __init__(self, data_source, seed=42):
+        self.data_source = data_source
+        self.seed = seed
+        self.num_replicas = get_world_size()
+        self.rank = get_rank()
+        self.num_samples = math.ceil(len(data_source) / self.num_replicas)
+        self.total_size = self.num_samples * self.num_replicas
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.randperm(len(self.data_source), generator=generator).tolist()
+        indices += indices[: self.total_size - len(indices)]  # rank별 sample 수를 맞춤
+        indices = indices[self.rank: self.total_size: self.num_replicas]
+        return iter(indices[self.start_index:])
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+
+def get_rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _to_cpu(obj):
+    """background thread에서 쓰는 동안 학습이 값을 바꾸지 않도록 tensor를 CPU로 복사"""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def _atomic_save(obj, path):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CheckpointManager:
+    """model / optimizer / scheduler / GradScaler / RNG / 학습 위치를 background thread로 저장
+
+    - save()는 state를 CPU로 복사만 하고 바로 return, 파일 쓰기는 writer thread가 한다 (tmp 파일 + rename)
+    - checkpoints.json에 저장된 checkpoint 목록과 score를 기록
+    - retention: score (joint goal accuracy) 상위 keep_best개 + 최근 keep_last개만 남긴다.
+      score를 기다리는 (wait_for_score=True) checkpoint는 score가 들어올 때까지 남긴다.
+      지워지는 checkpoint의 model_path (model-{epoch}.bin)도 같이 지운다.
+    - load()로 저장된 위치 (epoch, step)부터 그대로 재개
+    """
+
+    MANIFEST = "checkpoints.json"
+
+    def __init__(self, checkpoint_dir, keep_best=1, keep_last=1):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.manifest_path = os.path.join(checkpoint_dir, self.MANIFEST)
+        self.entries = self._read_manifest(self.manifest_path)
+        # entries는 writer thread가 바꾸고 main thread가 읽는다
+        self._entries_lock = threading.Lock()
+
+        # 쓰기가 밀리면 snapshot이 메모리에 쌓이지 않도록 save()가 대기
+        self._tasks = queue.Queue(maxsize=2)
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def _read_manifest(path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)["checkpoints"]
+
+    def save(self, name, model, optimizer=None, scheduler=None, engine=None,
+             epoch=0, step=0, extra=None, model_path=None, wait_for_score=False, on_saved=None):
+        """학습 state snapshot을 만들어 writer thread에 넘긴다
+
+        epoch, step: 재개할 위치 (epoch의 step번째 batch부터 학습)
+        model_path: 지정하면 model state_dict만 따로 저장 (inference용 model-{epoch}.bin)
+        on_saved: 파일 쓰기가 끝난 뒤 writer thread에서 entry를 인자로 호출 (evaluation 요청 등)
+        """
+        self._raise_error()
+        model_state = _to_cpu(unwrap_model(model).state_dict())
+        state = {
+            "model": model_state,
+            "optimizer": _to_cpu(optimizer.state_dict()) if optimizer is not None else None,
+            "scheduler": scheduler.state_dict() if scheduler is not None else None,
+            "engine": _to_cpu(engine.state_dict()) if engine is not None else None,
+            "rng": get_rng_state(),
+            "epoch": epoch,
+            "step": step,
+            "extra": extra or {},
+        }
+        entry = {
+            "name": name,
+            "path": f"{name}.pt",
+            "epoch": epoch,
+            "step": step,
+            "score": None,
+            "wait_for_score": wait_for_score,
+            "model_path": model_path,
+        }
+        self._tasks.put((self._write, (state, entry, on_saved)))
+
+    def set_score(self, name, score):
+        """checkpoint의 evaluation 결과 (joint goal accuracy)를 기록하고 retention 적용"""
+        self._raise_error()
+        self._tasks.put((self._update_score, (name, score)))
+
+    def best(self):
+        with self._entries_lock:
+            scored = [dict(e) for e in self.entries if e["score"] is not None]
+        return max(scored, key=lambda e: e["score"]) if scored else None
+
+    def waiting_for_score(self):
+        """저장은 됐지만 아직 score가 없는 checkpoint (재개 시 evaluation을 다시 요청하는 용도)"""
+        with self._entries_lock:
+            return [dict(e) for e in self.entries if e["wait_for_score"] and e["score"] is None]
+
+    def latest(self):
+        with self._entries_lock:
+            return dict(self.entries[-1]) if self.entries else None
+
+    def path(self, entry):
+        return os.path.join(self.checkpoint_dir, entry["path"])
+
+    def wait(self):
+        """밀려 있는 저장이 모두 끝날 때까지 대기"""
+        self._tasks.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        self._tasks.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        while True:
+            task = self._tasks.get()
+            try:
+                if task is None:
+                    return
+                fn, args = task
+                if self._error is None:
+                    fn(*args)
+            except Exception as e:  # main thread의 다음 save/wait에서 다시 raise
+                self._error = e
+            finally:
+                self._tasks.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError("checkpoint writer failed") from self._error
+
+    def _write(self, state, entry, on_saved):
+        _atomic_save(state, os.path.join(self.checkpoint_dir, entry["path"]))
+        if entry["model_path"] is not None:
+            _atomic_save(state["model"], entry["model_path"])
+        with self._entries_lock:
+            self.entries = [e for e in self.entries if e["name"] != entry["name"]] + [entry]
+        self._apply_retention()
+        if on_saved is not None:
+            on_saved(dict(entry))
+
+    def _update_score(self, name, score):
+        with self._entries_lock:
+            for e in self.entries:
+                if e["name"] == name:
+                    e["score"] = score
+        self._apply_retention()
+
+    def _apply_retention(self):
+        with self._entries_lock:
+            keep = {e["name"] for e in self.entries[-self.keep_last:]} if self.keep_last > 0 else set()
+            scored = sorted(
+                [e for e in self.entries if e["score"] is not None], key=lambda e: e["score"], reverse=True
+            )
+            keep.update(e["name"] for e in scored[: self.keep_best])
+            keep.update(e["name"] for e in self.entries if e["wait_for_score"] and e["score"] is None)
+
+            removed = [e for e in self.entries if e["name"] not in keep]
+            self.entries = [e for e in self.entries if e["name"] in keep]
+            manifest = {"checkpoints": [dict(e) for e in self.entries]}
+            # 남은 checkpoint가 같은 model_path를 쓰면 (예: best_model.bin) 지우지 않는다
+            kept_model_paths = {e["model_path"] for e in self.entries if e.get("model_path")}
+        # manifest를 먼저 바꾸고 파일 삭제 => 중간에 죽어도 manifest가 없는 파일을 가리키지 않음
+        tmp_path = f"{self.manifest_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        for e in removed:
+            paths = [os.path.join(self.checkpoint_dir, e["path"])]
+            if e.get("model_path") and e["model_path"] not in kept_model_paths:
+                paths.append(e["model_path"])
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def load(self, path, model, optimizer=None, scheduler=None, engine=None):
+        """checkpoint로 학습 state 복원. 재개할 (epoch, step, extra) 반환
+
+        path가 "latest"면 manifest의 가장 최근 checkpoint
+        """
+        return load_checkpoint(self.checkpoint_dir, path, model, optimizer, scheduler, engine)
+
+
+def load_checkpoint(checkpoint_dir, path, model, optimizer=None, scheduler=None, engine=None):
+    """CheckpointManager 없이 학습 state 복원 (CheckpointManager는 rank 0에만 있으므로 다른 process용)
+
+    path가 "latest"면 checkpoint_dir manifest의 가장 최근 checkpoint. 재개할 (epoch, step, extra) 반환
+    """
+    if path == "latest":
+        entries = CheckpointManager._read_manifest(os.path.join(checkpoint_dir, CheckpointManager.MANIFEST))
+        if not entries:
+            raise FileNotFoundError(f"no checkpoint in {checkpoint_dir}")
+        path = os.path.join(checkpoint_dir, entries[-1]["path"])
+    state = torch.load(path, map_location="cpu")
+    unwrap_model(model).load_state_dict(state["model"])
+    if optimizer is not None and state["optimizer"] is not None:
+        optimizer.load_state_dict(state["optimizer"])
+    if scheduler is not None and state["scheduler"] is not None:
+        scheduler.load_state_dict(state["scheduler"])
+    if engine is not None and state["engine"] is not None:
+        engine.load_state_dict(state["engine"])
+    set_rng_state(state["rng"])
+    return state["epoch"], state["step"], state["extra"]
+
+
+def select_eval_dialogues(items, num_dialogues=None, seed=42):
+    """dev set (turn 단위 example / feature)에서 dialogue 단위로 일부만 고른다
+
+    guid는 "{dialogue_idx}-{turn_idx}" 형식. 고른 dialogue의 turn은 원래 순서를 유지한다.
+    """
+    if num_dialogues is None:
+        return items
+    dialogue_ids = sorted({item.guid.rsplit("-", 1)[0] for item in items})
+    if num_dialogues >= len(dialogue_ids):
+        return items
+    selected = set(random.Random(seed).sample(dialogue_ids, num_dialogues))
+    return [item for item in items if item.guid.rsplit("-", 1)[0] in selected]
+
+
+def _evaluation_worker(evaluate_fn, tasks, results, num_threads):
+    torch.set_num_threads(num_threads)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        try:
+            results.put((task, evaluate_fn(task["model_path"]), None))
+        except Exception:
+            results.put((task, None, traceback.format_exc()))
+
+
+class BackgroundEvaluator:
+    """저장된 checkpoint를 별도 process에서 evaluation (학습과 병렬로 남는 core에서 실행)
+
+    evaluate_fn(model_path) -> eval_result dict. spawn으로 넘겨지므로 pickle 가능해야 한다
+    (module top-level 함수 또는 functools.partial).
+
+    사용법:
+        evaluator.submit(entry)        # CheckpointManager.save(on_saved=evaluator.submit)
+        for entry, eval_result in evaluator.poll(): ...
+    """
+
+    def __init__(self, evaluate_fn, num_threads=1):
+        ctx = mp.get_context("spawn")
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._process = ctx.Process(
+            target=_evaluation_worker,
+            args=(evaluate_fn, self._tasks, self._results, num_threads),
+            daemon=True,
+        )
+        self._process.start()
+        self._lock = threading.Lock()  # submit은 checkpoint writer thread에서도 호출된다
+        self.num_pending = 0
+
+    def submit(self, entry):
+        """entry: CheckpointManager entry (name, model_path, epoch 등)"""
+        with self._lock:
+            self.num_pending += 1
+        self._tasks.put(entry)
+
+    def poll(self, block=False):
+        """끝난 evaluation의 (entry, eval_result) 목록. block=True면 남은 evaluation을 모두 기다린다"""
+        finished = []
+        while True:
+            with self._lock:
+                num_pending = self.num_pending
+            if num_pending == 0:
+                break
+            try:
+                entry, eval_result, error = self._results.get(block=block, timeout=5 if block else None)
+            except queue.Empty:
+                if block and self._process.is_alive():
+                    continue
+                if block:
+                    raise RuntimeError("evaluation process exited unexpectedly")
+                break
+            with self._lock:
+                self.num_pending -= 1
+            if error is not None:
+                raise RuntimeError(f"evaluation of {entry['name']} failed\n{error}")
+            finished.append((entry, eval_result))
+        return finished
+
+    def close(self):
+        self._tasks.put(None)
+        self._process.join()
+
+
+class StepProfiler:
+    """training step을 phase (data / collate / h2d / encoder / decoder / loss / backward / optimizer) 별로 측정
+
+    phase는 중첩될 수 있고 각 phase에는 자기 자신의 시간만 (하위 phase 제외) 더해진다.
+    log_every step마다 phase별 평균 시간, throughput (turns/sec, tokens/sec), peak memory,
+    loader starvation (data + collate 대기 비율)을 SummaryWriter에 기록한다.
+    trace_steps를 주면 trace_start step부터 trace_steps 동안 torch profiler로 chrome trace를 저장한다.
+
+    사용법:
+        for batch in profiler.iter(train_loader):
+            with profiler.phase("h2d"):
+                batch = ...
+            ...
+            profiler.step(num_turns, num_tokens)
+    """
+
+    DATA_PHASES = ("data", "collate")
+
+    def __init__(self, enabled=True, device="cpu", logger=None, log_every=50,
+                 trace_path=None, trace_start=10, trace_steps=0):
+        self.enabled = enabled
+        self.device = torch.device(device)
+        self.logger = logger
+        self.log_every = log_every
+        self.trace_path = trace_path
+        self.trace_start = trace_start
+        self.trace_steps = trace_steps
+
+        self.global_step = 0
+        self._stack = []
+        self._trace = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self._phase_times = defaultdict(float)
+        self._window_steps = 0
+        self._window_turns = 0
+        self._window_tokens = 0
+        self._window_start = time.perf_counter()
+
+    def _sync(self):
+        # GPU는 kernel이 비동기로 실행되므로 phase 경계마다 기다려야 시간이 맞다
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+    def _push(self, name):
+        self._sync()
+        record = None
+        if self._trace is not None:
+            record = torch.autograd.profiler.record_function(name)
+            record.__enter__()
+        self._stack.append([name, time.perf_counter(), 0.0, record])
+
+    def _pop(self):
+        self._sync()
+        name, start, child_time, record = self._stack.pop()
+        if record is not None:
+            record.__exit__(None, None, None)
+        elapsed = time.perf_counter() - start
+        self._phase_times[name] += elapsed - child_time
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        self._push(name)
+        try:
+            yield
+        finally:
+            self._pop()
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(name)
+
+    def iter(self, loader):
+        """DataLoader에서 batch를 기다리는 시간을 data phase로 측정"""
+        iterator = iter(loader)
+        while True:
+            with self.phase("data"):
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    return
+            yield batch
+
+    def wrap(self, fn, name="collate"):
+        """collate_fn 등을 phase로 감싼다 (num_workers=0일 때만 main process에서 측정된다)"""
+        if not self.enabled:
+            return fn
+
+        def wrapped(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+
+        return wrapped
+
+    def attach(self, module, name):
+        """module의 forward를 phase로 측정 (encoder / decoder 등)"""
+        if not self.enabled:
+            return
+        module.register_forward_pre_hook(lambda m, inputs: self._push(name))
+        module.register_forward_hook(lambda m, inputs, outputs: self._pop())
+
+    def step(self, num_turns=0, num_tokens=0):
+        """training step 하나가 끝날 때 호출"""
+        if not self.enabled:
+            return
+        self.global_step += 1
+        self._window_steps += 1
+        self._window_turns += num_turns
+        self._window_tokens += num_tokens
+        self._update_trace()
+        if self._window_steps >= self.log_every:
+            self.log()
+
+    def _update_trace(self):
+        if not self.trace_steps:
+            return
+        if self._trace is None and self.global_step == self.trace_start:
+            try:
+                import torch.profiler as torch_profiler  # torch>=1.8.1
+
+                activities = [torch_profiler.ProfilerActivity.CPU]
+                if self.device.type == "cuda":
+                    activities.append(torch_profiler.ProfilerActivity.CUDA)
+                self._trace = torch_profiler.profile(activities=activities)
+            except ImportError:
+                self._trace = torch.autograd.profiler.profile(use_cuda=self.device.type == "cuda")
+            self._trace.__enter__()
+        elif self._trace is not None and self.global_step == self.trace_start + self.trace_steps:
+            self._trace.__exit__(None, None, None)
+            self._trace.export_chrome_trace(self.trace_path)
+            print(f"Chrome trace of {self.trace_steps} steps is saved to {self.trace_path}")
+            self._trace = None
+            self.trace_steps = 0
+
+    def peak_memory_mb(self):
+        if self.device.type == "cuda":
+            return torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # linux: KB
+
+    def summary(self):
+        """현재 window의 step 당 phase 시간 (ms), throughput, loader starvation, peak memory"""
+        elapsed = time.perf_counter() - self._window_start
+        steps = max(self._window_steps, 1)
+        result = {f"{name}_ms": 1000 * t / steps for name, t in self._phase_times.items()}
+        result["step_ms"] = 1000 * elapsed / steps
+        result["turns_per_sec"] = self._window_turns / elapsed
+        result["tokens_per_sec"] = self._window_tokens / elapsed
+        data_time = sum(self._phase_times[name] for name in self.DATA_PHASES)
+        result["loader_starvation"] = data_time / elapsed
+        result["peak_memory_mb"] = self.peak_memory_mb()
+        return result
+
+    def log(self):
+        result = self.summary()
+        if self.logger is not None:
+            for k, v in result.items():
+                self.logger.add_scalar(f"Profile/{k}", v, self.global_step)
+        print(
+            f"[profile] step {result['step_ms']:.1f}ms, {result['turns_per_sec']:.1f} turns/s, "
+            f"{result['tokens_per_sec']:.0f} tokens/s, loader starvation {result['loader_starvation']:.1%}, "
+            f"peak memory {result['peak_memory_mb']:.0f}MB"
+        )
+        self._reset_window()
@@ -0,0 +1,330 @@
+"""hardvote_v2의 hard voting을 정수 matrix 위의 numpy 연산으로
+
+prediction을 한 번만 읽어서 "domain-slot-value"를 정수 id로 바꾸고 turns x voters x slots value matrix를
+0이 아닌 칸만 (turn, voter, slot, slot-value id) 배열로 들고 있는 sparse (COO) 형태로 만든 뒤
+CRITERION (sv_majority1 / sv_majority2 / slot_first_and_top_value)을 turn 전체에 대해 sort / bincount로 한 번에 계산한다.
+sparse라서 한 voter가 한 turn에 같은 slot을 두 번 예측한 경우도 hardvote_v2와 똑같이 센다.
+결과는 hardvote_v2.hardvoting + voting2preds와 같다.
+
+turn 안의 slot-value 순서는 처음 나온 (voter, 위치) 순서. hardvote_v2는 sv_majority에서 voter 안의 set 순서를 쓰기 때문에
+실행마다 순서가 다를 수 있다 (집합으로는 같음).
+
+    python vote_engine.py --csv_dir . --criterion slot_first_and_top_value --save_dir ./hardvoting_result
+
+weighted voting: dev prediction으로 voter x slot weight와 slot별 채택 threshold를 고른 뒤 test에 적용한다.
+dev_dir과 csv_dir에는 같은 model의 prediction이 같은 파일 이름으로 있어야 한다.
+
+    python vote_engine.py fit --dev_dir dev_preds --dev_labels dev_labels.json --weights voter_weights.json
+    python vote_engine.py --csv_dir . --criterion weighted --weights voter_weights.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from hardvote_v2 import CRITERION, csvs_to_hardvoted_csv, save_csv, sv2s_v
+from prediction_io import load_predictions
+
+
+def vote_threshold(n_voter, criterion):
+    """hardvoting의 채택 기준 득표 수"""
+    if criterion == CRITERION.SV_MAJORITY1:
+        return max(n_voter // 2, 1)  # 0표인 slot-value는 Counter에 없으므로 1표 이상
+    return 1 if n_voter == 1 else n_voter // 2 + 1
+
+
+def _group_starts(*keys):
+    """정렬된 key들이 바뀌는 위치 (group의 시작 index)"""
+    change = np.zeros(len(keys[0]), dtype=bool)
+    if len(change):
+        change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+class VoteEngine:
+    """voter들의 prediction ({turn: state}) 목록을 한 번 interning 해두고 criterion별로 voting"""
+
+    def __init__(self, predictions, turns=None):
+        self.n_voter = len(predictions)
+        self.turns = list(predictions[0].keys()) if turns is None else list(turns)
+        self.sv_names, sv_slot = [], []
+        self.sv2id, self.slot2id = sv2id, slot2id = {}, {}
+
+        # entry (voter의 예측 하나)를 turn, voter, state 안의 위치 순서로 -> entry index가 곧 처음 나온 순서
+        turn_ids, voter_ids, sv_ids = [], [], []
+        for t, turn in enumerate(self.turns):
+            for n, prediction in enumerate(predictions):
+                state = prediction[turn]
+                for sv in state:
+                    if sv not in sv2id:
+                        s, _ = sv2s_v(sv)
+                        sv2id[sv] = len(self.sv_names)
+                        self.sv_names.append(sv)
+                        sv_slot.append(slot2id.setdefault(s, len(slot2id)))
+                    sv_ids.append(sv2id[sv])
+                turn_ids.extend([t] * len(state))
+                voter_ids.extend([n] * len(state))
+
+        self.slots = list(slot2id)
+        self.sv_slot = np.array(sv_slot, dtype=np.int64)
+        self.entry_turn = np.array(turn_ids, dtype=np.int64)
+        self.entry_voter = np.array(voter_ids, dtype=np.int64)
+        self.entry_sv = np.array(sv_ids, dtype=np.int64)
+        self.entry_slot = self.sv_slot[self.entry_sv]
+        self._build_candidates()
+
+    def _build_candidates(self):
+        """turn별 후보 (turn, slot-value)의 득표 voter 수 / 처음 나온 entry, slot별 득표 수 / 처음 나온 entry"""
+        t, n, sv = self.entry_turn, self.entry_voter, self.entry_sv
+        idx = np.arange(len(t))
+        S = len(self.slots)
+
+        # slotvalue_counts: voter 하나는 같은 slot-value를 한 번만 센다 (sum_predictions의 set)
+        order = np.lexsort((idx, n, sv, t))
+        is_start = np.zeros(len(order), dtype=bool)
+        is_start[_group_starts(t[order], sv[order])] = True
+        self.entry_cand = np.empty(len(order), dtype=np.int64)
+        self.entry_cand[order] = np.cumsum(is_start) - 1  # entry -> 후보 index (voter_meta 용)
+
+        voter_first = order[_group_starts(t[order], sv[order], n[order])]
+        starts = _group_starts(t[voter_first], sv[voter_first])
+        self.cand_sv = sv[voter_first][starts]
+        self.cand_slot = self.sv_slot[self.cand_sv]
+        self.cand_ts = t[voter_first][starts] * S + self.cand_slot
+        self.cand_count = np.diff(np.append(starts, len(voter_first)))
+        self.cand_first = voter_first[starts]  # voter 순으로 정렬돼 있으므로 group의 첫 entry가 가장 먼저 나온 entry
+        # 후보마다 투표한 voter (weighted voting 용)
+        self.vote_voter = n[voter_first]
+        self.vote_cand = np.repeat(np.arange(len(starts)), self.cand_count)
+
+        # slot_counts: slot은 voter 안에서 중복도 그대로 센다 (sum_predictions의 list)
+        ts = t * S + self.entry_slot
+        self.slot_count = np.bincount(ts, minlength=len(self.turns) * S)
+        order = np.lexsort((idx, ts))
+        slot_starts = _group_starts(ts[order])
+        self.slot_first = np.full(len(self.turns) * S, len(idx), dtype=np.int64)
+        self.slot_first[ts[order][slot_starts]] = order[slot_starts]
+
+    def accepted(self, criterion=CRITERION.default):
+        """채택된 후보 mask"""
+        criterion = criterion.lower()
+        thres = vote_threshold(self.n_voter, criterion)
+        if criterion in (CRITERION.SV_MAJORITY1, CRITERION.SV_MAJORITY2):
+            return self.cand_count >= thres
+        if criterion == CRITERION.SLOT_FIRST_AND_TOP_VALUE:
+            # slot 득표가 기준 이상인 slot에서 가장 많이 받은 value (동률이면 먼저 나온 value, Counter.most_common과 같음)
+            top = np.zeros(len(self.cand_ts), dtype=bool)
+            top[self._top_candidates(self.cand_count)] = True
+            return top & (self.slot_count[self.cand_ts] >= thres)
+        raise ValueError(f"unknown criterion: {criterion}")
+
+    def _top_candidates(self, score):
+        """(turn, slot)마다 score가 가장 높은 후보 index"""
+        order = np.lexsort((self.cand_first, -score, self.cand_ts))
+        return order[_group_starts(self.cand_ts[order])]
+
+    def weighted_scores(self, weights):
+        """후보별 득표 = 투표한 voter의 그 slot weight 합. weights: voters x slots (self.slots 순서)"""
+        w = weights[self.vote_voter, self.cand_slot[self.vote_cand]]
+        return np.bincount(self.vote_cand, weights=w, minlength=len(self.cand_sv))
+
+    def weighted_accepted(self, weights, thresholds):
+        """slot마다 weight 합이 가장 큰 value를 (그 slot 전체 weight 대비 비율이 thresholds[slot] 이상일 때) 채택"""
+        score = self.weighted_scores(weights)
+        top = self._top_candidates(score)
+        slot = self.cand_slot[top]
+        accept = score[top] >= thresholds[slot] * weights.sum(0)[slot] - 1e-9
+        mask = np.zeros(len(self.cand_sv), dtype=bool)
+        mask[top[accept]] = True
+        return mask
+
+    def vote(self, criterion=CRITERION.default):
+        """{turn: [domain-slot-value, ...]} (hardvote_v2.voting2preds 결과와 같은 형식)"""
+        slot_order = criterion.lower() == CRITERION.SLOT_FIRST_AND_TOP_VALUE
+        return self.to_predictions(self.accepted(criterion), slot_order=slot_order)
+
+    def weighted_vote(self, weights, thresholds):
+        return self.to_predictions(self.weighted_accepted(weights, thresholds), slot_order=True)
+
+    def to_predictions(self, mask, slot_order=False):
+        """채택된 후보를 turn별 state로. slot_order면 slot이 처음 나온 순서, 아니면 slot-value가 처음 나온 순서"""
+        S = len(self.slots)
+        cand_ts, cand_sv = self.cand_ts[mask], self.cand_sv[mask]
+        rank = self.slot_first[cand_ts] if slot_order else self.cand_first[mask]
+        order = np.lexsort((rank, cand_ts // S))
+
+        voted = {turn: [] for turn in self.turns}
+        turns, names = self.turns, self.sv_names
+        for t, sv in zip((cand_ts[order] // S).tolist(), cand_sv[order].tolist()):
+            voted[turns[t]].append(names[sv])
+        return voted
+
+    def voter_meta(self, criterion=CRITERION.default):
+        """hardvote_v2.voter_meta와 같은 voter별 통계"""
+        accepted_entry = self.accepted(criterion)[self.entry_cand]
+        win_count = np.bincount(self.entry_voter[accepted_entry], minlength=self.n_voter).tolist()
+        vote_count = np.bincount(self.entry_voter, minlength=self.n_voter).tolist()
+        win_rate = [f"{win_count[i] / vote_count[i] * 100}%" for i in range(self.n_voter)]
+        return dict(win_count=win_count, vote_count=vote_count, n_turns=len(self.turns), win_rate=win_rate)
+
+
+WEIGHT_SCHEMES = ["uniform", "log_odds"]
+THRESHOLDS = np.round(np.arange(0.05, 1.0, 0.05), 2)
+
+
+def _gold_cells(engine, labels):
+    """(turn, slot) 칸마다 gold slot-value id. gold가 없으면 -1, voter가 한 번도 예측하지 않은 value면 -2"""
+    S = len(engine.slots)
+    gold = np.full(len(engine.turns) * S, -1, dtype=np.int64)
+    for t, turn in enumerate(engine.turns):
+        for sv in labels[turn]:
+            s, _ = sv2s_v(sv)
+            if s in engine.slot2id:
+                gold[t * S + engine.slot2id[s]] = engine.sv2id.get(sv, -2)
+    return gold
+
+
+def voter_slot_accuracy(engine, gold):
+    """voter x slot 별 dev accuracy (turn마다 그 slot 값이 gold와 같은 비율, 둘 다 없는 경우 포함)
+
+    틀린 turn = gold가 없는 칸에 예측한 경우 + gold가 있는 칸에서 맞히지 못한 경우 (n_gold - hits).
+    gold가 있는 칸의 잘못된 값은 뒤쪽에 이미 들어가므로 앞쪽에서는 세지 않는다.
+    """
+    N, S, T = engine.n_voter, len(engine.slots), len(engine.turns)
+    entry_gold = gold[engine.entry_turn * S + engine.entry_slot]
+    correct = engine.entry_sv == entry_gold
+    cell = engine.entry_voter * S + engine.entry_slot
+    hits = np.bincount(cell[correct], minlength=N * S).reshape(N, S)
+    false_positive = np.bincount(cell[entry_gold == -1], minlength=N * S).reshape(N, S)
+    n_gold = np.bincount(np.flatnonzero(gold != -1) % S, minlength=S)
+    return 1 - (false_positive + n_gold[None, :] - hits) / T
+
+
+def scheme_weights(accuracy, scheme):
+    if scheme == "uniform":
+        return np.ones_like(accuracy)
+    # log-odds weight (정확도가 높은 voter일수록 크게, 찬스 이하는 0). slot 안에서 모두 0이면 uniform
+    acc = np.clip(accuracy, 1e-3, 1 - 1e-3)
+    weights = np.clip(np.log(acc / (1 - acc)), 0, None)
+    return np.where(weights.sum(0, keepdims=True) > 0, weights, 1.0)
+
+
+def fit_voter_weights(engine, labels, voter_names=None, thresholds=THRESHOLDS):
+    """dev prediction / label로 slot마다 weight scheme과 채택 threshold를 고른다
+
+    slot 별로 (scheme, threshold) 조합 중 그 slot이 gold와 같아지는 turn 수가 가장 많은 것을 고른다.
+    후보 (turn, slot) 칸 전체를 scheme마다 한 번, threshold 전체를 한 번에 비교하므로 voter 수에 거의 무관하게 빠르다.
+    """
+    S = len(engine.slots)
+    gold = _gold_cells(engine, labels)
+    accuracy = voter_slot_accuracy(engine, gold)
+
+    scores = np.zeros((len(WEIGHT_SCHEMES), S, len(thresholds)))
+    all_weights = []
+    for i, scheme in enumerate(WEIGHT_SCHEMES):
+        weights = scheme_weights(accuracy, scheme)
+        all_weights.append(weights)
+        score = engine.weighted_scores(weights)
+        top = engine._top_candidates(score)
+        slot, top_ts = engine.cand_slot[top], engine.cand_ts[top]
+        ratio = score[top] / weights.sum(0)[slot]
+        accept = ratio[:, None] >= thresholds[None, :] - 1e-9
+        correct = np.where(accept, (engine.cand_sv[top] == gold[top_ts])[:, None], (gold[top_ts] == -1)[:, None])
+        for k in range(len(thresholds)):
+            scores[i, :, k] = np.bincount(slot, weights=correct[:, k], minlength=S)
+
+    # slot마다 가장 좋은 (scheme, threshold). 동률이면 uniform / 낮은 threshold 먼저
+    best = scores.transpose(1, 0, 2).reshape(S, -1).argmax(1)
+    best_scheme, best_threshold = np.divmod(best, len(thresholds))
+    weights = np.stack([all_weights[i][:, s] for s, i in enumerate(best_scheme)], 1)
+    return {
+        "voters": voter_names or [str(n) for n in range(engine.n_voter)],
+        "slots": engine.slots,
+        "schemes": [WEIGHT_SCHEMES[i] for i in best_scheme],
+        "weights": weights.tolist(),
+        "thresholds": thresholds[best_threshold].tolist(),
+        "dev_slot_accuracy": accuracy.tolist(),
+    }
+
+
+def params_for_engine(params, engine):
+    """fit 결과를 engine의 slot 순서로. dev에 없던 slot은 uniform weight + 과반수 (sv_majority2와 같은 기준)"""
+    N = engine.n_voter
+    majority = vote_threshold(N, CRITERION.SV_MAJORITY2) / N
+    weights = np.ones((N, len(engine.slots)))
+    thresholds = np.full(len(engine.slots), majority)
+    fitted = {slot: i for i, slot in enumerate(params["slots"])}
+    fitted_weights = np.array(params["weights"], dtype=np.float64).reshape(N, -1)
+    for j, slot in enumerate(engine.slots):
+        if slot in fitted:
+            weights[:, j] = fitted_weights[:, fitted[slot]]
+            thresholds[j] = params["thresholds"][fitted[slot]]
+    return weights, thresholds
+
+
+def joint_goal_accuracy(predictions, labels):
+    return sum(set(predictions[guid]) == set(state) for guid, state in labels.items()) / len(labels)
+
+
+def _prediction_files(csv_dir, names=None):
+    files = names or [file for file in os.listdir(csv_dir) if file.endswith((".csv", ".jsonl"))]
+    return files, [load_predictions(os.path.join(csv_dir, f)) for f in files]
+
+
+def fit(dev_dir, dev_labels_path, output):
+    """dev_dir의 voter별 dev prediction으로 weight를 학습해서 output (json)에 저장"""
+    labels = json.load(open(dev_labels_path, "r"))
+    voter_names, predictions = _prediction_files(dev_dir)
+    print(f"{len(voter_names)} voters : {voter_names}")
+    engine = VoteEngine(predictions, turns=list(labels))
+
+    start = time.perf_counter()
+    params = fit_voter_weights(engine, labels, voter_names)
+    print(f"fitted in {time.perf_counter() - start:.2f}s")
+
+    weighted = engine.weighted_vote(*params_for_engine(params, engine))
+    for criterion in [CRITERION.SV_MAJORITY2, CRITERION.SLOT_FIRST_AND_TOP_VALUE]:
+        print(f"dev joint goal accuracy ({criterion}) : {joint_goal_accuracy(engine.vote(criterion), labels):.4f}")
+    print(f"dev joint goal accuracy (weighted) : {joint_goal_accuracy(weighted, labels):.4f}")
+
+    json.dump(params, open(output, "w"), indent=2, ensure_ascii=False)
+    print(f"weights are saved at {output}")
+    return params
+
+
+def weighted_csvs_to_hardvoted_csv(csv_dir, weights_path, save_dir="./hardvoting_result"):
+    """fit한 weight로 csv_dir의 test prediction을 voting. voter는 dev와 같은 파일 이름으로 찾는다"""
+    params = json.load(open(weights_path, "r"))
+    _, predictions = _prediction_files(csv_dir, params["voters"])
+    engine = VoteEngine(predictions)
+    voted_predictions = engine.weighted_vote(*params_for_engine(params, engine))
+    save_csv(voted_predictions, save_dir)
+    print(f"voted_predictions are saved at {save_dir}")
+    return voted_predictions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs="?", default="vote", choices=["vote", "fit"])
+    parser.add_argument("--csv_dir", type=str, default=".", help="voter prediction (.csv / .jsonl)이 있는 경로")
+    parser.add_argument(
+        "--criterion", type=str, default=CRITERION.SLOT_FIRST_AND_TOP_VALUE,
+        choices=[CRITERION.SV_MAJORITY1, CRITERION.SV_MAJORITY2, CRITERION.SLOT_FIRST_AND_TOP_VALUE, "weighted"],
+    )
+    parser.add_argument("--save_dir", type=str, default="./hardvoting_result")
+    parser.add_argument("--weights", type=str, default="voter_weights.json", help="fit 결과 (weighted voting)")
+    # fit
+    parser.add_argument("--dev_dir", type=str, default=None, help="voter별 dev prediction (test와 같은 파일 이름)")
+    parser.add_argument("--dev_labels", type=str, default=None, help="dev label json ({guid: state})")
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        fit(args.dev_dir, args.dev_labels, args.weights)
+    elif args.criterion == "weighted":
+        weighted_csvs_to_hardvoted_csv(args.csv_dir, args.weights, args.save_dir)
+    else:
+        csvs_to_hardvoted_csv(args.csv_dir, args.criterion, args.save_dir)
@@ -0,0 +1,175 @@
+"""ensemble voter들의 불일치 분석 report (예전 hardvote_v2.show_democarcy의 turn별 출력 대체)
+
+VoteEngine의 정수 배열 위에서 한 번에 계산한다.
+- turn별 불일치율: turn의 후보 slot-value 중 모든 voter가 고르지는 않은 비율
+- slot별: voter들의 값이 갈린 turn 수, 채택 / 탈락한 후보 수
+- voter 쌍별: 두 voter가 고른 (turn, slot-value) 집합의 불일치율 (1 - Jaccard)
+- voter별: 채택 / 탈락된 투표 수 (hardvote_v2.voter_meta 포함)
+- 가장 자주 부딪힌 value 쌍: 값이 갈린 (turn, slot)에서 득표 1, 2위 value
+
+    python vote_report.py --csv_dir . --criterion slot_first_and_top_value --output hardvoting_report.html
+"""
+import argparse
+import html
+import json
+import os
+
+import numpy as np
+
+from hardvote_v2 import CRITERION
+from vote_engine import VoteEngine, _group_starts, _prediction_files
+
+
+def build_report(engine, criterion=CRITERION.default, voter_names=None, top_k=20):
+    N, S, T = engine.n_voter, len(engine.slots), len(engine.turns)
+    voter_names = voter_names or [str(n) for n in range(N)]
+    accepted = engine.accepted(criterion)
+    cand_turn = engine.cand_ts // S
+    unanimous = engine.cand_count == N
+
+    # turn: 후보 중 만장일치가 아닌 비율
+    n_cand = np.bincount(cand_turn, minlength=T)
+    n_split = np.bincount(cand_turn[~unanimous], minlength=T)
+    turn_rate = np.divide(n_split, n_cand, out=np.zeros(T), where=n_cand > 0)
+    discord_turns = np.flatnonzero(n_split)
+    discord_turns = discord_turns[np.argsort(-turn_rate[discord_turns], kind="stable")]
+
+    # slot: 값이 갈린 turn = (turn, slot)에 후보가 둘 이상이거나 하나뿐인 후보를 모든 voter가 고르지는 않은 경우
+    ts, ts_cand = np.unique(engine.cand_ts, return_counts=True)
+    ts_unanimous = np.bincount(engine.cand_ts[unanimous], minlength=T * S)[ts] > 0
+    ts_split = (ts_cand > 1) | ~ts_unanimous
+    per_slot = {}
+    active = np.bincount(ts % S, minlength=S)
+    split = np.bincount(ts[ts_split] % S, minlength=S)
+    slot_accepted = np.bincount(engine.cand_slot[accepted], minlength=S)
+    slot_rejected = np.bincount(engine.cand_slot[~accepted], minlength=S)
+    for j in np.argsort(-split, kind="stable"):
+        per_slot[engine.slots[j]] = {
+            "active_turns": int(active[j]),
+            "split_turns": int(split[j]),
+            "split_rate": float(split[j] / active[j]) if active[j] else 0.0,
+            "accepted": int(slot_accepted[j]),
+            "rejected": int(slot_rejected[j]),
+        }
+
+    # voter 쌍: 후보 x voter 행렬로 공통 (turn, slot-value) 수 -> 1 - |A & B| / |A | B|
+    shared, chunk = np.zeros((N, N)), 65536
+    bounds = np.searchsorted(engine.vote_cand, np.arange(0, len(engine.cand_sv) + chunk, chunk))  # vote_cand는 정렬돼 있음
+    for i, start in enumerate(range(0, len(engine.cand_sv), chunk)):  # 후보가 많아도 memory가 일정하도록 나눠서
+        lo, hi = bounds[i], bounds[i + 1]
+        membership = np.zeros((min(chunk, len(engine.cand_sv) - start), N), dtype=np.float32)
+        membership[engine.vote_cand[lo:hi] - start, engine.vote_voter[lo:hi]] = 1
+        shared += membership.T @ membership
+    picked = np.diag(shared)
+    union = picked[:, None] + picked[None, :] - shared
+    pair_rate = 1 - np.divide(shared, union, out=np.ones_like(shared), where=union > 0)
+
+    # voter: 채택 / 탈락된 투표 (voter_meta와 같은 entry 기준)
+    meta = engine.voter_meta(criterion)
+    per_voter = {
+        name: {
+            "vote_count": meta["vote_count"][n],
+            "win_count": meta["win_count"][n],
+            "rejected_count": meta["vote_count"][n] - meta["win_count"][n],
+            "win_rate": meta["win_rate"][n],
+            "mean_disagreement": float(np.delete(pair_rate[n], n).mean()) if N > 1 else 0.0,
+        }
+        for n, name in enumerate(voter_names)
+    }
+
+    # 부딪힌 value 쌍: 후보가 둘 이상인 (turn, slot)의 득표 1, 2위
+    order = np.lexsort((engine.cand_first, -engine.cand_count, engine.cand_ts))
+    starts = _group_starts(engine.cand_ts[order])
+    sizes = np.diff(np.append(starts, len(order)))
+    first, second = order[starts[sizes > 1]], order[starts[sizes > 1] + 1]
+    a, b = engine.cand_sv[first], engine.cand_sv[second]
+    pair_key = np.minimum(a, b) * len(engine.sv_names) + np.maximum(a, b)
+    keys, counts = np.unique(pair_key, return_counts=True)
+    top = np.argsort(-counts, kind="stable")[:top_k]
+    top_conflicts = [
+        {"values": [engine.sv_names[k // len(engine.sv_names)], engine.sv_names[k % len(engine.sv_names)]], "turns": c}
+        for k, c in zip(keys[top].tolist(), counts[top].tolist())
+    ]
+
+    return {
+        "summary": {
+            "criterion": criterion,
+            "n_voters": N,
+            "n_turns": T,
+            "discord_turns": int(len(discord_turns)),
+            "discord_turn_rate": float(len(discord_turns) / T) if T else 0.0,
+            "candidates": int(len(engine.cand_sv)),
+            "unanimous_candidates": int(unanimous.sum()),
+            "accepted": int(accepted.sum()),
+            "rejected": int((~accepted).sum()),
+        },
+        "per_voter": per_voter,
+        "voter_pairs": {"voters": voter_names, "disagreement": pair_rate.round(4).tolist()},
+        "per_slot": per_slot,
+        "top_conflicts": top_conflicts,
+        "per_turn": {engine.turns[t]: round(float(turn_rate[t]), 4) for t in discord_turns.tolist()},
+    }
+
+
+def _table(header, rows):
+    head = "".join(f"<th>{html.escape(str(h))}</th>" for h in header)
+    body = "".join("<tr>" + "".join(f"<td>{html.escape(str(c))}</td>" for c in row) + "</tr>" for row in rows)
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def to_html(report, max_turns=100):
+    summary, pairs = report["summary"], report["voter_pairs"]
+    sections = [
+        ("summary", _table(["key", "value"], summary.items())),
+        ("voters", _table(
+            ["voter", "votes", "accepted", "rejected", "win rate", "mean disagreement"],
+            [[k, v["vote_count"], v["win_count"], v["rejected_count"], v["win_rate"], f"{v['mean_disagreement']:.4f}"]
+             for k, v in report["per_voter"].items()],
+        )),
+        ("voter pair disagreement", _table(
+            [""] + pairs["voters"],
+            [[name] + [f"{r:.3f}" for r in row] for name, row in zip(pairs["voters"], pairs["disagreement"])],
+        )),
+        ("slots", _table(
+            ["slot", "active turns", "split turns", "split rate", "accepted", "rejected"],
+            [[k, v["active_turns"], v["split_turns"], f"{v['split_rate']:.4f}", v["accepted"], v["rejected"]]
+             for k, v in report["per_slot"].items()],
+        )),
+        ("top conflicting values", _table(
+            ["value 1", "value 2", "turns"], [c["values"] + [c["turns"]] for c in report["top_conflicts"]]
+        )),
+        (f"most disputed turns (top {max_turns})", _table(
+            ["turn", "disagreement"], list(report["per_turn"].items())[:max_turns]
+        )),
+    ]
+    style = "body{font-family:sans-serif}table{border-collapse:collapse;margin-bottom:1em}td,th{border:1px solid #ccc;padding:2px 6px}"
+    body = "".join(f"<h2>{html.escape(title)}</h2>{table}" for title, table in sections)
+    return f"<!DOCTYPE html><html><head><meta charset='utf-8'><style>{style}</style></head><body>{body}</body></html>"
+
+
+def write_report(report, path):
+    """.html이면 표로, 아니면 json으로 저장"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".html"):
+            f.write(to_html(report))
+        else:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv_dir", type=str, default=".", help="voter prediction (.csv / .jsonl)이 있는 경로")
+    parser.add_argument(
+        "--criterion", type=str, default=CRITERION.SLOT_FIRST_AND_TOP_VALUE,
+        choices=[CRITERION.SV_MAJORITY1, CRITERION.SV_MAJORITY2, CRITERION.SLOT_FIRST_AND_TOP_VALUE],
+    )
+    parser.add_argument("--output", type=str, default="hardvoting_report.html", help=".html 또는 .json")
+    parser.add_argument("--top_k", type=int, default=20, help="출력할 conflicting value 쌍 수")
+    args = parser.parse_args()
+
+    voter_names, predictions = _prediction_files(args.csv_dir)
+    report = build_report(VoteEngine(predictions), args.criterion, voter_names, args.top_k)
+    write_report(report, args.output)
+    print(json.dumps(report["summary"], indent=2))
+    print(f"report is saved at {args.output}")
@@ -0,0 +1,143 @@
+"""voter prediction 파일들을 전부 memory에 올리지 않고 turn 순서대로 읽으면서 hard voting
+
+prediction 파일 (predictions.csv의 json 형식 / inference가 streaming으로 쓴 predictions.jsonl)을
+조금씩 읽어서 chunk_size turn씩 VoteEngine으로 voting하고 결과도 바로 파일에 쓴다.
+memory는 turn 수와 무관하게 (voter 수 x chunk_size) 정도로 일정하다.
+turn 순서는 첫 번째 파일의 순서를 따르고, 다른 파일의 순서가 다르면 앞서 나온 turn만 잠시 buffer에 둔다.
+결과 파일은 hardvote_v2.csvs_to_hardvoted_csv (save_csv)가 만드는 것과 같다.
+
+    python vote_stream.py --csv_dir . --criterion slot_first_and_top_value --save_dir ./hardvoting_result
+    python vote_stream.py --csv_dir . --criterion weighted --weights voter_weights.json --output voted.jsonl
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from hardvote_v2 import CRITERION
+from prediction_io import iter_prediction_file
+from vote_engine import VoteEngine, params_for_engine
+
+
+def iter_aligned(iterators):
+    """첫 번째 voter의 turn 순서로 모든 voter의 state를 모아서 (guid, [state, ...])"""
+    first, others = iterators[0], iterators[1:]
+    pending = [{} for _ in others]
+    for guid, state in first:
+        states = [state]
+        for it, buffer in zip(others, pending):
+            while guid not in buffer:
+                try:
+                    g, s = next(it)
+                except StopIteration:
+                    raise KeyError(guid)  # in-memory path (predictions[i][turn])와 같은 오류
+                buffer[g] = s
+            states.append(buffer.pop(guid))
+        yield guid, states
+
+
+class VotedWriter:
+    """voting 결과를 turn 단위로 append. .jsonl이면 한 줄에 한 turn, 아니면 save_csv와 같은 json"""
+
+    def __init__(self, path):
+        self.jsonl = path.endswith(".jsonl")
+        self.f = open(path, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, voted):
+        lines = []
+        for guid, state in voted.items():
+            if self.jsonl:
+                lines.append(json.dumps({"guid": guid, "state": state}, ensure_ascii=False) + "\n")
+            else:
+                # json.dump(indent=2)의 한 항목과 같은 모양
+                value = json.dumps(state, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+                lines.append(f"{',' if self.count else '{'}\n  {json.dumps(guid, ensure_ascii=False)}: {value}")
+            self.count += 1
+        self.f.write("".join(lines))
+
+    def close(self):
+        if not self.jsonl:
+            self.f.write("\n}" if self.count else "{}")
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stream_vote(paths, output_path, criterion=CRITERION.SLOT_FIRST_AND_TOP_VALUE, weights=None, chunk_size=4096):
+    """paths의 prediction을 chunk_size turn씩 voting해서 output_path에 쓰고 voter_meta 통계를 반환
+
+    criterion이 "weighted"면 weights (vote_engine.py fit 결과)로 voting 한다.
+    """
+    n_voter = len(paths)
+    win_count, vote_count = [0] * n_voter, [0] * n_voter
+    n_turns = 0
+
+    def flush(chunk, writer):
+        predictions = [{guid: states[n] for guid, states in chunk} for n in range(n_voter)]
+        engine = VoteEngine(predictions)
+        if criterion == "weighted":
+            weighted, thresholds = params_for_engine(weights, engine)
+            mask = engine.weighted_accepted(weighted, thresholds)
+            writer.write(engine.to_predictions(mask, slot_order=True))
+        else:
+            mask = engine.accepted(criterion)
+            writer.write(engine.vote(criterion))
+        # voter_meta: chunk별 entry 수를 더한다
+        win = np.bincount(engine.entry_voter[mask[engine.entry_cand]], minlength=n_voter)
+        votes = np.bincount(engine.entry_voter, minlength=n_voter)
+        for n in range(n_voter):
+            win_count[n] += int(win[n])
+            vote_count[n] += int(votes[n])
+
+    with VotedWriter(output_path) as writer:
+        chunk = []
+        for guid, states in iter_aligned([iter_prediction_file(p) for p in paths]):
+            chunk.append((guid, states))
+            if len(chunk) == chunk_size:
+                flush(chunk, writer)
+                n_turns += len(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk, writer)
+            n_turns += len(chunk)
+
+    win_rate = [f"{win_count[i] / vote_count[i] * 100}%" for i in range(n_voter)]
+    return dict(win_count=win_count, vote_count=vote_count, n_turns=n_turns, win_rate=win_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv_dir", type=str, default=".", help="voter prediction (.csv / .jsonl)이 있는 경로")
+    parser.add_argument(
+        "--criterion", type=str, default=CRITERION.SLOT_FIRST_AND_TOP_VALUE,
+        choices=[CRITERION.SV_MAJORITY1, CRITERION.SV_MAJORITY2, CRITERION.SLOT_FIRST_AND_TOP_VALUE, "weighted"],
+    )
+    parser.add_argument("--weights", type=str, default="voter_weights.json", help="vote_engine.py fit 결과 (weighted)")
+    parser.add_argument("--save_dir", type=str, default="./hardvoting_result")
+    parser.add_argument("--output", type=str, default=None, help="결과 파일 (기본: save_dir/hardvoting_result.csv)")
+    parser.add_argument("--chunk_size", type=int, default=4096, help="한 번에 voting하는 turn 수")
+    args = parser.parse_args()
+
+    weights = None
+    if args.criterion == "weighted":
+        weights = json.load(open(args.weights, "r"))
+        prediction_files = weights["voters"]  # fit 할 때와 같은 voter 순서
+    else:
+        prediction_files = [file for file in os.listdir(args.csv_dir) if file.endswith((".csv", ".jsonl"))]
+    print(f"{len(prediction_files)} prediction files : {prediction_files} are found at {args.csv_dir}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(args.save_dir, exist_ok=True)
+        output = os.path.join(args.save_dir, "hardvoting_result.csv")
+    statistics = stream_vote(
+        [os.path.join(args.csv_dir, p) for p in prediction_files], output, args.criterion, weights, args.chunk_size
+    )
+    print(f"voted_predictions are saved at {output}")
+    print(f"voting result summary : {statistics}")
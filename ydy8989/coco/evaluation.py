@@ -12,6 +12,14 @@ def metric(probs, labels, thresh):
     return preds, labels
 
 
+def query_flags(preds, labels):
+    """row마다 set(pred) ⊆ set(label) 인지 (0/1 값의 집합 비교)를 mask 연산으로 한 번에"""
+    flags = np.ones(len(preds), dtype=bool)
+    for value in (0, 1):
+        flags &= ~(preds == value).any(-1) | (labels == value).any(-1)
+    return flags
+
+
 def evaluate(model, device, eval_dataloader, thresh=0.5, is_query=False):
 
     model.eval()
@@ -31,7 +39,8 @@ def evaluate(model, device, eval_dataloader, thresh=0.5, is_query=False):
                 attention_mask=input_mask,
             )
         probs = logits.sigmoid()
-        preds, labels = metric(probs, torch.squeeze(target_ids), thresh)
+        # batch가 1개여도 (B, num_labels) 모양이 유지되도록 squeeze 대신 view
+        preds, labels = metric(probs, target_ids.view(-1, target_ids.size(-1)), thresh)
         preds_list.append(preds)
         label_list.append(labels)
 
@@ -45,12 +54,4 @@ def evaluate(model, device, eval_dataloader, thresh=0.5, is_query=False):
         recall = recall_score(all_label, all_pred, average="samples", zero_division=1)
 
         return precision, recall
-    result = []
-    for idx in range(len(all_pred)):
-        pred_set = set(all_pred[idx])
-        gold_set = set(all_label[idx])
-        if pred_set.issubset(gold_set):
-            result.append(True)
-        else:
-            result.append(False)
-    return result
+    return query_flags(all_pred, all_label).tolist()
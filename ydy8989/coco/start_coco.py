@@ -1,4 +1,6 @@
+import argparse
 import json
+import time
 from torch.utils.data import DataLoader, Dataset, RandomSampler, SequentialSampler
 
 from transformers import BartForConditionalGeneration, BertConfig, BertTokenizer
@@ -11,55 +13,89 @@ from model import BertForMultiLabelSequenceClassification
 from collections import defaultdict
 
 
-def get_augmented_uttrs(
-    model, tokenizer, new_turn, device
-):
-    x = convert_example_to_feature(new_turn, tokenizer)
-    input_id = torch.LongTensor([x.input_id]).to(device)
+# BART generation 설정 (turn 단위 / batch 모두 같은 설정)
+GENERATION_KWARGS = dict(
+    max_length=30,
+    early_stopping=True,
+    num_beams=8,
+    top_k=30,
+    temperature=1.5,
+    do_sample=True,
+    num_return_sequences=8,
+)
+
+
+def get_augmented_uttrs_batch(model, tokenizer, new_turns, device):
+    """여러 turn (dialogue가 달라도 됨)을 padding한 batch 하나로 generate -> turn 순서대로 [[uttr, ...], ...]
+
+    sampling은 batch 전체가 하나의 random stream을 쓰므로 같은 seed면 같은 batch 구성에서 같은 결과가 나온다.
+    turn 하나짜리 batch는 padding이 없어서 get_augmented_uttrs (이전의 turn별 generate)와 같다.
+    """
+    input_ids = [convert_example_to_feature(turn, tokenizer).input_id for turn in new_turns]
+    max_length = max(map(len, input_ids))
+    input_ids = torch.LongTensor(
+        [ids + [tokenizer.pad_token_id] * (max_length - len(ids)) for ids in input_ids]
+    ).to(device)
     o = model.generate(
-        input_id,
+        input_ids,
+        attention_mask=input_ids.ne(tokenizer.pad_token_id).long(),
         decoder_start_token_id=tokenizer.bos_token_id,
         bos_token_id=tokenizer.bos_token_id,
         eos_token_id=tokenizer.eos_token_id,
         pad_token_id=tokenizer.pad_token_id,
-        max_length=30,
-        early_stopping=True,
-        num_beams=8,
-        top_k=30,
-        temperature=1.5,
-        do_sample=True,
-        num_return_sequences=8,
+        **GENERATION_KWARGS,
     )
     uttrs = tokenizer.batch_decode(o.tolist(), skip_special_tokens=True)
-    return uttrs
+    # generate 결과는 입력 순서대로 num_return_sequences개씩 붙어 있다
+    n = GENERATION_KWARGS["num_return_sequences"]
+    return [uttrs[i * n : (i + 1) * n] for i in range(len(new_turns))]
 
 
-def classifier_filtering(model, uttrs, example, device, processor):
-    filtered = []
+def get_augmented_uttrs(
+    model, tokenizer, new_turn, device
+):
+    return get_augmented_uttrs_batch(model, tokenizer, [new_turn], device)[0]
+
+
+def classifier_filtering_batch(model, uttrs_list, new_turns, device, processor, batch_size=256):
+    """여러 turn의 후보 uttr를 한 번에 분류해서 turn별로 통과한 uttr list
+
+    후보 전체를 길이 순으로 batch_size개씩 묶어서 (padding 최소화) forward하고 결과는 원래 순서로 되돌린다.
+    """
     examples = [
         CoCoClassifierInputExample(
-            guid=example.guid,
-            system_utter=example.system_utter,
+            guid=new_turn.guid,
+            system_utter=new_turn.system_utter,
             user_utter=uttr,
-            turn_state=example.turn_state,
+            turn_state=new_turn.turn_state,
         )
+        for new_turn, uttrs in zip(new_turns, uttrs_list)
         for uttr in uttrs
     ]
-    features = []
-    for example in examples:
-        features.append(processor.cls_convert_example_to_feature(example))
-    data = CoCoClassifierDataset(features)
+    if not examples:
+        return [[] for _ in uttrs_list]
+    features = [processor.cls_convert_example_to_feature(example) for example in examples]
+    order = sorted(range(len(features)), key=lambda i: len(features[i].input_id))
+    data = CoCoClassifierDataset([features[i] for i in order])
     sampler = SequentialSampler(data)
     dataloader = DataLoader(
-        data, sampler=sampler, batch_size=32, collate_fn=processor.cls_collate_fn
+        data, sampler=sampler, batch_size=batch_size, collate_fn=processor.cls_collate_fn
     )
-    flags = evaluate(model, device, dataloader, is_query=True)
-    for idx, flag in enumerate(flags):
-        if flag:
-            filtered.append(uttrs[idx])
+    flags = [False] * len(features)
+    for i, flag in zip(order, evaluate(model, device, dataloader, is_query=True)):
+        flags[i] = flag
+
+    filtered, start = [], 0
+    for uttrs in uttrs_list:
+        filtered.append([uttr for uttr, flag in zip(uttrs, flags[start : start + len(uttrs)]) if flag])
+        start += len(uttrs)
     return filtered
 
 
+def classifier_filtering(model, uttrs, example, device, processor):
+    return classifier_filtering_batch(model, [uttrs], [example], device, processor, batch_size=32)[0]
+
+
 def match_filtering(new_turn, ori_turn, sentences):
     ori_turn_label_set = ori_turn.turn_state
     new_turn_label_set = new_turn.turn_state
@@ -121,61 +157,129 @@ def convert_examples_to_dialogue(examples):
     return {"dialogue_idx": dialogue_idx, "domains": domains, "dialogue": dialogue}
 
 
-def get_augmented_dialogue(
+def get_augmented_dialogues(
     generator,
     classifier_filter,
     processor,
-    dialogue,
+    dialogues,
     slot_value_dict,
     device,
     slot_comb_dict={},
+    gen_batch_size=32,
+    cls_batch_size=256,
 ):
-    new_turns = []
-    for turn in dialogue:
+    """여러 dialogue의 turn을 모아서 gen_batch_size turn씩 generate 하고, 모든 후보를 cls_batch_size씩 한 번에 filtering
 
-        new_turn = coco_generator(turn, slot_value_dict, slot_comb_dict)
-
-        uttrs = get_augmented_uttrs(
-            generator, processor.gen_tokenizer, new_turn, device
+    coco_generator (python random)는 dialogue / turn 순서대로 부르므로 생성되는 turn_state는 turn별로 할 때와 같다.
+    """
+    new_turns = [
+        [coco_generator(turn, slot_value_dict, slot_comb_dict) for turn in dialogue]
+        for dialogue in dialogues
+    ]
+    flat_turns = [new_turn for turns in new_turns for new_turn in turns]
+    flat_uttrs = []
+    for start in range(0, len(flat_turns), gen_batch_size):
+        flat_uttrs.extend(
+            get_augmented_uttrs_batch(
+                generator, processor.gen_tokenizer, flat_turns[start : start + gen_batch_size], device
+            )
         )
 
-        filter_uttrs = classifier_filtering(
-            classifier_filter, uttrs, new_turn, device, processor
-        )
-        best_uttr = match_filtering(new_turn, turn, filter_uttrs)
-        if best_uttr:
-            new_turn.user_utter = best_uttr
-        else:
-            new_turn = deepcopy(turn)
-        new_turns.append(new_turn)
+    flat_filtered = classifier_filtering_batch(
+        classifier_filter, flat_uttrs, flat_turns, device, processor, cls_batch_size
+    )
 
-    new_dialogue = convert_examples_to_dialogue(new_turns)
-    return new_dialogue
+    new_dialogues = []
+    filtered_iter = iter(flat_filtered)
+    for dialogue, turns in zip(dialogues, new_turns):
+        augmented_turns = []
+        for turn, new_turn in zip(dialogue, turns):
+            filter_uttrs = next(filtered_iter)
+            best_uttr = match_filtering(new_turn, turn, filter_uttrs)
+            if best_uttr:
+                new_turn.user_utter = best_uttr
+            else:
+                new_turn = deepcopy(turn)
+            augmented_turns.append(new_turn)
+        new_dialogues.append(convert_examples_to_dialogue(augmented_turns))
+    return new_dialogues
 
 
+def get_augmented_dialogue(
+    generator,
+    classifier_filter,
+    processor,
+    dialogue,
+    slot_value_dict,
+    device,
+    slot_comb_dict={},
+):
+    return get_augmented_dialogues(
+        generator, classifier_filter, processor, [dialogue], slot_value_dict, device, slot_comb_dict
+    )[0]
+
+
+def set_seed(seed):
+    random.seed(seed)
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
+
+
+def benchmark_generation(model, tokenizer, turns, device, batch_sizes, seed=42):
+    """batch size별 generation 처리량 (turns/sec)"""
+    results = {}
+    for batch_size in batch_sizes:
+        set_seed(seed)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for i in range(0, len(turns), batch_size):
+            get_augmented_uttrs_batch(model, tokenizer, turns[i : i + batch_size], device)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        results[batch_size] = len(turns) / (time.perf_counter() - start)
+        print(f"gen_batch_size {batch_size}: {results[batch_size]:.2f} turns/sec")
+    return results
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="../../input/data/train_dataset")
+    parser.add_argument("--gen_model_name", type=str, default="hyunwoongko/kobart")
+    parser.add_argument("--gen_model_path", type=str, default="../../model/gen_model.bin")
+    parser.add_argument("--cls_model_name", type=str, default="dsksd/bert-ko-small-minimal")
+    parser.add_argument("--cls_model_path", type=str, default="../../model/cls_model.bin")
+    parser.add_argument("--start", type=int, default=1500, help="augment할 dialogue 범위 [start, end)")
+    parser.add_argument("--end", type=int, default=3000)
+    parser.add_argument("--output", type=str, default=None, help="기본: data_dir/{start}_{end}.json")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--gen_batch_size", type=int, default=32, help="한 번에 generate하는 turn 수 (1이면 turn별)")
+    parser.add_argument("--cls_batch_size", type=int, default=256, help="classifier filtering batch size (turn 구분 없이)")
+    parser.add_argument("--dialogue_chunk", type=int, default=64, help="turn을 모아서 처리하는 dialogue 수")
+    parser.add_argument(
+        "--bench_batch_sizes", type=int, nargs="*", default=None,
+        help="주어지면 augmentation 대신 batch size별 generation turns/sec 만 측정",
+    )
+    parser.add_argument("--bench_turns", type=int, default=256, help="benchmark에 쓰는 turn 수")
+    args = parser.parse_args()
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    gen_model_path = "../../model/gen_model.bin"
-    gen_model_name = "hyunwoongko/kobart"
-    gen_model = BartForConditionalGeneration.from_pretrained(gen_model_name)
-    gen_tokenizer = PreTrainedTokenizerFast.from_pretrained(gen_model_name)
-    ckpt = torch.load("../../model/gen_model.bin")
+    gen_model = BartForConditionalGeneration.from_pretrained(args.gen_model_name)
+    gen_tokenizer = PreTrainedTokenizerFast.from_pretrained(args.gen_model_name)
+    ckpt = torch.load(args.gen_model_path)
     gen_model.load_state_dict(ckpt)
     gen_model.to(device)
 
-    cls_model_path = "../../model/cls_model.bin"
-    cls_model_name = "dsksd/bert-ko-small-minimal"
-    data = json.load(open('../../input/data/train_dataset/train_dials.json','rt',encoding='UTF8'))
+    data = json.load(open(f'{args.data_dir}/train_dials.json','rt',encoding='UTF8'))
 
-    slot_meta = json.load(open('../../input/data/train_dataset/slot_meta.json','rt',encoding='UTF8'))
-    cls_tokenizer = BertTokenizer.from_pretrained(cls_model_name)
-    bert_config = BertConfig.from_pretrained(cls_model_name, num_labels=len(slot_meta))
-    bert_config.model_name_or_path = cls_model_name
+    slot_meta = json.load(open(f'{args.data_dir}/slot_meta.json','rt',encoding='UTF8'))
+    cls_tokenizer = BertTokenizer.from_pretrained(args.cls_model_name)
+    bert_config = BertConfig.from_pretrained(args.cls_model_name, num_labels=len(slot_meta))
+    bert_config.model_name_or_path = args.cls_model_name
     bert_config.num_labels = len(slot_meta)
-    cls_model = BertForMultiLabelSequenceClassification.from_pretrained(cls_model_name, config=bert_config)
-    ckpt = torch.load("../../model/cls_model.bin")
+    cls_model = BertForMultiLabelSequenceClassification.from_pretrained(args.cls_model_name, config=bert_config)
+    ckpt = torch.load(args.cls_model_path)
     cls_model.load_state_dict(ckpt)
     cls_model.to(device)
 
@@ -184,21 +288,35 @@ if __name__ == "__main__":
     processor = CoCoPreprocessor(slot_meta, gen_tokenizer, cls_tokenizer, bert_config)
 
 
-    slot_value_dict = json.load(open('../../input/data/train_dataset/new_ontology.json','rt',encoding='UTF8'))
+    slot_value_dict = json.load(open(f'{args.data_dir}/new_ontology.json','rt',encoding='UTF8'))
     with open("coco_data/slot_comb_dict.pkl", "rb") as f:
         slot_comb_dict = pickle.load(f)
 
-    augmented = []
-    for dialogue in tqdm(coco_examples[1500:3000]):
-        new_dialogue = get_augmented_dialogue(
-            gen_model,
-            cls_model,
-            processor,
-            dialogue,
-            slot_value_dict,
-            device,
-            slot_comb_dict,
-        )
-        augmented.append(new_dialogue)
-    with open("../../input/data/train_dataset/1500_3000.json", "w", encoding='UTF8') as f:
-        json.dump(augmented, f)
\ No newline at end of file
+    set_seed(args.seed)
+    dialogues = coco_examples[args.start:args.end]
+    if args.bench_batch_sizes:
+        turns = [
+            coco_generator(turn, slot_value_dict, slot_comb_dict) for dialogue in dialogues for turn in dialogue
+        ][: args.bench_turns]
+        gen_model.eval()
+        with torch.no_grad():
+            benchmark_generation(gen_model, gen_tokenizer, turns, device, args.bench_batch_sizes, args.seed)
+    else:
+        augmented = []
+        for i in tqdm(range(0, len(dialogues), args.dialogue_chunk)):
+            augmented.extend(
+                get_augmented_dialogues(
+                    gen_model,
+                    cls_model,
+                    processor,
+                    dialogues[i : i + args.dialogue_chunk],
+                    slot_value_dict,
+                    device,
+                    slot_comb_dict,
+                    args.gen_batch_size,
+                    args.cls_batch_size,
+                )
+            )
+        output = args.output or f"{args.data_dir}/{args.start}_{args.end}.json"
+        with open(output, "w", encoding='UTF8') as f:
+            json.dump(augmented, f)
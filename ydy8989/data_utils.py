@@ -1,4 +1,5 @@
 import dataclasses
+import hashlib
 import json
 import random
 from collections import defaultdict
@@ -6,6 +7,8 @@ from copy import deepcopy
 from dataclasses import dataclass
 from typing import List, Optional, Union
 import os
+import shutil
+
 import numpy as np
 import torch
 from torch.utils.data import Dataset
@@ -42,6 +45,27 @@ class WOSDataset(Dataset):
         return self.features[idx]
 
 
+class UtteranceCacheDataset(Dataset):
+    """SUMBT feature와 cache된 utterance encoder output을 함께 반환하는 dataset
+
+    cache는 실제 turn만 feature 순서대로 이어붙인 [num_turns, N, H] fp16 .npy 파일이다.
+    """
+
+    def __init__(self, features, cache_path):
+        self.features = features
+        self.length = len(self.features)
+        self.hidden = np.load(cache_path, mmap_mode="r")
+        self.offsets = np.cumsum([0] + [f.num_turn for f in features])
+        assert self.offsets[-1] == len(self.hidden), "utterance cache does not match features"
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.features[idx], self.hidden[start:end]
+
+
 def load_dataset(dataset_path, dev_split=0.1):
     data = json.load(open(dataset_path))
     num_data = len(data)
@@ -270,3 +294,85 @@ def tokenize_ontology(ontology, tokenizer, max_seq_length=12):
             slot_value.append(tokens)
         slot_values.append(torch.LongTensor(slot_value))
     return torch.LongTensor(slot_types), slot_values
+
+
+WEIGHT_FILES = ("pytorch_model.bin", "tf_model.h5", "model.ckpt.index", "flax_model.msgpack", "config.json")
+
+
+def weights_fingerprint(model_name_or_path):
+    """encoder weight 파일의 (이름, 크기, mtime) 목록. 같은 경로에 다시 학습한 weight를 덮어쓰면 달라진다
+
+    local 경로가 아니면 (huggingface model id) 이미 download된 cache 파일로 확인한다.
+    cache 파일 이름에 etag가 들어가므로 hub에서 weight가 바뀌면 경로가 달라진다.
+    """
+    if os.path.isfile(model_name_or_path):
+        paths = [model_name_or_path]
+    elif os.path.isdir(model_name_or_path):
+        paths = [os.path.join(model_name_or_path, name) for name in WEIGHT_FILES]
+    else:
+        from transformers.file_utils import WEIGHTS_NAME, cached_path, hf_bucket_url
+
+        try:
+            paths = [cached_path(hf_bucket_url(model_name_or_path, WEIGHTS_NAME), local_files_only=True)]
+        except (EnvironmentError, ValueError):  # download 전이면 이름만으로 구분
+            return []
+    return [
+        [os.path.abspath(path), os.path.getsize(path), os.stat(path).st_mtime_ns]
+        for path in paths
+        if os.path.exists(path)
+    ]
+
+
+def slot_value_cache_path(cache_dir, model_name_or_path, ontology, max_label_length=12):
+    """(encoder checkpoint와 그 weight 파일, ontology, max_label_length) 조합마다 하나의 cache 경로"""
+    key = json.dumps(
+        [model_name_or_path, weights_fingerprint(model_name_or_path), ontology, max_label_length],
+        ensure_ascii=False,
+    )
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+def save_slot_value_cache(path, hid_slot, hid_labels):
+    """slot embedding [J, H]과 value embedding J x [V_j, H]을 .npy로 저장
+
+    다른 process와 경로가 겹쳐도 깨진 cache가 보이지 않도록 임시 경로에 쓴 뒤 rename 한다.
+    """
+    if os.path.exists(path):
+        return
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    np.save(os.path.join(tmp_path, "slot.npy"), hid_slot.detach().cpu().float().numpy())
+    np.save(
+        os.path.join(tmp_path, "value.npy"),
+        torch.cat([h.detach().cpu().float() for h in hid_labels]).numpy(),
+    )
+    json.dump(
+        {"num_labels": [h.size(0) for h in hid_labels]},
+        open(os.path.join(tmp_path, "meta.json"), "w"),
+    )
+    try:
+        os.rename(tmp_path, path)
+    except OSError:  # 먼저 저장한 process가 있음
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_slot_value_cache(path):
+    """cache가 있으면 memory-map으로 (hid_slot, hid_labels)를 읽고, 없으면 None"""
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    num_labels = json.load(open(os.path.join(path, "meta.json")))["num_labels"]
+    # copy-on-write mmap: 실제로 접근하는 page만 읽고, 파일은 수정하지 않는다
+    hid_slot = torch.from_numpy(np.load(os.path.join(path, "slot.npy"), mmap_mode="c"))
+    hid_value = torch.from_numpy(np.load(os.path.join(path, "value.npy"), mmap_mode="c"))
+    hid_labels = list(torch.split(hid_value, num_labels))
+    return hid_slot, hid_labels
+
+
+def utterance_cache_path(cache_dir, model_name_or_path, features, max_seq_length=64):
+    """feature 구성 (guid, turn 수)과 encoder checkpoint (weight 파일 포함)가 같을 때만 cache를 재사용"""
+    key = json.dumps(
+        [model_name_or_path, weights_fingerprint(model_name_or_path), max_seq_length,
+         [(f.guid, f.num_turn) for f in features]],
+        ensure_ascii=False,
+    )
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
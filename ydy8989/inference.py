@@ -28,13 +28,15 @@ def inference_sumbt(model, eval_loader, processor, device):
     predictions = {}
 
     for step, batch in tqdm(enumerate(eval_loader), total=len(eval_loader)):
-        input_ids, segment_ids, input_masks, target_ids, num_turns, guids = \
-            [b.to(device) if not isinstance(b, list) else b for b in batch]
+        batch = [b.to(device) if not isinstance(b, list) else b for b in batch]
+        input_ids, segment_ids, input_masks, target_ids, num_turns, guids = batch[:6]
+        utterance_hidden = batch[6] if len(batch) > 6 else None  # cached_collate_fn
 
         # 변경 시작
         with torch.no_grad():
             with autocast(enabled=use_amp):
-                output, pred_slot = model(input_ids, segment_ids, input_masks, None, 1)
+                output, pred_slot = model(input_ids, segment_ids, input_masks, None, 1, num_turns=num_turns,
+                                          utterance_hidden=utterance_hidden)
         # 변경 끝
 
         pred_slot = pred_slot.detach().cpu()
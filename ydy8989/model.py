@@ -6,6 +6,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn import CosineEmbeddingLoss, CrossEntropyLoss
+from torch.nn.utils.rnn import pad_sequence
 from transformers import BertModel, BertPreTrainedModel
 
 def masked_cross_entropy_for_value(logits, target, pad_idx=0):
@@ -320,6 +321,7 @@ class SUMBT(nn.Module):
         self.num_labels = num_labels
         self.num_slots = len(num_labels)
         self.attn_head = args.attn_head
+        self.model_name_or_path = args.model_name_or_path
         self.device = device
 
         ### Utterance Encoder
@@ -332,18 +334,16 @@ class SUMBT(nn.Module):
             for p in self.utterance_encoder.bert.pooler.parameters():
                 p.requires_grad = False
 
-        ### slot, slot-value Encoder (not trainable)
-        self.sv_encoder = BertForUtteranceEncoding.from_pretrained(
-            args.model_name_or_path
-        )
-        # os.path.join(args.bert_dir, 'bert-base-uncased.model'))
-        for p in self.sv_encoder.bert.parameters():
-            p.requires_grad = False
-
+        ### slot, slot-value lookup
+        # slot, slot-value Encoder (not trainable)는 initialize_slot_value_lookup에서만 잠깐 생성한다.
+        # cache된 embedding을 set_slot_value_lookup으로 넣으면 두번째 BERT를 만들지 않는다.
         self.slot_lookup = nn.Embedding(self.num_slots, self.bert_output_dim)
         self.value_lookup = nn.ModuleList(
             [nn.Embedding(num_label, self.bert_output_dim) for num_label in num_labels]
         )
+        # 모든 slot의 value embedding을 하나로 packing한 [J, Vmax, H] 텐서 (frozen lookup일 때만 캐싱)
+        self.register_buffer("value_table", None, persistent=False)
+        self.register_buffer("value_mask", None, persistent=False)
 
         ### Attention layer
         self.attn = MultiHeadAttention(self.attn_head, self.bert_output_dim, dropout=0)
@@ -368,50 +368,100 @@ class SUMBT(nn.Module):
         self.linear = nn.Linear(self.hidden_dim, self.bert_output_dim)
         self.layer_norm = nn.LayerNorm(self.bert_output_dim)
 
-        ### Measure
-        self.metric = torch.nn.PairwiseDistance(p=2.0, eps=1e-06, keepdim=False)
-
         ### Classifier
-        self.nll = CrossEntropyLoss(ignore_index=-1)
+        self.nll = CrossEntropyLoss(ignore_index=-1, reduction="none")
 
         ### Etc.
         self.dropout = nn.Dropout(self.hidden_dropout_prob)
 
     def initialize_slot_value_lookup(self, label_ids, slot_ids):
+        sv_encoder = BertForUtteranceEncoding.from_pretrained(self.model_name_or_path)
+        sv_encoder.to(slot_ids.device)
+        sv_encoder.eval()
+
+        with torch.no_grad():
+            # Slot encoding
+            slot_type_ids = torch.zeros(slot_ids.size(), dtype=torch.long).to(
+                slot_ids.device
+            )
+            slot_mask = slot_ids > 0
+            hid_slot, _ = sv_encoder(
+                slot_ids.view(-1, self.max_label_length),
+                slot_type_ids.view(-1, self.max_label_length),
+                slot_mask.view(-1, self.max_label_length),
+            )
+            hid_slot = hid_slot[:, 0, :]
+
+            hid_labels = []
+            for label_id in label_ids:
+                label_type_ids = torch.zeros(label_id.size(), dtype=torch.long).to(
+                    label_id.device
+                )
+                label_mask = label_id > 0
+                hid_label, _ = sv_encoder(
+                    label_id.view(-1, self.max_label_length),
+                    label_type_ids.view(-1, self.max_label_length),
+                    label_mask.view(-1, self.max_label_length),
+                )
+                hid_labels.append(hid_label[:, 0, :])
+
+        self.set_slot_value_lookup(hid_slot, hid_labels)
+        print("Complete initialization of slot and value lookup")
 
-        self.sv_encoder.eval()
+    def set_slot_value_lookup(self, hid_slot, hid_labels):
+        # hid_slot: [J, H], hid_labels: J x [V_j, H] (sv_encoder의 [CLS] output)
+        self.slot_lookup = nn.Embedding.from_pretrained(hid_slot.detach(), freeze=True)
+        for s, hid_label in enumerate(hid_labels):
+            self.value_lookup[s] = nn.Embedding.from_pretrained(hid_label.detach(), freeze=True)
+            self.value_lookup[s].padding_idx = -1
+        self.refresh_value_table()
 
-        # Slot encoding
-        slot_type_ids = torch.zeros(slot_ids.size(), dtype=torch.long).to(
-            slot_ids.device
+    def build_value_table(self):
+        # value_lookup: J x [V_j, H] => [J, Vmax, H], validity mask [J, Vmax]
+        table = pad_sequence(
+            [lookup.weight for lookup in self.value_lookup], batch_first=True
         )
-        slot_mask = slot_ids > 0
-        hid_slot, _ = self.sv_encoder(
-            slot_ids.view(-1, self.max_label_length),
-            slot_type_ids.view(-1, self.max_label_length),
-            slot_mask.view(-1, self.max_label_length),
-        )
-        hid_slot = hid_slot[:, 0, :]
-        hid_slot = hid_slot.detach()
-        self.slot_lookup = nn.Embedding.from_pretrained(hid_slot, freeze=True)
+        num_labels = torch.tensor(self.num_labels, device=table.device)
+        mask = torch.arange(table.size(1), device=table.device).unsqueeze(0) < num_labels.unsqueeze(1)
+        return table, mask
+
+    def refresh_value_table(self):
+        # value lookup이 학습되지 않을 때만 packing 결과를 buffer로 재사용한다
+        if any(lookup.weight.requires_grad for lookup in self.value_lookup):
+            self.value_table, self.value_mask = None, None
+            return
+        table, mask = self.build_value_table()
+        self.value_table, self.value_mask = table.detach(), mask
+
+    def load_state_dict(self, state_dict, strict=True):
+        result = super(SUMBT, self).load_state_dict(state_dict, strict)
+        self.refresh_value_table()
+        return result
+
+    def encode_utterance(self, input_ids, token_type_ids, attention_mask, num_turns=None):
+        # dummy turn (padding으로만 이루어진 turn)은 BERT에 넣지 않고 0으로 채운다
+        ds, ts = input_ids.size(0), input_ids.size(1)
+        if num_turns is None:
+            turn_mask = attention_mask[:, :, 0].bool()  # 실제 turn은 항상 [CLS]로 시작
+        else:
+            num_turns = torch.as_tensor(num_turns, device=input_ids.device)
+            turn_mask = torch.arange(ts, device=input_ids.device).unsqueeze(0) < num_turns.unsqueeze(1)
+        turn_mask = turn_mask.view(-1)  # [B*M]
 
-        for s, label_id in enumerate(label_ids):
-            label_type_ids = torch.zeros(label_id.size(), dtype=torch.long).to(
-                label_id.device
-            )
-            label_mask = label_id > 0
-            hid_label, _ = self.sv_encoder(
-                label_id.view(-1, self.max_label_length),
-                label_type_ids.view(-1, self.max_label_length),
-                label_mask.view(-1, self.max_label_length),
-            )
-            hid_label = hid_label[:, 0, :]
-            hid_label = hid_label.detach()
-            self.value_lookup[s] = nn.Embedding.from_pretrained(hid_label, freeze=True)
-            self.value_lookup[s].padding_idx = -1
+        attention_mask = attention_mask.view(-1, self.max_seq_length)[turn_mask]
+        hidden, _ = self.utterance_encoder(
+            input_ids.view(-1, self.max_seq_length)[turn_mask],
+            token_type_ids.view(-1, self.max_seq_length)[turn_mask],
+            attention_mask,
+        )
+        hidden = torch.mul(
+            hidden, attention_mask.unsqueeze(-1).expand(hidden.size()).float()
+        )
 
-        print("Complete initialization of slot and value lookup")
-        self.sv_encoder = None
+        # [B*M, N, H] layout으로 되돌림, dummy turn 위치는 0
+        output = hidden.new_zeros(ds * ts, self.max_seq_length, hidden.size(-1))
+        output[turn_mask] = hidden
+        return output
 
     def forward(
         self,
@@ -421,11 +471,15 @@ class SUMBT(nn.Module):
         labels=None,
         n_gpu=1,
         target_slot=None,
+        num_turns=None,
+        utterance_hidden=None,
     ):
         # input_ids: [B, M, N]
         # token_type_ids: [B, M, N]
         # attention_mask: [B, M, N]
         # labels: [B, M, J]
+        # num_turns: [B] 각 dialogue의 실제 turn 수 (나머지는 dummy turn)
+        # utterance_hidden: [B, M, N, H] 미리 계산해둔 utterance encoder output (frozen encoder일 때)
 
         # if target_slot is not specified, output values corresponding all slot-types
         if target_slot is None:
@@ -437,17 +491,12 @@ class SUMBT(nn.Module):
         slot_dim = len(target_slot)  # J
 
         # Utterance encoding
-        hidden, _ = self.utterance_encoder(
-            input_ids.view(-1, self.max_seq_length),
-            token_type_ids.view(-1, self.max_seq_length),
-            attention_mask.view(-1, self.max_seq_length),
-        )
-        hidden = torch.mul(
-            hidden,
-            attention_mask.view(-1, self.max_seq_length, 1)
-            .expand(hidden.size())
-            .float(),
-        )
+        if utterance_hidden is None:
+            hidden = self.encode_utterance(
+                input_ids, token_type_ids, attention_mask, num_turns
+            )  # [B*M, N, H]
+        else:
+            hidden = utterance_hidden.view(-1, self.max_seq_length, self.bert_output_dim)
         hidden = hidden.repeat(slot_dim, 1, 1)  # [J*M*B, N, H]
 
         hid_slot = self.slot_lookup.weight[
@@ -489,45 +538,36 @@ class SUMBT(nn.Module):
             rnn_out, _ = self.nbt(hidden, (h, c))  # [slot_dim*ds, turn, hidden]
         rnn_out = self.layer_norm(self.linear(self.dropout(rnn_out)))
 
-        hidden = rnn_out.view(slot_dim, ds, ts, -1)  # [J, B, M, H_GRU]
+        hidden = rnn_out.view(slot_dim, ds * ts, -1)  # [J, B*M, H_GRU]
 
         # Label (slot-value) encoding
-        loss = 0
-        loss_slot = []
-        pred_slot = []
-        output = []
-        for s, slot_id in enumerate(target_slot):  ## note: target_slots are successive
-            # loss calculation
-            hid_label = self.value_lookup[slot_id].weight
-            num_slot_labels = hid_label.size(0)
-
-            _hid_label = (
-                hid_label.unsqueeze(0)
-                .unsqueeze(0)
-                .repeat(ds, ts, 1, 1)
-                .view(ds * ts * num_slot_labels, -1)
-            )
-            _hidden = (
-                hidden[s, :, :, :]
-                .unsqueeze(2)
-                .repeat(1, 1, num_slot_labels, 1)
-                .view(ds * ts * num_slot_labels, -1)
-            )
-            _dist = self.metric(_hid_label, _hidden).view(ds, ts, num_slot_labels)
-            _dist = -_dist
-            _, pred = torch.max(_dist, -1)
-            pred_slot.append(pred.view(ds, ts, 1))
-            output.append(_dist)
-
-            if labels is not None:
-                _loss = self.nll(_dist.view(ds * ts, -1), labels[:, :, s].view(-1))
-                loss_slot.append(_loss.item())
-                loss += _loss
-
-        pred_slot = torch.cat(pred_slot, 2)
+        if self.value_table is not None:
+            value_table, value_mask = self.value_table, self.value_mask
+        else:
+            value_table, value_mask = self.build_value_table()
+        value_table = value_table[target_slot]  # [J, Vmax, H]
+        value_mask = value_mask[target_slot]  # [J, Vmax]
+
+        # 모든 slot의 distance를 한번에 계산, padding value는 선택되지 않도록 masking
+        dist = -torch.cdist(hidden, value_table)  # [J, B*M, Vmax]
+        dist = dist.masked_fill(~value_mask.unsqueeze(1), torch.finfo(dist.dtype).min)
+
+        _, pred = torch.max(dist, -1)  # [J, B*M]
+        pred_slot = pred.view(slot_dim, ds, ts).permute(1, 2, 0)  # [B, M, J]
+        output = [
+            dist[s].view(ds, ts, -1)[:, :, : self.num_labels[slot_id]]
+            for s, slot_id in enumerate(target_slot)
+        ]
         if labels is None:
             return output, pred_slot
 
+        # loss calculation
+        slot_labels = labels.permute(2, 0, 1).reshape(slot_dim, -1)  # [J, B*M]
+        _loss = self.nll(dist.transpose(1, 2), slot_labels)  # [J, B*M]
+        _loss = _loss.sum(-1) / slot_labels.ne(-1).sum(-1).float()  # [J]
+        loss = _loss.sum()
+        loss_slot = _loss.tolist()
+
         # calculate joint accuracy
         accuracy = (pred_slot == labels).view(-1, slot_dim)
         acc_slot = (
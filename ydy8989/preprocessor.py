@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 from data_utils import DSTPreprocessor, OpenVocabDSTFeature, convert_state_dict, _truncate_seq_pair, OntologyDSTFeature
 
@@ -198,4 +199,16 @@ class SUMBTPreprocessor(DSTPreprocessor):
         input_masks = input_ids.ne(self.src_tokenizer.pad_token_id)
         target_ids = torch.LongTensor([b.target_ids for b in batch])
         num_turns = [b.num_turn for b in batch]
-        return input_ids, segment_ids, input_masks, target_ids, num_turns, guids
\ No newline at end of file
+        return input_ids, segment_ids, input_masks, target_ids, num_turns, guids
+
+    def cached_collate_fn(self, batch):
+        # UtteranceCacheDataset용: 기존 tensor들 + cache된 utterance encoder output [B, M, N, H]
+        features = [b[0] for b in batch]
+        outputs = self.collate_fn(features)
+        hidden_size = batch[0][1].shape[-1]
+        utterance_hidden = torch.zeros(
+            len(batch), self.max_turn_length, self.max_seq_length, hidden_size
+        )
+        for i, (_, hidden) in enumerate(batch):
+            utterance_hidden[i, : len(hidden)] = torch.from_numpy(np.asarray(hidden, dtype=np.float32))
+        return outputs + (utterance_hidden,)
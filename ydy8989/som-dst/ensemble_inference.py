@@ -0,0 +1,302 @@
+"""TRADE / SOM-DST checkpoint 여러 개를 한 process에서 soft voting (확률 평균) 하는 inference
+
+hard voting (hard_voting.py)은 model별 prediction 파일을 만든 뒤 값을 투표하지만, 여기서는 확률을 평균한 뒤 decode 한다.
+- feature extraction / collate는 family (TRADE / SOM-DST) 별로 한 번만 하고 모든 checkpoint가 같은 batch를 쓴다
+- TRADE: gate 확률을 평균. value는 step마다 모든 decoder의 token 분포 (p_final)를 평균해서 argmax token을
+  모든 decoder의 다음 입력으로 넣는다
+- SOM-DST: op 확률을 평균해서 update slot을 정하고 (모든 model이 같은 slot을 decode), value는 TRADE와 같이 step마다 평균
+- 두 family가 다 주어지면 입력 / vocab이 달라서 확률을 직접 섞을 수 없으므로, slot마다 평균 확률 (gate / op)의
+  max가 더 큰 family의 값을 쓴다. 이렇게 합친 state가 SOM-DST의 다음 turn 입력 (이전 state)이 된다.
+같은 family의 checkpoint는 같은 tokenizer (model_name_or_path)를, 모든 checkpoint는 같은 slot_meta를 써야 한다.
+
+    python ensemble_inference.py --data_dir /opt/ml/input/data/eval_dataset --output_dir /opt/ml/predictions/ensemble \
+        --trade_models results/trade1/model-29.bin results/trade2/model-29.bin \
+        --somdst_models /opt/ml/result/SOMDST/model-17.bin /opt/ml/result/SOMDST2/model-20.bin
+"""
+import argparse
+import json
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, SequentialSampler
+from tqdm import tqdm
+from transformers import BertTokenizer
+
+from data_utils import WOSDataset, convert_state_dict, get_examples_from_dialogues
+from eval_utils import StreamingDSTEvaluator
+from inference import postprocess_state
+from models import SOMDST, TRADE, TRADEBERT
+# prediction jsonl 읽기 / 쓰기는 repo root의 prediction_io.py 하나를 같이 쓴다
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from prediction_io import PredictionWriter, jsonl_to_csv
+from preprocessor import SOMDSTPreprocessor, TRADEPreprocessor
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def _load_config(checkpoint):
+    """checkpoint (model-{epoch}.bin)와 같은 경로의 exp_config.json / slot_meta.json"""
+    model_dir_path = os.path.dirname(checkpoint)
+    config = json.load(open(f"{model_dir_path}/exp_config.json", "r"))
+    slot_meta = json.load(open(f"{model_dir_path}/slot_meta.json", "r"))
+    return argparse.Namespace(**config), slot_meta
+
+
+def _shared_slot_meta(checkpoints):
+    slot_metas = [_load_config(checkpoint)[1] for checkpoint in checkpoints]
+    if any(s != slot_metas[0] for s in slot_metas):
+        raise ValueError(f"checkpoints use different slot_meta: {checkpoints}")
+    return slot_metas[0]
+
+
+def _shared_config(checkpoints):
+    """feature를 공유하려면 tokenizer와 slot_meta가 같아야 한다"""
+    configs = [_load_config(checkpoint)[0] for checkpoint in checkpoints]
+    if len({c.model_name_or_path for c in configs}) > 1:
+        raise ValueError(f"checkpoints use different tokenizers (model_name_or_path): {checkpoints}")
+    return configs, _shared_slot_meta(checkpoints)
+
+
+def load_trade_models(checkpoints, device):
+    """TRADE / TRADEBERT checkpoint들과 공유할 TRADEPreprocessor (encoder는 state dict key로 구분)"""
+    configs, slot_meta = _shared_config(checkpoints)
+    tokenizer = BertTokenizer.from_pretrained(configs[0].model_name_or_path)
+    processor = TRADEPreprocessor(slot_meta, tokenizer, max_seq_length=512, word_drop=0)
+    models = []
+    for checkpoint, config in zip(checkpoints, configs):
+        tokenized_slot_meta = [
+            tokenizer.encode(slot.replace("-", " "), add_special_tokens=False) for slot in slot_meta
+        ]
+        ckpt = torch.load(checkpoint, map_location="cpu")
+        model_class = TRADEBERT if any(k.startswith("encoder.bert.") for k in ckpt) else TRADE
+        model = model_class(config, tokenized_slot_meta)
+        model.load_state_dict(ckpt)
+        models.append(model.to(device).eval())
+    return models, processor
+
+
+def load_somdst_models(checkpoints, device):
+    configs, slot_meta = _shared_config(checkpoints)
+    tokenizer = BertTokenizer.from_pretrained(configs[0].model_name_or_path)
+    tokenizer.add_special_tokens({"additional_special_tokens": ["[SLOT]", "[NULL]", "[EOS]"]})
+    processor = SOMDSTPreprocessor(slot_meta, tokenizer, max_seq_length=512)
+    models = []
+    for checkpoint, config in zip(checkpoints, configs):
+        model = SOMDST(config, 5, 6, processor.op2id["update"])
+        model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+        models.append(model.to(device).eval())
+    return models, processor
+
+
+def trade_generate(models, input_ids, segment_ids, input_masks, max_len=9):
+    """평균 gate 확률 (B,J,n_gate)과 step마다 평균 token 분포의 argmax로 generate한 token id (B,J,max_len)"""
+    batch_size = input_ids.size(0)
+    J = len(models[0].decoder.slot_embed_idx)
+    states = []
+    for model in models:
+        encoder_output, hidden = model.encode(input_ids, segment_ids, input_masks)
+        states.append(list(model.decoder._expand_slots(input_ids, encoder_output, hidden, input_masks.ne(1))))
+
+    gate_probs = 0
+    point_ids = []
+    for k in range(max_len):
+        p_final = 0
+        for model, state in zip(models, states):
+            p, state[1], context = model.decoder._decode_step(*state)
+            p_final = p_final + p
+            if k == 0:
+                gate_probs = gate_probs + F.softmax(model.decoder.w_gate(context.squeeze(1)), -1)
+        _, w_idx = (p_final / len(models)).max(-1)
+        for model, state in zip(models, states):
+            state[0] = model.decoder.embedding(w_idx).unsqueeze(1)  # 모든 decoder가 같은 token을 다음 입력으로
+        point_ids.append(w_idx.view(batch_size, J))
+    gate_probs = (gate_probs / len(models)).view(batch_size, J, -1)
+    return gate_probs, torch.stack(point_ids, -1)
+
+
+def trade_ensemble(models, processor, eval_loader, device, max_len=9):
+    """batch마다 [(guid, prediction, slot별 confidence (평균 gate 확률의 max)), ...]"""
+    for batch in tqdm(eval_loader, desc="TRADE"):
+        input_ids, segment_ids, input_masks, _, _, guids = [
+            b.to(device) if not isinstance(b, list) else b for b in batch
+        ]
+        with torch.no_grad():
+            gate_probs, point_ids = trade_generate(models, input_ids, segment_ids, input_masks, max_len)
+        confidence, gate_ids = gate_probs.max(-1)
+        yield [
+            (guid, postprocess_state(processor.recover_state(gate, gen)), conf)
+            for guid, gate, gen, conf in zip(guids, gate_ids.tolist(), point_ids.tolist(), confidence.tolist())
+        ]
+
+
+def somdst_generate(models, input_ids, segment_ids, slot_position_ids, input_masks, max_value=9):
+    """평균 op 확률 (B,J,n_op)과 update slot마다 step별 평균 token 분포로 generate한 token id (B,n_update,max_value)"""
+    encoded = [
+        model.encoder.encode_state(input_ids, segment_ids, slot_position_ids, input_masks) for model in models
+    ]
+    op_probs = torch.stack([F.softmax(state_scores, -1) for _, state_scores, _, _, _ in encoded]).mean(0)
+    _, op_ids = op_probs.max(-1)
+    # 평균 op로 모든 model이 같은 update slot을 decode 한다
+    decoder_inputs = [
+        model.encoder.gather_decoder_inputs(state_output, op_ids)
+        for model, (_, _, state_output, _, _) in zip(models, encoded)
+    ]
+    hiddens = [pooled_output for _, _, _, _, pooled_output in encoded]
+    mask = input_ids.eq(models[0].decoder.pad_idx)
+
+    generated = []
+    for j in range(decoder_inputs[0].size(1)):
+        ws = [inputs[:, j].unsqueeze(1) for inputs in decoder_inputs]
+        slot_value = []
+        for k in range(max_value):
+            p_final = 0
+            for i, (model, (_, _, _, sequence_output, _)) in enumerate(zip(models, encoded)):
+                p, hiddens[i] = model.decoder._decode_step(ws[i], hiddens[i], input_ids, sequence_output, mask)
+                p_final = p_final + p
+            _, w_idx = (p_final / len(models)).max(-1)
+            ws = [model.decoder.embed(w_idx).unsqueeze(1) for model in models]
+            slot_value.append(w_idx)
+        generated.append(torch.stack(slot_value, -1))
+    if generated:
+        generated = torch.stack(generated, 1)
+    else:
+        generated = torch.zeros(input_ids.size(0), 0, max_value, dtype=torch.long, device=input_ids.device)
+    return op_probs, generated
+
+
+def merge_family_states(slot_meta, somdst_prediction, somdst_conf, trade_prediction, trade_conf):
+    """slot마다 평균 확률 (op / gate)의 max가 더 큰 family의 값"""
+    somdst_state = convert_state_dict(somdst_prediction)
+    trade_state = convert_state_dict(trade_prediction)
+    merged = []
+    for slot, s_conf, t_conf in zip(slot_meta, somdst_conf, trade_conf):
+        value = (somdst_state if s_conf >= t_conf else trade_state).get(slot)
+        if value is not None:
+            merged.append(f"{slot}-{value}")
+    return merged
+
+
+def encoded_prev_state_matches(processor, input_id, state):
+    """SOM-DST 입력의 "[SLOT] 도메인 슬롯 - 값" 부분이 state ({slot: value})와 같은지 (truncation으로 잘린 slot은 건너뜀)"""
+    tokenizer = processor.src_tokenizer
+    tokens = tokenizer.convert_ids_to_tokens(input_id)
+    starts = [i for i, token in enumerate(tokens) if token == "[SLOT]"]
+    for slot, start, end in zip(processor.slot_meta, starts, starts[1:] + [len(tokens)]):
+        segment = tokens[start + 1 : end]
+        if end == len(tokens):  # 마지막 slot은 [SEP] 전까지
+            if tokenizer.sep_token not in segment:
+                continue
+            segment = segment[: segment.index(tokenizer.sep_token)]
+        value = state.get(slot, "[NULL]")
+        if value == "dontcare":
+            value = "dont care"
+        if segment != tokenizer.tokenize(" ".join(slot.split("-") + ["-", value])):
+            return False
+    return True
+
+
+def somdst_ensemble(models, processor, eval_examples, device, max_value=9, trade_results=None):
+    """turn마다 (guid, prediction)
+
+    trade_results ({guid: (prediction, confidence)})가 주어지면 slot마다 confidence가 큰 쪽 값으로 합친다.
+    이전 turn의 prediction이 다음 turn의 입력이 되므로 eval_examples는 dialogue 단위로 처음 turn부터 있어야 한다.
+    """
+    processor.reset_state()
+    last_states = {}
+    for example in tqdm(eval_examples, desc="SOM-DST"):
+        if not example.context_turns:
+            last_states = {}
+        # 이번 turn 입력의 이전 state (b_prev_state)는 processor.prev_state로 만들어지므로 합친 state를 넣는다.
+        # recover_state가 prev_state를 in-place로 고치기 때문에 복사본을 넘긴다.
+        processor.prev_state = dict(last_states)
+        feature = processor._convert_example_to_feature(example)
+        if not encoded_prev_state_matches(processor, feature.input_id, last_states):
+            raise RuntimeError(f"{feature.guid}: encoded previous state differs from the merged prediction")
+        features = processor.collate_fn([feature])
+        input_ids, input_masks, segment_ids, slot_position_ids = [b.to(device) for b in features[:4]]
+        guid = features[-1][0]
+
+        with torch.no_grad():
+            op_probs, generated = somdst_generate(
+                models, input_ids, segment_ids, slot_position_ids, input_masks, max_value
+            )
+        confidence, op_ids = op_probs[0].max(-1)
+        pred_ops = [processor.id2op[op] for op in op_ids.tolist()]
+        processor.prev_state = dict(last_states)
+        prediction = postprocess_state(processor.recover_state(pred_ops, generated[0].tolist()))
+        if trade_results is not None:
+            trade_prediction, trade_conf = trade_results[guid]
+            prediction = merge_family_states(
+                processor.slot_meta, prediction, confidence.tolist(), trade_prediction, trade_conf
+            )
+        last_states = convert_state_dict(prediction)
+        yield guid, prediction
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="/opt/ml/input/data/eval_dataset")
+    parser.add_argument("--output_dir", type=str, default="/opt/ml/predictions/ensemble")
+    parser.add_argument("--trade_models", nargs="*", default=[], help="TRADE / TRADEBERT checkpoint (model-{epoch}.bin)")
+    parser.add_argument("--somdst_models", nargs="*", default=[], help="SOM-DST checkpoint (model-{epoch}.bin)")
+    parser.add_argument("--eval_batch_size", type=int, default=32, help="TRADE batch size (SOM-DST는 turn 단위)")
+    parser.add_argument("--max_value", type=int, default=9, help="slot value 당 generate할 token 수")
+    parser.add_argument(
+        "--gt_path", type=str, default=None,
+        help="label json (dev). 주어지면 inference 중에 평가하고 output_dir/eval_state.json에 저장",
+    )
+    args = parser.parse_args()
+    if not args.trade_models and not args.somdst_models:
+        parser.error("--trade_models or --somdst_models is required")
+
+    eval_data = json.load(open(f"{args.data_dir}/eval_dials.json", "r"))
+    eval_examples = get_examples_from_dialogues(eval_data, user_first=False, dialogue_level=False)
+    print("# eval:", len(eval_examples))
+
+    slot_meta = _shared_slot_meta(args.trade_models + args.somdst_models)
+    evaluator = None
+    if args.gt_path:
+        evaluator = StreamingDSTEvaluator(slot_meta, json.load(open(args.gt_path, "r")))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with PredictionWriter(f"{args.output_dir}/predictions.jsonl") as writer:
+
+        def write(predictions):
+            writer.write(predictions)
+            if evaluator is not None:
+                evaluator.update(predictions)
+
+        trade_results = None
+        if args.trade_models:
+            models, processor = load_trade_models(args.trade_models, device)
+            print(f"{len(models)} TRADE models are loaded")
+            eval_features = WOSDataset(processor.convert_examples_to_features(eval_examples))
+            eval_loader = DataLoader(
+                eval_features,
+                batch_size=args.eval_batch_size,
+                sampler=SequentialSampler(eval_features),
+                collate_fn=processor.collate_fn,
+            )
+            trade_results = {}
+            for results in trade_ensemble(models, processor, eval_loader, device, args.max_value):
+                if args.somdst_models:
+                    trade_results.update({guid: (prediction, conf) for guid, prediction, conf in results})
+                else:
+                    write({guid: prediction for guid, prediction, _ in results})
+            del models
+
+        if args.somdst_models:
+            models, processor = load_somdst_models(args.somdst_models, device)
+            print(f"{len(models)} SOM-DST models are loaded")
+            for guid, prediction in somdst_ensemble(
+                models, processor, eval_examples, device, args.max_value, trade_results
+            ):
+                write({guid: prediction})
+
+    jsonl_to_csv(f"{args.output_dir}/predictions.jsonl", f"{args.output_dir}/predictions.csv")
+    print(f"predictions are saved at {args.output_dir}/predictions.csv")
+    if evaluator is not None:
+        evaluator.save(f"{args.output_dir}/eval_state.json")
+        print(evaluator.compute())
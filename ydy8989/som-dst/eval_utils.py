@@ -1,3 +1,9 @@
+import json
+from fractions import Fraction
+
+import numpy as np
+
+
 class DSTEvaluator:
     def __init__(self, slot_meta):
         self.slot_meta = slot_meta
@@ -76,3 +82,275 @@ def compute_prf(gold, pred):
         else:
             precision, recall, F1, count = 0, 0, 0, 1
     return F1, recall, precision, count
+
+
+def _unique(a):
+    """정렬된 unique (np.unique보다 빠른 sort + diff)"""
+    a = np.sort(a)
+    return a[np.concatenate([[True], a[1:] != a[:-1]])] if len(a) else a
+
+
+def _isin(a, b):
+    """a의 각 원소가 b에 있는지 (b를 정렬해서 searchsorted)"""
+    b = np.sort(b)
+    if not len(b):
+        return np.zeros(len(a), dtype=bool)
+    idx = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return b[idx] == a
+
+
+class VectorizedDSTEvaluator:
+    """DSTEvaluator와 같은 metric을 모든 turn에 대해 numpy로 한 번에 계산
+
+    update에서는 "domain-slot-value"를 정수 id로 바꿔서 쌓기만 하고 (같은 문자열은 한 번만 split),
+    compute / breakdown에서 (turn, slot-value) key의 isin / bincount로 turn별 값을 한꺼번에 구한다.
+    """
+
+    def __init__(self, slot_meta):
+        self.slot_meta = slot_meta
+        self.num_slots = len(slot_meta)
+        self.slot2id = {slot: i for i, slot in enumerate(slot_meta)}
+        self.sv2id = {}
+        self.sv_slot = []  # sv id -> slot id
+        self.init()
+
+    def init(self):
+        self.gold_ids, self.gold_turns = [], []
+        self.pred_ids, self.pred_turns = [], []
+        self.turn_idx = []
+        self.all_hit = 0
+
+    def _encode(self, state):
+        ids = []
+        for sv in state:
+            sv_id = self.sv2id.get(sv)
+            if sv_id is None:
+                sv_id = self.sv2id[sv] = len(self.sv2id)
+                slot = sv.rsplit("-", 1)[0]
+                self.sv_slot.append(self.slot2id.setdefault(slot, len(self.slot2id)))
+            ids.append(sv_id)
+        return ids
+
+    def update(self, gold, pred, turn_idx=-1):
+        """turn_idx: dialogue 안에서 몇 번째 turn인지 (breakdown의 per_turn용)"""
+        self.gold_ids.extend(self._encode(gold))
+        self.gold_turns.extend([self.all_hit] * len(gold))
+        self.pred_ids.extend(self._encode(pred))
+        self.pred_turns.extend([self.all_hit] * len(pred))
+        self.turn_idx.append(turn_idx)
+        self.all_hit += 1
+
+    def _counts(self):
+        n, num_sv, num_slot = self.all_hit, max(1, len(self.sv2id)), len(self.slot2id)
+        sv_slot = np.array(self.sv_slot, dtype=np.int64)
+        g_sv, g_t = np.array(self.gold_ids, dtype=np.int64), np.array(self.gold_turns, dtype=np.int64)
+        p_sv, p_t = np.array(self.pred_ids, dtype=np.int64), np.array(self.pred_turns, dtype=np.int64)
+
+        g_key, p_key = g_t * num_sv + g_sv, p_t * num_sv + p_sv
+        g_hit = _isin(g_key, p_key)  # g in pred
+        p_hit = _isin(p_key, g_key)  # p in gold
+
+        # compute_acc: 틀린 pred 중 같은 slot의 gold를 이미 놓친 경우는 한 번만 센다
+        g_miss_slot_key = g_t[~g_hit] * num_slot + sv_slot[g_sv[~g_hit]]
+        p_slot_key = p_t * num_slot + sv_slot[p_sv]
+        wrong_pred = ~p_hit & ~_isin(p_slot_key, g_miss_slot_key)
+        return {
+            "tp": np.bincount(g_t[g_hit], minlength=n),
+            "fn": np.bincount(g_t[~g_hit], minlength=n),
+            "fp": np.bincount(p_t[~p_hit], minlength=n),
+            "wrong_pred": np.bincount(p_t[wrong_pred], minlength=n),
+            "n_gold": np.bincount(g_t, minlength=n),
+            "n_pred": np.bincount(p_t, minlength=n),
+            # slot 단위로 틀린 (turn, slot) key (놓친 gold + gold에 없는 pred)
+            "error_slot_key": _unique(np.concatenate([g_miss_slot_key, p_slot_key[~p_hit]])),
+            "gold_slot_key": _unique(g_t * num_slot + sv_slot[g_sv]),
+            "pred_slot_key": _unique(p_slot_key),
+        }
+
+    def _breakdown_counts(self, c, joint):
+        num_slot = len(self.slot2id)
+        slot_errors = np.bincount(c["error_slot_key"] % num_slot, minlength=num_slot)
+
+        # domain: gold나 pred에 그 domain의 slot이 있는 turn 수와 그중 domain의 slot이 모두 맞은 turn 수
+        domains = sorted({slot.split("-")[0] for slot in self.slot2id})
+        domain2id = {d: i for i, d in enumerate(domains)}
+        slot_domain = np.array(
+            [domain2id[slot.split("-")[0]] for slot in sorted(self.slot2id, key=self.slot2id.get)], dtype=np.int64
+        )
+        num_domain = len(domains)
+
+        def domain_key(slot_key):
+            return _unique(slot_key // num_slot * num_domain + slot_domain[slot_key % num_slot])
+
+        active = domain_key(np.concatenate([c["gold_slot_key"], c["pred_slot_key"]]))
+        correct = active[~_isin(active, domain_key(c["error_slot_key"]))]
+        active_count = np.bincount(active % num_domain, minlength=num_domain)
+        correct_count = np.bincount(correct % num_domain, minlength=num_domain)
+
+        turn_idx = np.array(self.turn_idx, dtype=np.int64)
+        per_turn = {}
+        for t in _unique(turn_idx[turn_idx >= 0]):
+            mask = turn_idx == t
+            per_turn[int(t)] = [int(joint[mask].sum()), int(mask.sum())]
+        return {
+            "slot_errors": {slot: int(slot_errors[i]) for i, slot in enumerate(self.slot_meta)},
+            "domain": {d: [int(correct_count[i]), int(active_count[i])] for i, d in enumerate(domains) if active_count[i]},
+            "turn": per_turn,
+        }
+
+    def totals(self, breakdown=False):
+        """metric을 만드는 합계. 정수 / 분수라서 어떤 순서로 나눠서 더해도 결과가 같다 (StreamingDSTEvaluator)"""
+        c = self._counts()
+        joint = (c["fn"] == 0) & (c["fp"] == 0)  # set(pred) == set(gold)
+        has_gold = c["n_gold"] > 0
+        f1_turns = has_gold & (c["tp"] > 0)
+        totals = {
+            "turns": self.all_hit,
+            "joint_goal_hit": int(joint.sum()),
+            # compute_acc: turn마다 (J - 놓친 gold - 틀린 pred) / J
+            "slot_hit": int(self.num_slots * self.all_hit - c["fn"].sum() - c["wrong_pred"].sum()),
+            # compute_prf: F1 = 2TP / (2TP + FP + FN), gold가 비어 있으면 pred도 비어 있을 때만 1
+            "f1_sum": _fraction_sum(2 * c["tp"][f1_turns], (2 * c["tp"] + c["fp"] + c["fn"])[f1_turns])
+            + int((~has_gold & (c["n_pred"] == 0)).sum()),
+        }
+        if breakdown:
+            totals["breakdown"] = self._breakdown_counts(c, joint)
+        return totals
+
+    def compute(self):
+        return metrics_from_totals(self.totals(), self.num_slots)
+
+    def breakdown(self):
+        """slot별 accuracy, domain별 joint accuracy, dialogue 내 turn 위치별 joint goal accuracy"""
+        totals = self.totals(breakdown=True)
+        return breakdown_from_totals(totals["breakdown"], totals["turns"])
+
+
+def _fraction_sum(numerators, denominators):
+    """sum(n / d)를 Fraction으로 정확하게 (같은 (n, d) 쌍은 개수를 곱해서 한 번에)"""
+    if not len(numerators):
+        return Fraction(0)
+    base = int(denominators.max()) + 1
+    key = np.sort(numerators * base + denominators)
+    bounds = np.flatnonzero(np.concatenate([[True], key[1:] != key[:-1], [True]]))
+    return sum(
+        (Fraction(int(k) // base, int(k) % base) * int(n) for k, n in zip(key[bounds[:-1]], np.diff(bounds))),
+        Fraction(0),
+    )
+
+
+def metrics_from_totals(totals, num_slots):
+    n = totals["turns"]
+    return {
+        "joint_goal_accuracy": totals["joint_goal_hit"] / n,
+        "turn_slot_accuracy": totals["slot_hit"] / (num_slots * n),
+        "turn_slot_f1": float(totals["f1_sum"] / n),
+    }
+
+
+def breakdown_from_totals(counts, turns):
+    return {
+        "per_slot": {slot: 1 - errors / turns for slot, errors in counts["slot_errors"].items()},
+        "per_domain": {
+            d: {"joint_goal_accuracy": hit / count, "turns": count} for d, (hit, count) in sorted(counts["domain"].items())
+        },
+        "per_turn": {
+            t: {"joint_goal_accuracy": hit / count, "turns": count} for t, (hit, count) in sorted(counts["turn"].items())
+        },
+    }
+
+
+class StreamingDSTEvaluator:
+    """batch 단위로 update하면서 합계만 들고 있는 evaluator
+
+    합계 (정수 / 분수)만 저장하므로 prediction / label 전체를 memory에 둘 필요가 없고,
+    to_dict / from_dict로 저장해서 shard / process별 결과를 merge 할 수 있다.
+    전체 turn을 한 번에 넣은 _evaluation (VectorizedDSTEvaluator)과 같은 값이 나온다.
+
+        evaluator = StreamingDSTEvaluator(slot_meta, labels)
+        evaluator.update(batch_predictions)  # {guid: state}
+        evaluator.compute()                  # 지금까지의 running metric
+    """
+
+    def __init__(self, slot_meta, labels=None):
+        self.slot_meta = slot_meta
+        self.labels = labels
+        self.init()
+
+    def init(self):
+        self.totals = {
+            "turns": 0,
+            "joint_goal_hit": 0,
+            "slot_hit": 0,
+            "f1_sum": Fraction(0),
+            "breakdown": {"slot_errors": {slot: 0 for slot in self.slot_meta}, "domain": {}, "turn": {}},
+        }
+
+    def update(self, predictions, labels=None):
+        """predictions: {guid: state}. gold는 labels 인자, 없으면 생성할 때 받은 labels에서 찾는다"""
+        labels = labels if labels is not None else self.labels
+        evaluator = VectorizedDSTEvaluator(self.slot_meta)
+        for guid, pred in predictions.items():
+            gold = labels.get(guid)
+            if gold is None:
+                raise Exception(f"{guid} is not in the labels!")
+            turn_idx = guid.rsplit("-", 1)[-1]
+            evaluator.update(gold, pred, int(turn_idx) if turn_idx.isdigit() else -1)
+        if evaluator.all_hit:
+            self._add(evaluator.totals(breakdown=True))
+
+    def _add(self, totals):
+        for k in ["turns", "joint_goal_hit", "slot_hit", "f1_sum"]:
+            self.totals[k] += totals[k]
+        counts, other = self.totals["breakdown"], totals["breakdown"]
+        for slot, errors in other["slot_errors"].items():
+            counts["slot_errors"][slot] = counts["slot_errors"].get(slot, 0) + errors
+        for key in ["domain", "turn"]:
+            for k, (hit, count) in other[key].items():
+                prev = counts[key].get(k, [0, 0])
+                counts[key][k] = [prev[0] + hit, prev[1] + count]
+
+    def merge(self, other):
+        """다른 shard의 evaluator (또는 to_dict 결과)를 더한다"""
+        self._add(other.totals if isinstance(other, StreamingDSTEvaluator) else _totals_from_dict(other))
+        return self
+
+    def compute(self):
+        return metrics_from_totals(self.totals, len(self.slot_meta))
+
+    def breakdown(self):
+        return breakdown_from_totals(self.totals["breakdown"], self.totals["turns"])
+
+    def to_dict(self):
+        totals = dict(self.totals)
+        totals["f1_sum"] = [totals["f1_sum"].numerator, totals["f1_sum"].denominator]
+        return {"slot_meta": self.slot_meta, "totals": totals}
+
+    @classmethod
+    def from_dict(cls, state):
+        evaluator = cls(state["slot_meta"])
+        evaluator.merge(state)
+        return evaluator
+
+    def save(self, path):
+        json.dump(self.to_dict(), open(path, "w"), ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_dict(json.load(open(path, "r")))
+
+    @classmethod
+    def merge_files(cls, paths):
+        """shard별 eval_state.json들을 하나로 합친다"""
+        evaluator = cls.load(paths[0])
+        for path in paths[1:]:
+            evaluator.merge(json.load(open(path, "r")))
+        return evaluator
+
+
+def _totals_from_dict(state):
+    totals = dict(state["totals"])
+    totals["f1_sum"] = Fraction(*totals["f1_sum"])
+    # json key는 문자열이 되므로 turn 위치는 다시 int로
+    totals["breakdown"] = dict(totals["breakdown"], turn={int(t): v for t, v in totals["breakdown"]["turn"].items()})
+    return totals
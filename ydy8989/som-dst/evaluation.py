@@ -1,13 +1,24 @@
 import json
 import argparse
-from eval_utils import DSTEvaluator
+import os
+import sys
+from eval_utils import StreamingDSTEvaluator, VectorizedDSTEvaluator
+# prediction jsonl 읽기 / 쓰기는 repo root의 prediction_io.py 하나를 같이 쓴다
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from prediction_io import load_predictions
 
 
 SLOT_META_PATH = 'data/train_dataset/slot_meta.json'
 
 
-def _evaluation(preds, labels, slot_meta):
-    evaluator = DSTEvaluator(slot_meta)
+def _turn_index(guid):
+    """guid ("{dialogue_idx}-{turn_idx}")에서 dialogue 안의 turn 위치"""
+    turn_idx = guid.rsplit("-", 1)[-1]
+    return int(turn_idx) if turn_idx.isdigit() else -1
+
+
+def _evaluation(preds, labels, slot_meta, breakdown=False):
+    evaluator = VectorizedDSTEvaluator(slot_meta)
 
     evaluator.init()
     assert len(preds) == len(labels)
@@ -16,24 +27,46 @@ def _evaluation(preds, labels, slot_meta):
         p = preds.get(k)
         if p is None:
             raise Exception(f"{k} is not in the predictions!")
-        evaluator.update(l, p)
+        evaluator.update(l, p, _turn_index(k))
 
     result = evaluator.compute()
     print(result)
+    if breakdown:
+        # slot / domain / turn 위치별 결과는 따로 (학습 loop에서는 scalar metric만 기록)
+        return result, evaluator.breakdown()
     return result
 
 
-def evaluation(gt_path, pred_path):
+def evaluation(gt_path, pred_path, breakdown=False):
     slot_meta = json.load(open(SLOT_META_PATH))
     gts = json.load(open(gt_path))
-    preds = json.load(open(pred_path))
-    eval_result = _evaluation(preds, gts, slot_meta)
+    preds = load_predictions(pred_path)  # predictions.csv (json) / predictions.jsonl
+    eval_result = _evaluation(preds, gts, slot_meta, breakdown)
+    if breakdown:
+        print(json.dumps(eval_result[1], indent=2, ensure_ascii=False))
+    return eval_result
+
+
+def merge_evaluation(state_paths, breakdown=False):
+    """shard별 inference가 저장한 eval_state.json을 합쳐서 전체 결과를 계산"""
+    evaluator = StreamingDSTEvaluator.merge_files(state_paths)
+    eval_result = evaluator.compute()
+    print(eval_result)
+    if breakdown:
+        print(json.dumps(evaluator.breakdown(), indent=2, ensure_ascii=False))
     return eval_result
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('--gt_path', type=str, required=True)
-    parser.add_argument('--pred_path', type=str, required=True)
+    parser.add_argument('--gt_path', type=str, default=None)
+    parser.add_argument('--pred_path', type=str, default=None, help='predictions.csv 또는 predictions.jsonl')
+    parser.add_argument('--breakdown', action='store_true', help='slot / domain / turn 위치별 accuracy 출력')
+    parser.add_argument('--merge', nargs='+', default=None, help='shard별 eval_state.json (gt_path / pred_path 대신)')
     args = parser.parse_args()
-    eval_result = evaluation(args.gt_path, args.pred_path)
+    if args.merge:
+        eval_result = merge_evaluation(args.merge, args.breakdown)
+    else:
+        if not (args.gt_path and args.pred_path):
+            parser.error('--gt_path and --pred_path are required without --merge')
+        eval_result = evaluation(args.gt_path, args.pred_path, args.breakdown)
@@ -1,6 +1,7 @@
 import argparse
 import os
 import json
+import sys
 print(os.getcwd())
 import torch
 from torch.utils.data import DataLoader, SequentialSampler
@@ -8,8 +9,13 @@ from tqdm import tqdm
 from transformers import BertTokenizer
 
 from data_utils import WOSDataset, get_examples_from_dialogues, convert_state_dict
+from eval_utils import StreamingDSTEvaluator
 from models import SOMDST_pre, masked_cross_entropy_for_value
 from preprocessor import SOMDSTPreprocessor
+# prediction_io.py (prediction jsonl 읽기 / 쓰기)와 quantization.py는 repo root의 것을 같이 쓴다
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from prediction_io import PredictionWriter, iter_predictions, jsonl_to_csv
+from quantization import quantize_dynamic_int8
 import torch.cuda.amp as amp
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -22,13 +28,21 @@ def postprocess_state(state):
     return state
 
 
-def inference(model, eval_examples, processor, device):
+def inference(model, eval_examples, processor, device, writer=None, evaluator=None):
+    """writer (PredictionWriter)가 주어지면 turn마다 jsonl에 쓰고 memory에는 모으지 않는다
+
+    evaluator (StreamingDSTEvaluator)가 주어지면 turn마다 update하고 running JGA를 progress bar에 표시한다.
+    resume으로 다시 돌리는 turn (writer.done에 있는 guid)은 이미 반영된 것으로 보고 update하지 않는다.
+
+    이전 turn의 prediction이 다음 turn의 입력이 되므로 eval_examples는 dialogue 단위로 처음 turn부터 있어야 한다.
+    """
     processor.reset_state()
     model.eval()
     predictions = {}
     last_states = {}
 
-    for example in tqdm(eval_examples):
+    pbar = tqdm(eval_examples)
+    for example in pbar:
         # print(example)
         if not example.context_turns:
             last_states = {}
@@ -71,7 +85,13 @@ def inference(model, eval_examples, processor, device):
         prediction = processor.recover_state(pred_ops, generated)
         prediction = postprocess_state(prediction)
         last_states = convert_state_dict(prediction)
-        predictions[guids[0]] = prediction
+        if evaluator is not None and (writer is None or guids[0] not in writer.done):
+            evaluator.update({guids[0]: prediction})
+            pbar.set_postfix(jga=f"{evaluator.compute()['joint_goal_accuracy']:.4f}", refresh=False)
+        if writer is not None:
+            writer.write({guids[0]: prediction})
+        else:
+            predictions[guids[0]] = prediction
     return predictions
 
 
@@ -84,6 +104,18 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", type=str, default="/opt/ml/predictions")
     parser.add_argument("--eval_batch_size", type=int, default=32)
     parser.add_argument("--model_name", type=str, default="SOMDST/model-17.bin")
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="output_dir/predictions.jsonl에 이미 있는 guid는 건너뛰고 이어서 inference",
+    )
+    parser.add_argument(
+        "--quantize", action="store_true",
+        help="Linear / GRU / vocab projection을 dynamic int8로 quantize해서 CPU에서 inference",
+    )
+    parser.add_argument(
+        "--gt_path", type=str, default=None,
+        help="label json (dev). 주어지면 inference 중에 평가하고 output_dir/eval_state.json에 저장",
+    )
 
     args = parser.parse_args()
     # args.data_dir = os.environ["SM_CHANNEL_EVAL"]
@@ -107,6 +139,21 @@ if __name__ == "__main__":
         eval_data, user_first=False, dialogue_level=False
     )
 
+    # prediction은 turn마다 predictions.jsonl에 쓰고, 끝나면 predictions.csv로 변환
+    os.makedirs(args.output_dir, exist_ok=True)
+    writer = PredictionWriter(f"{args.output_dir}/predictions.jsonl", resume=args.resume)
+    # 중간까지만 쓴 dialogue는 state를 다시 만들기 위해 처음 turn부터 다시 돌린다 (이미 쓴 turn은 writer가 건너뜀)
+    unfinished = {e.guid.rsplit("-", 1)[0] for e in eval_examples if e.guid not in writer.done}
+    eval_examples = [e for e in eval_examples if e.guid.rsplit("-", 1)[0] in unfinished]
+    print(f"# skipped (already predicted): {len(writer.done)}")
+
+    evaluator = None
+    if args.gt_path:
+        evaluator = StreamingDSTEvaluator(slot_meta, json.load(open(args.gt_path, "r")))
+        if writer.done:
+            # resume: 이미 쓴 prediction부터 다시 반영
+            evaluator.update(dict(iter_predictions(f"{args.output_dir}/predictions.jsonl")))
+
     # Extracting Featrues
     # eval_features = processor.convert_examples_to_features(eval_examples)
     # eval_data = WOSDataset(eval_features)
@@ -130,15 +177,15 @@ if __name__ == "__main__":
     ckpt = torch.load(args.model_dir, map_location="cpu")
     model.load_state_dict(ckpt)
     model.to(device)
+    if args.quantize:
+        device = torch.device("cpu")
+        model = quantize_dynamic_int8(model, inplace=True)
     print("Model is loaded")
 
-    predictions = inference(model, eval_examples, processor, device)
+    with writer:
+        inference(model, eval_examples, processor, device, writer=writer, evaluator=evaluator)
 
-    if not os.path.exists(args.output_dir):
-        os.mkdir(args.output_dir)
-    json.dump(
-        predictions,
-        open(f"{args.output_dir}/predictions.csv", "w"),
-        indent=2,
-        ensure_ascii=False,
-    )
+    jsonl_to_csv(f"{args.output_dir}/predictions.jsonl", f"{args.output_dir}/predictions.csv")
+    if evaluator is not None:
+        evaluator.save(f"{args.output_dir}/eval_state.json")
+        print(evaluator.compute())
@@ -173,7 +173,28 @@ class BertEncoder(nn.Module):
         op_ids=None,
         max_update=None,
     ):
+        (
+            domain_scores,
+            state_scores,
+            state_output,
+            sequence_output,
+            pooled_output,
+        ) = self.encode_state(input_ids, token_type_ids, state_positions, attention_mask)
 
+        batch_size = state_scores.size(0)
+        if op_ids is None:
+            op_ids = state_scores.view(-1, self.n_op).max(-1)[-1].view(batch_size, -1)
+        decoder_inputs = self.gather_decoder_inputs(state_output, op_ids, max_update)
+        return (
+            domain_scores,
+            state_scores,
+            decoder_inputs,
+            sequence_output,
+            pooled_output,
+        )
+
+    def encode_state(self, input_ids, token_type_ids, state_positions, attention_mask):
+        """op 예측까지: (domain_scores / state_scores B x J x n_op / state_output B x J x H / sequence_output / pooled_output 1 x B x H)"""
         outputs = self.bert(
             input_ids=input_ids,
             token_type_ids=token_type_ids,
@@ -194,10 +215,16 @@ class BertEncoder(nn.Module):
         state_output = torch.gather(sequence_output, 1, state_pos)
         # state_scores: B x J x n_ops(4)
         state_scores = self.op_classifier(self.dropout(state_output))
+        return (
+            domain_scores,
+            state_scores,
+            state_output,
+            sequence_output,
+            pooled_output.unsqueeze(0),
+        )
 
-        batch_size = state_scores.size(0)
-        if op_ids is None:
-            op_ids = state_scores.view(-1, self.n_op).max(-1)[-1].view(batch_size, -1)
+    def gather_decoder_inputs(self, state_output, op_ids, max_update=None):
+        """op_ids가 update인 slot의 state_output을 모은 decoder 입력 (B x max_update x H)"""
         if max_update is None:
             max_update = op_ids.eq(self.update_id).sum(-1).max().item()
         gathered = []
@@ -212,23 +239,16 @@ class BertEncoder(nn.Module):
                 if gap > 0:
                     # 부족한 개수만큼 패딩
                     zeros = torch.zeros(
-                        1, 1 * gap, self.hidden_size, device=input_ids.device
+                        1, 1 * gap, self.hidden_size, device=state_output.device
                     )
                     v = torch.cat([v, zeros], 1)
             else:
                 # Update 가 존재하지 않으면 dummy 값
                 v = torch.zeros(
-                    1, max_update, self.hidden_size, device=input_ids.device
+                    1, max_update, self.hidden_size, device=state_output.device
                 )
             gathered.append(v)
-        decoder_inputs = torch.cat(gathered)  # B x max_update x H
-        return (
-            domain_scores,
-            state_scores,
-            decoder_inputs,
-            sequence_output,
-            pooled_output.unsqueeze(0),
-        )
+        return torch.cat(gathered)  # B x max_update x H
 
 
 class Decoder(nn.Module):
@@ -245,11 +265,45 @@ class Decoder(nn.Module):
         self.w_gen = nn.Linear(config.hidden_size * 3, 1)
         self.sigmoid = nn.Sigmoid()
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        # hidden -> vocab score. None이면 embed.weight와 matmul (quantization.py에서 int8 Linear로 교체)
+        self.vocab_proj = None
 
         for n, p in self.gru.named_parameters():
             if "weight" in n:
                 p.data.normal_(mean=0.0, std=config.initializer_range)
 
+    def _decode_step(self, w, hidden, input_ids, encoder_output, mask):
+        """한 step: (p_final B x V / hidden 1 x B x H)"""
+        w = self.dropout(w)
+        _, hidden = self.gru(w, hidden)  # 1 x B x H
+        attn_e = torch.bmm(encoder_output, hidden.permute(1, 2, 0))  # B x T x 1
+        attn_e = attn_e.squeeze(-1).masked_fill(mask, -1e4)
+        attn_history = nn.functional.softmax(attn_e, -1)  # B x T
+
+        if self.vocab_proj is not None:
+            attn_v = self.vocab_proj(hidden.squeeze(0))  # B x Vocab Size
+        else:
+            attn_v = torch.matmul(
+                hidden.squeeze(0), self.embed.weight.transpose(0, 1)
+            )  # B x Vocab Size
+        attn_vocab = nn.functional.softmax(attn_v, -1)
+
+        context = torch.bmm(
+            attn_history.unsqueeze(1), encoder_output
+        )  # B x 1 x H
+
+        p_gen = self.sigmoid(
+            self.w_gen(torch.cat([w, hidden.transpose(0, 1), context], -1))
+        )  # B x 1
+        p_gen = p_gen.squeeze(-1)
+
+        p_context_ptr = torch.zeros_like(attn_vocab, device=input_ids.device)
+        p_context_ptr.scatter_add(
+            1, input_ids, attn_history
+        )  # Copy: B x T -> B x V
+        p_final = p_gen * attn_vocab + (1 - p_gen) * p_context_ptr  # B, V
+        return p_final, hidden
+
     def forward(
         self, input_ids, decoder_inputs, encoder_output, hidden, max_value, teacher=None
     ):
@@ -267,31 +321,7 @@ class Decoder(nn.Module):
             w = state_in[:, j].unsqueeze(1)  # B x 1 x H
             slot_value = []
             for k in range(max_value):
-                w = self.dropout(w)
-                _, hidden = self.gru(w, hidden)  # 1 x B x H
-                attn_e = torch.bmm(encoder_output, hidden.permute(1, 2, 0))  # B x T x 1
-                attn_e = attn_e.squeeze(-1).masked_fill(mask, -1e4)
-                attn_history = nn.functional.softmax(attn_e, -1)  # B x T
-
-                attn_v = torch.matmul(
-                    hidden.squeeze(0), self.embed.weight.transpose(0, 1)
-                )  # B x Vocab Size
-                attn_vocab = nn.functional.softmax(attn_v, -1)
-
-                context = torch.bmm(
-                    attn_history.unsqueeze(1), encoder_output
-                )  # B x 1 x H
-
-                p_gen = self.sigmoid(
-                    self.w_gen(torch.cat([w, hidden.transpose(0, 1), context], -1))
-                )  # B x 1
-                p_gen = p_gen.squeeze(-1)
-
-                p_context_ptr = torch.zeros_like(attn_vocab, device=input_ids.device)
-                p_context_ptr.scatter_add(
-                    1, input_ids, attn_history
-                )  # Copy: B x T -> B x V
-                p_final = p_gen * attn_vocab + (1 - p_gen) * p_context_ptr  # B, V
+                p_final, hidden = self._decode_step(w, hidden, input_ids, encoder_output, mask)
                 _, w_idx = p_final.max(-1)
                 slot_value.append([ww.tolist() for ww in w_idx])
                 if teacher is not None:
@@ -51,15 +51,20 @@ class TRADE(nn.Module):
         if self.decoder.proj_layer:
             self.decoder.proj_layer.weight = self.encoder.proj_layer.weight
 
+    def encode(self, input_ids, token_type_ids, attention_mask=None):
+        """decoder 입력: (encoder_outputs B,T,D / hidden 1,B,D)"""
+        encoder_outputs, pooled_output = self.encoder(input_ids=input_ids)
+        return encoder_outputs, pooled_output.unsqueeze(0)
+
     def forward(
         self, input_ids, token_type_ids, attention_mask=None, max_len=10, teacher=None
     ):
 
-        encoder_outputs, pooled_output = self.encoder(input_ids=input_ids)
+        encoder_outputs, hidden = self.encode(input_ids, token_type_ids, attention_mask)
         all_point_outputs, all_gate_outputs = self.decoder(
             input_ids,
             encoder_outputs,
-            pooled_output.unsqueeze(0),
+            hidden,
             attention_mask,
             max_len,
             teacher,
@@ -86,18 +91,23 @@ class TRADEBERT(nn.Module):
     def tie_weight(self):
         self.decoder.embed.weight = self.encoder.bert.embeddings.word_embeddings.weight
 
-    def forward(
-        self, input_ids, token_type_ids, attention_mask=None, max_len=10, teacher=None
-    ):
+    def encode(self, input_ids, token_type_ids, attention_mask=None):
+        """decoder 입력: (encoder_outputs B,T,D / hidden 1,B,D)"""
         encoder_outputs, pooled_output = self.encoder(
             input_ids=input_ids,
             token_type_ids=token_type_ids,
             attention_mask=attention_mask,
         )
+        return encoder_outputs, pooled_output.unsqueeze(0)
+
+    def forward(
+        self, input_ids, token_type_ids, attention_mask=None, max_len=10, teacher=None
+    ):
+        encoder_outputs, hidden = self.encode(input_ids, token_type_ids, attention_mask)
         all_point_outputs, all_gate_outputs = self.decoder(
             input_ids,
             encoder_outputs,
-            pooled_output.unsqueeze(0),
+            hidden,
             attention_mask,
             max_len,
             teacher,
@@ -187,6 +197,8 @@ class SlotGenerator(nn.Module):
         self.w_gen = nn.Linear(self.hidden_size * 3, 1)
         self.sigmoid = nn.Sigmoid()
         self.w_gate = nn.Linear(self.hidden_size, n_gate)
+        # hidden -> vocab score. None이면 embed.weight와 matmul (quantization.py에서 int8 Linear로 교체)
+        self.vocab_proj = None
 
     def set_slot_idx(self, slot_vocab_idx):
         whole = []
@@ -204,12 +216,8 @@ class SlotGenerator(nn.Module):
             x = self.proj_layer(x)
         return x
 
-    def forward(
-        self, input_ids, encoder_output, hidden, input_masks, max_len, teacher=None
-    ):
-        input_masks = input_masks.ne(1)
-        # J, slot_meta : key : [domain, slot] ex> LongTensor([1,2])
-        # J,2
+    def _expand_slots(self, input_ids, encoder_output, hidden, input_masks):
+        """Parallel Decoding: batch x slot (B*J)개의 sequence로 펼친다"""
         batch_size = encoder_output.size(0)
         slot = torch.tensor(
             self.slot_embed_idx, device=input_ids.device, dtype=torch.int64
@@ -217,46 +225,69 @@ class SlotGenerator(nn.Module):
         slot_e = torch.sum(self.embedding(slot), 1)  # J,d
         J = slot_e.size(0)
 
-        all_point_outputs = torch.zeros(
-            batch_size, J, max_len, self.vocab_size, device=input_ids.device
-        )
-
-        # Parallel Decoding
         w = slot_e.repeat(batch_size, 1).unsqueeze(1)
         hidden = hidden.repeat_interleave(J, dim=1)
         encoder_output = encoder_output.repeat_interleave(J, dim=0)
         input_ids = input_ids.repeat_interleave(J, dim=0)
         input_masks = input_masks.repeat_interleave(J, dim=0)
-        for k in range(max_len):
-            w = self.dropout(w)
-            _, hidden = self.gru(w, hidden)  # 1,B,D
+        return w, hidden, encoder_output, input_ids, input_masks
 
-            # B,T,D * B,D,1 => B,T
-            attn_e = torch.bmm(encoder_output, hidden.permute(1, 2, 0))  # B,T,1
-            attn_e = attn_e.squeeze(-1).masked_fill(input_masks, -1e4)
-            attn_history = F.softmax(attn_e, -1)  # B,T
+    def _decode_step(self, w, hidden, encoder_output, input_ids, input_masks):
+        w = self.dropout(w)
+        _, hidden = self.gru(w, hidden)  # 1,B,D
 
-            if self.proj_layer:
-                hidden_proj = torch.matmul(hidden, self.proj_layer.weight)
-            else:
-                hidden_proj = hidden
+        # B,T,D * B,D,1 => B,T
+        attn_e = torch.bmm(encoder_output, hidden.permute(1, 2, 0))  # B,T,1
+        attn_e = attn_e.squeeze(-1).masked_fill(input_masks, -1e4)
+        attn_history = F.softmax(attn_e, -1)  # B,T
 
-            # B,D * D,V => B,V
+        if self.proj_layer:
+            hidden_proj = torch.matmul(hidden, self.proj_layer.weight)
+        else:
+            hidden_proj = hidden
+
+        # B,D * D,V => B,V
+        if self.vocab_proj is not None:
+            attn_v = self.vocab_proj(hidden_proj.squeeze(0))  # B,V
+        else:
             attn_v = torch.matmul(
                 hidden_proj.squeeze(0), self.embed.weight.transpose(0, 1)
             )  # B,V
-            attn_vocab = F.softmax(attn_v, -1)
-
-            # B,1,T * B,T,D => B,1,D
-            context = torch.bmm(attn_history.unsqueeze(1), encoder_output)  # B,1,D
-            p_gen = self.sigmoid(
-                self.w_gen(torch.cat([w, hidden.transpose(0, 1), context], -1))
-            )  # B,1
-            p_gen = p_gen.squeeze(-1)
-
-            p_context_ptr = torch.zeros_like(attn_vocab, device=input_ids.device)
-            p_context_ptr.scatter_add_(1, input_ids, attn_history)  # copy B,V
-            p_final = p_gen * attn_vocab + (1 - p_gen) * p_context_ptr  # B,V
+        attn_vocab = F.softmax(attn_v, -1)
+
+        # B,1,T * B,T,D => B,1,D
+        context = torch.bmm(attn_history.unsqueeze(1), encoder_output)  # B,1,D
+        p_gen = self.sigmoid(
+            self.w_gen(torch.cat([w, hidden.transpose(0, 1), context], -1))
+        )  # B,1
+        p_gen = p_gen.squeeze(-1)
+
+        p_context_ptr = torch.zeros_like(attn_vocab, device=input_ids.device)
+        p_context_ptr.scatter_add_(1, input_ids, attn_history)  # copy B,V
+        p_final = p_gen * attn_vocab + (1 - p_gen) * p_context_ptr  # B,V
+        return p_final, hidden, context
+
+    def forward(
+        self, input_ids, encoder_output, hidden, input_masks, max_len, teacher=None
+    ):
+        input_masks = input_masks.ne(1)
+        # J, slot_meta : key : [domain, slot] ex> LongTensor([1,2])
+        # J,2
+        batch_size = encoder_output.size(0)
+        J = len(self.slot_embed_idx)
+
+        all_point_outputs = torch.zeros(
+            batch_size, J, max_len, self.vocab_size, device=input_ids.device
+        )
+
+        # Parallel Decoding
+        w, hidden, encoder_output, input_ids, input_masks = self._expand_slots(
+            input_ids, encoder_output, hidden, input_masks
+        )
+        for k in range(max_len):
+            p_final, hidden, context = self._decode_step(
+                w, hidden, encoder_output, input_ids, input_masks
+            )
             _, w_idx = p_final.max(-1)
 
             if teacher is not None:
@@ -0,0 +1,81 @@
+"""fp32 vs dynamic int8 SOM-DST 비교 (dev split)
+
+train_somdst.py와 같은 seed로 dev split을 만들고 두 model로 같은 inference()를 돌려서
+joint goal accuracy, turn 당 latency, throughput, model 크기를 비교한다.
+
+    python quantize_eval_somdst.py --data_dir /opt/ml/input/data/train_dataset --model_dir /opt/ml/result/SOMDST --model_name model-17.bin
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+from transformers import BertTokenizer
+
+from data_utils import get_examples_from_dialogues, load_dataset, set_seed
+from evaluation import _evaluation
+from inference_somdst import inference
+from models import SOMDST
+from preprocessor import SOMDSTPreprocessor
+# dynamic int8 quantization은 repo root의 quantization.py 하나를 같이 쓴다
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from quantization import model_size_mb, quantize_dynamic_int8
+from train_utils import select_eval_dialogues
+
+
+def run(model, eval_examples, processor, dev_labels, slot_meta):
+    start = time.perf_counter()
+    predictions = inference(model, eval_examples, processor, torch.device("cpu"))
+    elapsed = time.perf_counter() - start
+    result = _evaluation(predictions, dev_labels, slot_meta)
+    return {
+        "joint_goal_accuracy": result["joint_goal_accuracy"],
+        "turn_slot_f1": result["turn_slot_f1"],
+        "latency_ms_per_turn": elapsed / len(predictions) * 1000,
+        "turns_per_sec": len(predictions) / elapsed,
+        "model_size_mb": model_size_mb(model),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="/opt/ml/input/data/train_dataset")
+    parser.add_argument("--model_dir", type=str, default="/opt/ml/result/SOMDST")
+    parser.add_argument("--model_name", type=str, default="model-17.bin")
+    parser.add_argument("--random_seed", type=int, default=42, help="train_somdst.py와 같아야 같은 dev split")
+    parser.add_argument("--eval_subset", type=int, default=100, help="dev set에서 이 수만큼의 dialogue만 사용")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--max_jga_drop", type=float, default=0.01, help="허용하는 joint goal accuracy 하락 폭")
+    parser.add_argument("--output", type=str, default=None, help="결과 json 경로")
+    args = parser.parse_args()
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+
+    config = argparse.Namespace(**json.load(open(f"{args.model_dir}/exp_config.json", "r")))
+    slot_meta = json.load(open(f"{args.model_dir}/slot_meta.json", "r"))
+    tokenizer = BertTokenizer.from_pretrained(config.model_name_or_path)
+    tokenizer.add_special_tokens({"additional_special_tokens": ["[SLOT]", "[NULL]", "[EOS]"]})
+    processor = SOMDSTPreprocessor(slot_meta, tokenizer, max_seq_length=512)
+
+    set_seed(args.random_seed)
+    _, dev_data, dev_labels = load_dataset(f"{args.data_dir}/train_dials.json")
+    dev_examples = get_examples_from_dialogues(dev_data, user_first=False, dialogue_level=False)
+    dev_examples = select_eval_dialogues(dev_examples, args.eval_subset, args.random_seed)
+    dev_labels = {e.guid: dev_labels[e.guid] for e in dev_examples}
+    print("# dev:", len(dev_examples))
+
+    model = SOMDST(config, 5, 6, processor.op2id["update"])
+    model.load_state_dict(torch.load(os.path.join(args.model_dir, args.model_name), map_location="cpu"))
+
+    results = {"fp32": run(model, dev_examples, processor, dev_labels, slot_meta)}
+    results["int8"] = run(quantize_dynamic_int8(model), dev_examples, processor, dev_labels, slot_meta)
+    results["delta"] = {k: results["int8"][k] - results["fp32"][k] for k in results["fp32"]}
+
+    for k in results["fp32"]:
+        print(f"{k:<22} fp32 {results['fp32'][k]:>10.4f}  int8 {results['int8'][k]:>10.4f}  delta {results['delta'][k]:>+10.4f}")
+    if args.output:
+        json.dump(results, open(args.output, "w"), indent=2)
+    if -results["delta"]["joint_goal_accuracy"] > args.max_jga_drop:
+        raise SystemExit(f"joint goal accuracy dropped by more than {args.max_jga_drop}")
@@ -0,0 +1,132 @@
+"""serve_somdst.py load generator
+
+eval dialogue(json)를 concurrency 개의 가상 사용자가 나눠서 turn 순서대로 /turn에 보내고
+요청별 latency의 p50 / p99와 초당 처리 turn 수를 출력한다.
+
+    python serve_client.py --data_path /opt/ml/input/data/eval_dataset/eval_dials.json --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+class HTTPConnection:
+    """keep-alive로 요청을 주고받는 최소한의 asyncio HTTP client"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, value = line.decode("latin-1").split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+        data = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        return status, json.loads(data)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def dialogue_turns(dialogue):
+    """(system utterance, user utterance) 목록 (get_examples_from_dialogue와 같은 순서)"""
+    turns = []
+    for idx, turn in enumerate(dialogue["dialogue"]):
+        if turn["role"] != "user":
+            continue
+        sys_utter = dialogue["dialogue"][idx - 1]["text"] if idx else ""
+        turns.append((sys_utter, turn["text"]))
+    return turns
+
+
+async def user(host, port, dialogues, latencies, errors, predictions):
+    conn = HTTPConnection(host, port)
+    try:
+        for dialogue in dialogues:
+            session_id = dialogue["dialogue_idx"]
+            for sys_utter, user_utter in dialogue_turns(dialogue):
+                start = time.perf_counter()
+                status, result = await conn.request(
+                    "POST",
+                    "/turn",
+                    {"session_id": session_id, "system_utterance": sys_utter, "user_utterance": user_utter},
+                )
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    errors.append(result)
+                    break
+                predictions[f"{session_id}-{result['turn_idx']}"] = result["state"]
+            await conn.request("POST", "/reset", {"session_id": session_id})
+    finally:
+        conn.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def run(args):
+    dialogues = json.load(open(args.data_path, "r"))
+    if args.num_dialogues:
+        dialogues = dialogues[: args.num_dialogues]
+    latencies, errors, predictions = [], [], {}
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        user(args.host, args.port, dialogues[i:: args.concurrency], latencies, errors, predictions)
+        for i in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    conn = HTTPConnection(args.host, args.port)
+    _, health = await conn.request("GET", "/health")
+    conn.close()
+
+    report = {
+        "concurrency": args.concurrency,
+        "dialogues": len(dialogues),
+        "turns": len(latencies),
+        "errors": len(errors),
+        "elapsed_sec": elapsed,
+        "turns_per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_batch_size": health["turns"] / max(1, health["batches"]),
+    }
+    for k, v in report.items():
+        print(f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}")
+    if errors:
+        print("first error:", errors[0])
+    if args.output_path:
+        json.dump(predictions, open(args.output_path, "w"), indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_path", type=str, default="/opt/ml/input/data/eval_dataset/eval_dials.json")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=16, help="동시에 대화하는 사용자 수")
+    parser.add_argument("--num_dialogues", type=int, default=None)
+    parser.add_argument("--output_path", type=str, default=None, help="받은 state를 predictions.csv 형식으로 저장")
+    args = parser.parse_args()
+    asyncio.run(run(args))
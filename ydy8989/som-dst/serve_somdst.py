@@ -0,0 +1,312 @@
+"""SOM-DST online serving (asyncio HTTP/JSON)
+
+dialogue(session) 마다 history / 이전 belief state를 server에 두고 turn 단위로 state를 갱신한다.
+동시에 들어온 turn 요청은 micro-batch로 묶어서 한 번에 forward 한다.
+batch는 max_batch_size가 차거나 첫 요청 이후 max_wait_ms가 지나면 실행된다.
+
+    python serve_somdst.py --model_dir /opt/ml/result/SOMDST --model_name model-17.bin --port 8000
+
+    POST /turn   {"session_id": "...", "system_utterance": "...", "user_utterance": "..."}
+                 -> {"session_id": "...", "turn_idx": 0, "state": ["관광-종류-박물관", ...]}
+    POST /reset  {"session_id": "..."}
+    GET  /health -> session 수, 처리한 turn / batch 수
+
+같은 session의 turn은 순서대로 하나씩만 처리된다 (이전 turn의 prediction이 다음 turn의 입력).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from transformers import BertTokenizer
+
+from data_utils import DSTInputExample, convert_state_dict
+from inference_somdst import postprocess_state
+from models import SOMDST
+from preprocessor import SOMDSTPreprocessor
+# dynamic int8 quantization은 repo root의 quantization.py 하나를 같이 쓴다
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from quantization import quantize_dynamic_int8
+
+
+class DialogueSession:
+    """session 하나의 dialogue history와 이전 turn의 state"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.history = []
+        self.num_turns = 0
+        self.prev_example = None
+        self.prev_domain_id = 0
+        # prev_state: 다음 turn의 입력으로 encoding 되는 state (processor.prev_state)
+        # last_state: 직전 turn의 prediction (recover_state의 기준)
+        self.prev_state = {}
+        self.last_state = {}
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+
+class SOMDSTTracker:
+    """SOMDSTPreprocessor의 prev_* 상태를 session 별로 바꿔 끼우면서 batch 단위로 state를 예측"""
+
+    def __init__(self, model, processor, device, max_value=9):
+        self.model = model
+        self.processor = processor
+        self.device = device
+        self.max_value = max_value
+
+    def build_feature(self, session, system_utterance, user_utterance):
+        """feature와 이 turn이 성공했을 때 session에 반영할 값 (update)을 반환
+
+        session은 바꾸지 않는다. forward / recover가 실패하면 session은 이전 turn 그대로 남는다.
+        """
+        example = DSTInputExample(
+            guid=f"{session.session_id}-{session.num_turns}",
+            context_turns=list(session.history),
+            current_turn=[system_utterance, user_utterance],
+        )
+        processor = self.processor
+        processor.prev_example = session.prev_example
+        processor.prev_state = session.prev_state
+        processor.prev_domain_id = session.prev_domain_id
+        feature = processor._convert_example_to_feature(example)
+
+        update = {
+            "prev_example": example,
+            "prev_domain_id": processor.prev_domain_id,
+            "history": session.history + [system_utterance, user_utterance],
+            "num_turns": session.num_turns + 1,
+        }
+        return feature, update
+
+    @torch.no_grad()
+    def forward(self, features):
+        """model forward만 수행 (executor thread에서 실행)"""
+        batch = self.processor.collate_fn(features)
+        input_ids, input_masks, segment_ids, slot_position_ids = [
+            b.to(self.device) for b in batch[:4]
+        ]
+        _, state_scores, gen_scores = self.model(
+            input_ids=input_ids,
+            token_type_ids=segment_ids,
+            slot_positions=slot_position_ids,
+            attention_mask=input_masks,
+            max_value=self.max_value,
+            op_ids=None,
+        )
+        op_ids = state_scores.max(-1)[1]
+        generated = gen_scores.max(-1)[1] if gen_scores.size(1) > 0 else None
+        outputs = []
+        for b, ops in enumerate(op_ids.tolist()):
+            n_update = ops.count(self.processor.op2id["update"])
+            gen = generated[b, :n_update].tolist() if n_update else []
+            outputs.append((ops, gen))
+        return outputs
+
+    def recover(self, session, update, ops, generated):
+        """prediction을 복원하고, 성공하면 build_feature의 update와 함께 session에 반영"""
+        pred_ops = [self.processor.id2op[op] for op in ops]
+        # recover_state는 prev_state를 in-place로 바꾸므로 복사본으로
+        self.processor.prev_state = dict(session.last_state)
+        prediction = postprocess_state(self.processor.recover_state(pred_ops, generated))
+        last_state = convert_state_dict(prediction)
+
+        for name, value in update.items():
+            setattr(session, name, value)
+        session.prev_state = self.processor.prev_state
+        session.last_state = last_state
+        return prediction
+
+
+class MicroBatcher:
+    """요청을 queue에 모아서 max_batch_size / max_wait_ms 기준으로 묶어 실행"""
+
+    def __init__(self, tracker, max_batch_size=16, max_wait_ms=10):
+        self.tracker = tracker
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        # model forward는 한 번에 하나씩, event loop를 막지 않도록 thread에서 실행
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.num_turns = 0
+        self.num_batches = 0
+
+    async def submit(self, session, system_utterance, user_utterance):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((session, system_utterance, user_utterance, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._run_batch(loop, requests)
+
+    async def _run_batch(self, loop, requests):
+        try:
+            # preprocessor 상태를 session 별로 바꿔 끼우므로 feature 변환 / state 복원은 event loop thread에서만
+            features, updates = zip(*[self.tracker.build_feature(s, sys, usr) for s, sys, usr, _ in requests])
+            outputs = await loop.run_in_executor(self.executor, self.tracker.forward, list(features))
+            for (session, _, _, future), update, (ops, generated) in zip(requests, updates, outputs):
+                # 실패한 요청의 session만 이전 turn 상태로 남고 같은 batch의 다른 요청은 그대로 처리
+                try:
+                    prediction = self.tracker.recover(session, update, ops, generated)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                future.set_result((session.num_turns - 1, prediction))
+        except Exception as e:
+            for *_, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+        self.num_turns += len(requests)
+        self.num_batches += 1
+
+
+class DSTServer:
+    def __init__(self, batcher, session_ttl=1800):
+        self.batcher = batcher
+        self.session_ttl = session_ttl
+        self.sessions = {}
+
+    def get_session(self, session_id):
+        if session_id not in self.sessions:
+            self.sessions[session_id] = DialogueSession(session_id)
+        session = self.sessions[session_id]
+        session.last_active = time.monotonic()
+        return session
+
+    async def handle_turn(self, body):
+        session = self.get_session(str(body["session_id"]))
+        async with session.lock:
+            turn_idx, state = await self.batcher.submit(
+                session, body.get("system_utterance", ""), body["user_utterance"]
+            )
+        return {"session_id": session.session_id, "turn_idx": turn_idx, "state": state}
+
+    async def handle_reset(self, body):
+        self.sessions.pop(str(body["session_id"]), None)
+        return {"session_id": body["session_id"]}
+
+    def health(self):
+        return {
+            "sessions": len(self.sessions),
+            "turns": self.batcher.num_turns,
+            "batches": self.batcher.num_batches,
+            "queue": self.batcher.queue.qsize(),
+        }
+
+    async def expire_sessions(self):
+        while True:
+            await asyncio.sleep(min(60, self.session_ttl))
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if now - session.last_active > self.session_ttl and not session.lock.locked():
+                    self.sessions.pop(session_id)
+
+    async def dispatch(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, self.health()
+        if method == "POST" and path in ("/turn", "/reset"):
+            try:
+                body = json.loads(body or b"{}")
+                if path == "/turn":
+                    return 200, await self.handle_turn(body)
+                return 200, await self.handle_reset(body)
+            except (KeyError, ValueError) as e:
+                return 400, {"error": f"bad request: {e!r}"}
+        return 404, {"error": f"{method} {path} not found"}
+
+    async def handle_connection(self, reader, writer):
+        """HTTP/1.1 keep-alive connection 처리 (Content-Length body만 지원)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    status, payload = await self.dispatch(method, path, body)
+                except Exception as e:
+                    status, payload = 500, {"error": repr(e)}
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'ERROR'}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def load_tracker(args):
+    config = json.load(open(f"{args.model_dir}/exp_config.json", "r"))
+    config = argparse.Namespace(**config)
+    slot_meta = json.load(open(f"{args.model_dir}/slot_meta.json", "r"))
+
+    tokenizer = BertTokenizer.from_pretrained(config.model_name_or_path)
+    tokenizer.add_special_tokens({"additional_special_tokens": ["[SLOT]", "[NULL]", "[EOS]"]})
+    processor = SOMDSTPreprocessor(slot_meta, tokenizer, max_seq_length=512)
+
+    device = torch.device(args.device)
+    model = SOMDST(config, 5, 6, processor.op2id["update"])
+    model.load_state_dict(torch.load(os.path.join(args.model_dir, args.model_name), map_location="cpu"))
+    if args.quantize:
+        device = torch.device("cpu")
+        model = quantize_dynamic_int8(model, inplace=True)
+    model.to(device)
+    model.eval()
+    return SOMDSTTracker(model, processor, device)
+
+
+async def serve(args):
+    batcher = MicroBatcher(load_tracker(args), args.max_batch_size, args.max_wait_ms)
+    server = DSTServer(batcher, args.session_ttl)
+    asyncio.ensure_future(batcher.run())
+    asyncio.ensure_future(server.expire_sessions())
+    http_server = await asyncio.start_server(server.handle_connection, args.host, args.port)
+    print(f"Serving SOM-DST on http://{args.host}:{args.port}")
+    async with http_server:
+        await http_server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_dir", type=str, default="/opt/ml/result/SOMDST")
+    parser.add_argument("--model_name", type=str, default="model-17.bin")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--quantize", action="store_true", help="dynamic int8 quantization (CPU)")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_batch_size", type=int, default=16)
+    parser.add_argument("--max_wait_ms", type=float, default=10, help="첫 요청 이후 batch를 모으는 최대 대기 시간")
+    parser.add_argument("--session_ttl", type=int, default=1800, help="이 시간(초) 동안 요청이 없는 session은 삭제")
+    args = parser.parse_args()
+    asyncio.run(serve(args))
@@ -6,6 +6,8 @@ import pickle
 import glob
 from pathlib import Path
 import re
+import time
+from functools import partial
 from torch.utils.tensorboard import SummaryWriter
 import numpy as np
 import torch
@@ -21,10 +23,14 @@ from inference_somdst import inference
 from models import SOMDST, masked_cross_entropy_for_value
 from preprocessor import SOMDSTPreprocessor
 from torch.optim.lr_scheduler import *
-import torch.cuda.amp as amp
+from train_utils import (BackgroundEvaluator, CheckpointManager, ResumableSampler,
+                         StepProfiler, TrainingEngine, all_reduce_sum, barrier,
+                         init_distributed, is_main_process, load_checkpoint,
+                         select_eval_dialogues, unwrap_model, wrap_distributed)
 # import wandb
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+_eval_model = None
 
 
 def increment_path(path, exist_ok=False):
@@ -48,6 +54,33 @@ def get_lr(optimizer):
         return param_group['lr']
 
 
+def evaluate_checkpoint(model_path, args, update_id, processor, eval_examples, eval_labels, slot_meta,
+                        device="cpu"):
+    """background evaluation process에서 저장된 model-{epoch}.bin을 dev set으로 평가"""
+    global _eval_model
+    if _eval_model is None:
+        _eval_model = SOMDST(args, 5, 6, update_id).to(device)
+    _eval_model.load_state_dict(torch.load(model_path, map_location=device))
+    predictions = inference(_eval_model, eval_examples, processor, device)
+    return _evaluation(predictions, eval_labels, slot_meta)
+
+
+def report_evaluation(epoch, eval_result, best_score, best_checkpoint, logger):
+    """evaluation 결과를 출력 / tensorboard에 기록하고 best checkpoint 갱신 (출력은 rank 0만)"""
+    if is_main_process():
+        print(f"Evaluation of model-{epoch}")
+        for k, v in eval_result.items():
+            print(f"{k}: {v}")
+            logger.add_scalar(f"{k}", v, epoch)
+            # wandb.log({k: v})
+    if best_score < eval_result["joint_goal_accuracy"]:
+        if is_main_process():
+            print("Update Best checkpoint!")
+        best_score = eval_result["joint_goal_accuracy"]
+        best_checkpoint = epoch
+    return best_score, best_checkpoint
+
+
 if __name__ == "__main__":
     # wandb.init(project="Stage2-DST")
 
@@ -92,15 +125,39 @@ if __name__ == "__main__":
         default=None,
     )
     parser.add_argument("--teacher_forcing_ratio", type=float, default=0.5)
+    parser.add_argument("--amp", action="store_true", help="GPU에서는 fp16, CPU에서는 bfloat16 autocast")
+    parser.add_argument("--gradient_accumulation_steps", type=int, default=1)
+    parser.add_argument("--max_steps", type=int, default=None, help="epoch당 최대 step 수 (throughput 측정용)")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="학습 state checkpoint 경로 또는 latest ({model_dir}/checkpoints의 최근 checkpoint)")
+    parser.add_argument("--save_steps", type=int, default=None, help="epoch 중간에도 N step마다 학습 state 저장")
+    parser.add_argument("--keep_best", type=int, default=3, help="joint goal accuracy 상위 몇 개의 checkpoint를 남길지")
+    parser.add_argument("--keep_last", type=int, default=2, help="최근 몇 개의 checkpoint를 남길지")
+    parser.add_argument("--eval_every", type=int, default=1, help="N epoch마다 dev set evaluation")
+    parser.add_argument("--eval_subset", type=int, default=None, help="evaluation에 쓸 dev dialogue 수 (기본: 전체)")
+    parser.add_argument("--eval_threads", type=int, default=2, help="background evaluation process의 thread 수")
+    parser.add_argument("--eval_device", type=str, default="cpu", help="background evaluation process의 device")
+    parser.add_argument("--sync_eval", action="store_true",
+                        help="evaluation을 background process가 아니라 학습 loop 안에서 실행")
+    parser.add_argument("--profile", action="store_true",
+                        help="step의 phase별 시간, throughput, peak memory를 tensorboard에 기록")
+    parser.add_argument("--profile_log_steps", type=int, default=50, help="profile 결과를 몇 step마다 기록할지")
+    parser.add_argument("--trace_steps", type=int, default=0, help="N step 동안 chrome trace ({model_dir}/trace.json) 저장")
+    parser.add_argument("--trace_start", type=int, default=10, help="chrome trace를 시작할 step (warmup 이후)")
     args = parser.parse_args()
+
+    # launch.py로 실행하면 gloo backend로 여러 process가 하나의 model을 학습
+    rank, world_size = init_distributed()
     args.arch_name = args.model_name_or_path.split('/')[1].split('-')[0]
-    print(args.arch_name)
+    if is_main_process():
+        print(args.arch_name)
     # args.data_dir = os.environ["SM_CHANNEL_TRAIN"]
     if args.model_name:
         args.model_dir = os.path.join(args.model_dir, args.model_name)
     else:
         args.model_dir = increment_path(os.path.join(args.model_dir, args.run_name))
-    print(args.model_dir)
+    if is_main_process():
+        print(args.model_dir)
     # wandb.config.update(args)
     # wandb.run.name = f"{args.run_name}-{wandb.run.id}"
     # wandb.run.save()
@@ -129,8 +186,9 @@ if __name__ == "__main__":
                        # f"{args.data_dir}/new_train2.json",
                        ]
     train_data, dev_data, dev_labels = load_dataset(train_data_file)
-    print(len(train_data))
-    print(len(dev_data))
+    if is_main_process():
+        print(len(train_data))
+        print(len(dev_data))
     # asdfasdf
     train_examples = get_examples_from_dialogues(
         train_data, user_first=False, dialogue_level=False
@@ -138,9 +196,10 @@ if __name__ == "__main__":
     dev_examples = get_examples_from_dialogues(
         dev_data, user_first=False, dialogue_level=False
     )
-    print(len(train_examples))
-    print(len(dev_examples))
-    print()
+    if is_main_process():
+        print(len(train_examples))
+        print(len(dev_examples))
+        print()
     # asdfasdf
     # if not os.path.exists(os.path.join(args.data_dir, "train_somdst_features6.pkl")):
     #     print("Cached Input Features not Found.\nLoad data and save.")
@@ -162,7 +221,8 @@ if __name__ == "__main__":
     #         dev_examples = pickle.load(f)
     #     with open(os.path.join(args.data_dir, "dev_somdst_labels6.pkl"), "rb") as f:
     #         dev_labels = pickle.load(f)
-    if not os.path.exists(os.path.join(args.data_dir, "train_somdst_fin_coco.pkl")):
+    # feature cache는 rank 0만 만들고, 다른 process는 barrier 이후 같은 파일을 읽는다
+    if is_main_process() and not os.path.exists(os.path.join(args.data_dir, "train_somdst_fin_coco.pkl")):
         print("Cached Input Features not Found.\nLoad data and save.")
 
         # Extracting Featrues
@@ -174,20 +234,22 @@ if __name__ == "__main__":
             pickle.dump(dev_examples, f)
         with open(os.path.join(args.data_dir, "dev_somdst_labels_fin_coco.pkl"), "wb") as f:
             pickle.dump(dev_labels, f)
-    else:
-        print("Cached Input Features Found.\nLoad data from Cached")
-        with open(os.path.join(args.data_dir, "train_somdst_fin_coco.pkl"), "rb") as f:
-            train_features = pickle.load(f)
-        with open(os.path.join(args.data_dir, "dev_somdst_examples_fin_coco.pkl"), "rb") as f:
-            dev_examples = pickle.load(f)
-        with open(os.path.join(args.data_dir, "dev_somdst_labels_fin_coco.pkl"), "rb") as f:
-            dev_labels = pickle.load(f)
+    barrier()
+    if is_main_process():
+        print("Load data from Cached")
+    with open(os.path.join(args.data_dir, "train_somdst_fin_coco.pkl"), "rb") as f:
+        train_features = pickle.load(f)
+    with open(os.path.join(args.data_dir, "dev_somdst_examples_fin_coco.pkl"), "rb") as f:
+        dev_examples = pickle.load(f)
+    with open(os.path.join(args.data_dir, "dev_somdst_labels_fin_coco.pkl"), "rb") as f:
+        dev_labels = pickle.load(f)
 
     # Model 선언
     model = SOMDST(args, 5, 6, processor.op2id["update"])
 
-    if args.model_name:
-        print("Checkpoint Load")
+    if args.model_name and not args.resume:
+        if is_main_process():
+            print("Checkpoint Load")
         ckpt = torch.load(os.path.join(args.model_dir, f"model-{args.ckpt}.bin"))
         model.load_state_dict(ckpt)
 
@@ -195,10 +257,13 @@ if __name__ == "__main__":
     # wandb.watch(model)
     # print(f"Subword Embeddings is loaded from {args.model_name_or_path}")
     model.to(device)
-    print("Model is initialized")
+    # update가 없는 batch에서는 decoder가 쓰이지 않는다
+    model = wrap_distributed(model, find_unused_parameters=True)
+    if is_main_process():
+        print("Model is initialized")
 
     train_data = WOSDataset(train_features)
-    train_sampler = RandomSampler(train_data)
+    train_sampler = ResumableSampler(train_data, seed=args.random_seed)
     train_loader = DataLoader(
         train_data,
         batch_size=args.train_batch_size,
@@ -206,15 +271,20 @@ if __name__ == "__main__":
         collate_fn=processor.collate_fn,
         num_workers=4,
     )
-    print("# train:", len(train_data))
+    if is_main_process():
+        print("# train:", len(train_data))
 
-    print("# dev:", len(dev_examples))
+    # dev set 일부만으로 evaluation (dialogue 단위로 선택, turn 순서 유지)
+    dev_examples = select_eval_dialogues(dev_examples, args.eval_subset, args.random_seed)
+    dev_labels = {e.guid: dev_labels[e.guid] for e in dev_examples}
+    if is_main_process():
+        print("# dev:", len(dev_examples))
 
     # Optimizer 및 Scheduler 선언
     n_epochs = args.num_train_epochs
     t_total = len(train_loader) * n_epochs
     # warmup_steps = int(t_total * args.warmup_ratio)
-    num_train_steps = int(len(train_data) / args.train_batch_size * n_epochs)
+    num_train_steps = int(len(train_loader) * n_epochs / args.gradient_accumulation_steps)
     optimizer = AdamW(model.parameters(), lr=8.2e-5, eps=args.adam_epsilon)#args.learning_rate
     # scheduler = get_linear_schedule_with_warmup(
     #     optimizer, num_warmup_steps=warmup_steps, num_training_steps=t_total
@@ -222,36 +292,111 @@ if __name__ == "__main__":
     scheduler = WarmupLinearSchedule(optimizer, 0,
                                          t_total=num_train_steps)
     # scheduler = StepLR(optimizer, 1, gamma=0.9997)  # 794) #gamma : 20epoch => lr x 0.01
+    engine = TrainingEngine(
+        model,
+        optimizer,
+        scheduler,
+        device=device,
+        use_amp=args.amp,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        max_grad_norm=args.max_grad_norm,
+    )
     loss_fnc_1 = masked_cross_entropy_for_value  # generation
     loss_fnc_2 = nn.CrossEntropyLoss()  # gating
 
-    if not os.path.exists(args.model_dir):
-        os.mkdir(args.model_dir)
+    logger = None
+    if is_main_process():
+        if not os.path.exists(args.model_dir):
+            os.mkdir(args.model_dir)
 
-    json.dump(
-        vars(args),
-        open(f"{args.model_dir}/exp_config.json", "w",encoding='UTF8'),
-        indent=2,
-        ensure_ascii=False,
-    )
-    json.dump(
-        slot_meta,
-        open(f"{args.model_dir}/slot_meta.json", "w",encoding='UTF8'),
-        indent=2,
-        ensure_ascii=False,
+        json.dump(
+            vars(args),
+            open(f"{args.model_dir}/exp_config.json", "w",encoding='UTF8'),
+            indent=2,
+            ensure_ascii=False,
+        )
+        json.dump(
+            slot_meta,
+            open(f"{args.model_dir}/slot_meta.json", "w",encoding='UTF8'),
+            indent=2,
+            ensure_ascii=False,
+        )
+        logger = SummaryWriter(log_dir=args.model_dir)
+
+    # step의 phase별 시간 측정 (--profile) / chrome trace (--trace_steps)
+    # collate는 DataLoader worker에서 실행되므로 data phase (batch 대기)에 포함된다
+    profiler = StepProfiler(
+        enabled=(args.profile or args.trace_steps > 0) and is_main_process(),
+        device=device,
+        logger=logger,
+        log_every=args.profile_log_steps,
+        trace_path=f"{args.model_dir}/trace.json",
+        trace_start=args.trace_start,
+        trace_steps=args.trace_steps,
     )
-    logger = SummaryWriter(log_dir=args.model_dir)
+    profiler.attach(unwrap_model(model).encoder, "encoder")
+    profiler.attach(unwrap_model(model).decoder, "decoder")
+    engine.profiler = profiler
+    # --ckpt로 model weight만 불러오던 것과 달리 optimizer / scheduler / RNG까지 복원
+    # checkpoint 저장 / retention은 rank 0만, 재개는 모든 process가 같은 checkpoint에서
+    checkpoint_manager = None
+    if is_main_process():
+        checkpoint_manager = CheckpointManager(
+            f"{args.model_dir}/checkpoints", keep_best=args.keep_best, keep_last=args.keep_last
+        )
     best_score, best_checkpoint = 0, 0
-    for epoch in range(n_epochs):
+    start_epoch, start_step = 0, 0
+    if args.resume:
+        start_epoch, start_step, extra = load_checkpoint(
+            f"{args.model_dir}/checkpoints", args.resume, model, optimizer, scheduler, engine
+        )
+        best_score, best_checkpoint = extra["best_score"], extra["best_checkpoint"]
+        if is_main_process():
+            # 저장 이후에 끝난 background evaluation 결과가 manifest에 남아 있을 수 있다
+            best = checkpoint_manager.best()
+            if best is not None and best_score < best["score"]:
+                best_score, best_checkpoint = best["score"], best["epoch"] - 1 + args.ckpt
+            print(f"Resume from epoch {start_epoch} step {start_step}")
+
+    # 저장된 checkpoint를 별도 process에서 평가해서 다음 epoch 학습과 겹치게 한다
+    # (SOM-DST inference는 example 단위 순차 처리라 epoch 시간의 큰 부분을 차지)
+    evaluator = None
+    if not args.sync_eval and is_main_process():
+        evaluator = BackgroundEvaluator(
+            partial(
+                evaluate_checkpoint,
+                args=args,
+                update_id=processor.op2id["update"],
+                processor=processor,
+                eval_examples=dev_examples,
+                eval_labels=dev_labels,
+                slot_meta=slot_meta,
+                device=args.eval_device,
+            ),
+            num_threads=args.eval_threads,
+        )
+        # 재개 전에 평가가 끝나지 않은 checkpoint는 다시 요청
+        for entry in checkpoint_manager.waiting_for_score():
+            evaluator.submit(entry)
+
+    steps_per_epoch = len(train_loader)
+    for epoch in range(start_epoch, n_epochs):
         batch_loss = []
         model.train()
-        for step, batch in enumerate(train_loader):
-            batch = [
-                b.to(device)
-                if not isinstance(b, int) and not isinstance(b, list)
-                else b
-                for b in batch
-            ]
+        # 재개한 epoch은 이미 학습한 batch를 건너뜀
+        skip_steps = start_step if epoch == start_epoch else 0
+        train_sampler.set_epoch(epoch, skip_steps * args.train_batch_size)
+        epoch_start, num_samples = time.time(), 0
+        for step, batch in enumerate(profiler.iter(train_loader), start=skip_steps):
+            if args.max_steps is not None and step >= args.max_steps:
+                break
+            with profiler.phase("h2d"):
+                batch = [
+                    b.to(device)
+                    if not isinstance(b, int) and not isinstance(b, list)
+                    else b
+                    for b in batch
+                ]
             (
                 input_ids,
                 input_masks,
@@ -273,66 +418,114 @@ if __name__ == "__main__":
                 tf = target_ids
             else:
                 tf = None
-            with amp.autocast():
-
-                domain_scores, state_scores, gen_scores = model(
-                    input_ids=input_ids,
-                    token_type_ids=segment_ids,
-                    slot_positions=slot_position_ids,
-                    attention_mask=input_masks,
-                    max_value=max_value,
-                    op_ids=gating_ids,
-                    max_update=max_update,
-                    teacher=tf,
-                )
+            with engine.autocast():
+                with profiler.phase("forward"):
+                    domain_scores, state_scores, gen_scores = model(
+                        input_ids=input_ids,
+                        token_type_ids=segment_ids,
+                        slot_positions=slot_position_ids,
+                        attention_mask=input_masks,
+                        max_value=max_value,
+                        op_ids=gating_ids,
+                        max_update=max_update,
+                        teacher=tf,
+                    )
 
-                # generation loss
-                loss_1 = loss_fnc_1(
-                    gen_scores.contiguous(),
-                    target_ids.contiguous(),
-                    tokenizer.pad_token_id,
-                )
+                with profiler.phase("loss"):
+                    # generation loss
+                    loss_1 = loss_fnc_1(
+                        gen_scores.contiguous(),
+                        target_ids.contiguous(),
+                        tokenizer.pad_token_id,
+                    )
 
-                # gating loss
-                loss_2 = loss_fnc_2(
-                    state_scores.contiguous().view(-1, 6),
-                    gating_ids.contiguous().view(-1),
-                )
-                loss_3 = loss_fnc_2(domain_scores.view(-1, 5), domain_ids.view(-1))
-                loss = loss_1 + loss_2 + loss_3
-                batch_loss.append(loss.item())
+                    # gating loss
+                    loss_2 = loss_fnc_2(
+                        state_scores.contiguous().view(-1, 6),
+                        gating_ids.contiguous().view(-1),
+                    )
+                    loss_3 = loss_fnc_2(domain_scores.view(-1, 5), domain_ids.view(-1))
+                    loss = loss_1 + loss_2 + loss_3
+            batch_loss.append(loss.item())
 
-                loss.backward()
-            nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
-            optimizer.step()
-            scheduler.step()
-            optimizer.zero_grad()
+            engine.backward(loss)
+            num_samples += len(guids)
+            profiler.step(len(guids), int(input_masks.sum()) if profiler.enabled else 0)
 
-            if step % 50 == 0:
+            if step % 50 == 0 and is_main_process():
                 current_lr = get_lr(optimizer)
                 print("[%d/%d] [%d/%d] mean_loss : %.3f, state_loss : %.3f, gen_loss : %.3f, dom_loss : %.3f, lr : %.7f" \
                       % (epoch + 1, n_epochs, step,
-                         len(train_loader), np.mean(batch_loss),
+                         steps_per_epoch, np.mean(batch_loss),
                          loss_1.item(), loss_2.item(), loss_3.item(), current_lr))
-                logger.add_scalar("Train/loss", loss, epoch * len(train_loader) + step)
-                logger.add_scalar("Train/gen_loss", loss_1, epoch * len(train_loader) + step)
-                logger.add_scalar("Train/gating_loss", loss_2, epoch * len(train_loader) + step)
-                logger.add_scalar("Train/domain_loss", loss_3, epoch * len(train_loader) + step)
-                logger.add_scalar("Train/Learning_rate", current_lr, epoch * len(train_loader) + step)
+                logger.add_scalar("Train/loss", loss, epoch * steps_per_epoch + step)
+                logger.add_scalar("Train/gen_loss", loss_1, epoch * steps_per_epoch + step)
+                logger.add_scalar("Train/gating_loss", loss_2, epoch * steps_per_epoch + step)
+                logger.add_scalar("Train/domain_loss", loss_3, epoch * steps_per_epoch + step)
+                logger.add_scalar("Train/Learning_rate", current_lr, epoch * steps_per_epoch + step)
 
                 batch_loss = []
-        predictions = inference(model, dev_examples, processor, device)
-        eval_result = _evaluation(predictions, dev_labels, slot_meta)
-        for k, v in eval_result.items():
-            print(f"{k}: {v}")
-            logger.add_scalar(f"{k}", v, epoch)
-            # wandb.log({k: v})
-        if best_score < eval_result["joint_goal_accuracy"]:
-            print("Update Best checkpoint!")
-            best_score = eval_result["joint_goal_accuracy"]
-        best_checkpoint = epoch + args.ckpt
 
-        torch.save(
-            model.state_dict(), f"{args.model_dir}/model-{epoch + args.ckpt}.bin"
-        )
-    print(f"Best checkpoint: {args.model_dir}/model-{best_checkpoint}.bin")
+            # accumulation 중간이 아닐 때만 (optimizer step 직후) 저장
+            if (
+                args.save_steps
+                and (step + 1) % args.save_steps == 0
+                and engine.num_backward % args.gradient_accumulation_steps == 0
+                and is_main_process()
+            ):
+                checkpoint_manager.save(
+                    f"checkpoint-{epoch + args.ckpt}-{step + 1}", model, optimizer, scheduler, engine,
+                    epoch=epoch, step=step + 1,
+                    extra={"best_score": best_score, "best_checkpoint": best_checkpoint},
+                )
+        engine.flush()
+
+        # 모든 process가 처리한 sample 수로 throughput 계산
+        num_samples = all_reduce_sum(num_samples)
+        if is_main_process():
+            throughput = num_samples / (time.time() - epoch_start)
+            print(f"throughput: {throughput:.1f} samples/s ({world_size} processes)")
+            logger.add_scalar("Train/throughput", throughput, epoch)
+
+        # evaluation과 checkpoint 저장은 rank 0만, 나머지 process는 barrier에서 대기
+        if is_main_process():
+            do_eval = (epoch + 1) % args.eval_every == 0 or epoch == n_epochs - 1
+            if do_eval and args.sync_eval:
+                predictions = inference(unwrap_model(model), dev_examples, processor, device)
+                eval_result = _evaluation(predictions, dev_labels, slot_meta)
+                best_score, best_checkpoint = report_evaluation(
+                    epoch + args.ckpt, eval_result, best_score, best_checkpoint, logger
+                )
+
+            # 파일 쓰기는 background thread에서, 다음 epoch 학습과 겹쳐서 진행
+            # background evaluation은 model-{epoch}.bin 쓰기가 끝나면 요청된다
+            checkpoint_manager.save(
+                f"checkpoint-{epoch + args.ckpt}", model, optimizer, scheduler, engine,
+                epoch=epoch + 1, step=0,
+                extra={"best_score": best_score, "best_checkpoint": best_checkpoint},
+                model_path=f"{args.model_dir}/model-{epoch + args.ckpt}.bin",
+                wait_for_score=do_eval,
+                on_saved=evaluator.submit if do_eval and evaluator is not None else None,
+            )
+            if do_eval and args.sync_eval:
+                checkpoint_manager.set_score(f"checkpoint-{epoch + args.ckpt}", eval_result["joint_goal_accuracy"])
+
+            # 이전 epoch들의 background evaluation 중 끝난 것 반영
+            for entry, eval_result in evaluator.poll() if evaluator is not None else []:
+                best_score, best_checkpoint = report_evaluation(
+                    entry["epoch"] - 1 + args.ckpt, eval_result, best_score, best_checkpoint, logger
+                )
+                checkpoint_manager.set_score(entry["name"], eval_result["joint_goal_accuracy"])
+        barrier()
+
+    if is_main_process():
+        checkpoint_manager.wait()
+        if evaluator is not None:
+            for entry, eval_result in evaluator.poll(block=True):
+                best_score, best_checkpoint = report_evaluation(
+                    entry["epoch"] - 1 + args.ckpt, eval_result, best_score, best_checkpoint, logger
+                )
+                checkpoint_manager.set_score(entry["name"], eval_result["joint_goal_accuracy"])
+            evaluator.close()
+        checkpoint_manager.close()
+        print(f"Best checkpoint: {args.model_dir}/model-{best_checkpoint}.bin")
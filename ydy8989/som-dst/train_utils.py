@@ -0,0 +1,9 @@
+"""학습 공용 코드는 repo root의 train_engine.py 하나에만 둔다
+
+이 폴더의 script가 `from train_utils import ...`로 그대로 쓸 수 있도록 root를 sys.path에 넣고 다시 export 한다.
+"""
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from train_engine import *  # noqa: F401,F403
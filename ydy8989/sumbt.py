@@ -2,27 +2,68 @@ import argparse
 import json
 import os
 import random
+import time
 
+import numpy as np
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
+from torch.utils.data import DataLoader, SequentialSampler
 from tqdm import tqdm
 from transformers import AdamW, BertTokenizer, get_linear_schedule_with_warmup
 
 from data_utils import (WOSDataset, get_examples_from_dialogues, load_dataset,
-                        set_seed, tokenize_ontology)
+                        set_seed, tokenize_ontology, slot_value_cache_path,
+                        load_slot_value_cache, save_slot_value_cache,
+                        UtteranceCacheDataset, utterance_cache_path)
 from eval_utils import DSTEvaluator
 from evaluation import _evaluation
 from inference import inference, inference_sumbt
 from model import TRADE, masked_cross_entropy_for_value, SUMBT
 from preprocessor import TRADEPreprocessor, SUMBTPreprocessor
-from torch.cuda.amp import autocast,  GradScaler
-use_amp = True
-scaler = GradScaler(enabled=use_amp)
+from train_utils import (CheckpointManager, ResumableSampler, TrainingEngine, all_reduce_sum,
+                         barrier, init_distributed, is_main_process, load_checkpoint,
+                         unwrap_model, wrap_distributed)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+def build_utterance_cache(model, features, processor, path, batch_size, device):
+    """frozen utterance encoder의 output을 실제 turn만 fp16 .npy (memory-map)로 저장"""
+    loader = DataLoader(
+        WOSDataset(features),
+        batch_size=batch_size,
+        sampler=SequentialSampler(features),
+        collate_fn=processor.collate_fn,
+    )
+    total_turns = sum(f.num_turn for f in features)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path[:-len('.npy')]}.tmp-{os.getpid()}.npy"
+    cache = np.lib.format.open_memmap(
+        tmp_path,
+        mode="w+",
+        dtype=np.float16,
+        shape=(total_turns, processor.max_seq_length, model.bert_output_dim),
+    )
+
+    model.eval()
+    offset = 0
+    for batch in tqdm(loader, desc="utterance cache"):
+        input_ids, segment_ids, input_masks, target_ids, num_turns, guids = \
+            [b.to(device) if not isinstance(b, list) else b for b in batch]
+        with torch.no_grad():
+            hidden = model.encode_utterance(input_ids, segment_ids, input_masks, num_turns)
+        hidden = hidden.view(len(num_turns), -1, processor.max_seq_length, model.bert_output_dim)
+        for h, num_turn in zip(hidden, num_turns):
+            cache[offset: offset + num_turn] = h[:num_turn].half().cpu().numpy()
+            offset += num_turn
+    cache.flush()
+    del cache
+    os.replace(tmp_path, path)
+
+
 def train(args):
+    # launch.py로 실행하면 gloo backend로 여러 process가 하나의 model을 학습
+    rank, world_size = init_distributed()
+
     # random seed 고정
     set_seed(args.random_seed)
 
@@ -34,7 +75,8 @@ def train(args):
     slot_meta = json.load(open(f"{args.data_dir}/slot_meta.json"))  # 45개의 slot
     ontology = json.load(open(f"{args.data_dir}/ontology.json"))
     train_data, dev_data, dev_labels = load_dataset(train_data_file)  # item별로 분류 6301개 , 699개
-    print(train_data[:1])
+    if is_main_process():
+        print(train_data[:1])
     # list안에 dialogue별로 세분화, dict type -> DSTInputExample type , dev는 label이 none
     train_examples = get_examples_from_dialogues(  # item의 dialogue별로 46170개, 5075개
         train_data, user_first=True, dialogue_level=True
@@ -42,8 +84,8 @@ def train(args):
     dev_examples = get_examples_from_dialogues(
         dev_data, user_first=True, dialogue_level=True
     )
-    print(len(train_examples), len(dev_examples))
-    asdfasdf
+    if is_main_process():
+        print(len(train_examples), len(dev_examples))
     # Define Preprocessor
     tokenizer = BertTokenizer.from_pretrained(args.model_name_or_path)
     max_turn = max([len(e['dialogue']) for e in train_data])
@@ -58,39 +100,92 @@ def train(args):
     train_features = processor.convert_examples_to_features(train_examples)
     dev_features = processor.convert_examples_to_features(dev_examples)
 
-    # Ontology pre encoding
-    slot_type_ids, slot_values_ids = tokenize_ontology(ontology, tokenizer, 12)
-    num_labels = [len(s) for s in slot_values_ids]  # 각 Slot 별 후보 Values의 갯수
+    # dummy turn은 encoder에서 건너뛰므로 실제로 encoding 되는 turn의 비율을 기록
+    num_real_turns = sum(f.num_turn for f in train_features)
+    num_padded_turns = len(train_features) * processor.max_turn_length
+    if is_main_process():
+        print(f"encoded turns: {num_real_turns}/{num_padded_turns} ({num_real_turns / num_padded_turns:.1%})")
+
+    num_labels = [len(v) for v in ontology.values()]  # 각 Slot 별 후보 Values의 갯수
 
     # Model 선언
     n_gpu = 1 if torch.cuda.device_count() < 2 else torch.cuda.device_count()
-    print(n_gpu)
+    if is_main_process():
+        print(n_gpu)
     n_epochs = args.num_train_epochs
 
     model = SUMBT(args, num_labels, device)
-    model.initialize_slot_value_lookup(slot_values_ids, slot_type_ids)  # Tokenized Ontology의 Pre-encoding using BERT_SV
+
+    # Ontology pre encoding: cache가 있으면 BERT_SV 없이 바로 불러온다
+    sv_cache_dir = args.sv_cache_dir or f"{args.data_dir}/sumbt_sv_cache"
+    sv_cache_path = slot_value_cache_path(
+        sv_cache_dir, args.model_name_or_path, ontology, args.max_label_length
+    )
+    # multi process면 rank 0만 cache를 만들고 나머지는 만들어진 cache를 읽는다
+    if not is_main_process():
+        barrier()
+    sv_cache = load_slot_value_cache(sv_cache_path)
+    if sv_cache is not None:
+        if is_main_process():
+            print(f"Slot/value embeddings are loaded from {sv_cache_path}")
+        model.set_slot_value_lookup(*sv_cache)
+    else:
+        slot_type_ids, slot_values_ids = tokenize_ontology(ontology, tokenizer, args.max_label_length)
+        model.initialize_slot_value_lookup(slot_values_ids, slot_type_ids)  # Tokenized Ontology의 Pre-encoding using BERT_SV
+        save_slot_value_cache(
+            sv_cache_path,
+            model.slot_lookup.weight,
+            [lookup.weight for lookup in model.value_lookup],
+        )
+    if is_main_process():
+        barrier()
     model.to(device)
-    print("Model is initialized")
+    if is_main_process():
+        print("Model is initialized")
 
-    train_data = WOSDataset(train_features)  # feature와 len만 담긴 dataset
-    train_sampler = RandomSampler(train_data)  #
+    if args.utterance_cache:
+        # utterance encoder를 고정하고, encoder output을 한번만 계산해서 cache로부터 학습
+        for p in model.utterance_encoder.parameters():
+            p.requires_grad = False
+        utterance_cache_dir = args.utterance_cache_dir or f"{args.data_dir}/sumbt_utterance_cache"
+        cache_paths = []
+        for features in [train_features, dev_features]:
+            cache_path = utterance_cache_path(
+                utterance_cache_dir, args.model_name_or_path, features, processor.max_seq_length
+            )
+            if not os.path.exists(cache_path) and is_main_process():
+                print(f"Utterance cache not found. Build {cache_path}")
+                build_utterance_cache(model, features, processor, cache_path, args.eval_batch_size, device)
+            cache_paths.append(cache_path)
+        barrier()
+        train_data = UtteranceCacheDataset(train_features, cache_paths[0])
+        dev_data = UtteranceCacheDataset(dev_features, cache_paths[1])
+        collate_fn = processor.cached_collate_fn
+    else:
+        train_data = WOSDataset(train_features)  # feature와 len만 담긴 dataset
+        dev_data = WOSDataset(dev_features)
+        collate_fn = processor.collate_fn
+
+    model = wrap_distributed(model)
+    train_sampler = ResumableSampler(train_data, seed=args.random_seed)
     train_loader = DataLoader(
         train_data,
         batch_size=args.train_batch_size,
         sampler=train_sampler,
-        collate_fn=processor.collate_fn,
+        collate_fn=collate_fn,
     )
-    print("# train:", len(train_data))
+    if is_main_process():
+        print("# train:", len(train_data))
 
-    dev_data = WOSDataset(dev_features)
     dev_sampler = SequentialSampler(dev_data)
     dev_loader = DataLoader(
         dev_data,
         batch_size=args.eval_batch_size,
         sampler=dev_sampler,
-        collate_fn=processor.collate_fn,
+        collate_fn=collate_fn,
     )
-    print("# dev:", len(dev_data))
+    if is_main_process():
+        print("# dev:", len(dev_data))
 
     # Optimizer 및 Scheduler 선언
 
@@ -106,72 +201,131 @@ def train(args):
         },
     ]
 
-    t_total = len(train_loader) * n_epochs
+    t_total = len(train_loader) * n_epochs // args.gradient_accumulation_steps
     optimizer = AdamW(optimizer_grouped_parameters, lr=args.learning_rate, eps=1e-8)
     scheduler = get_linear_schedule_with_warmup(
         optimizer, num_warmup_steps=int(t_total * args.warmup_ratio), num_training_steps=t_total
     )
 
-    if not os.path.exists(args.model_dir):
-        os.mkdir(args.model_dir)
-    if not os.path.exists(f"{args.model_dir}/{args.model}"):
-        os.mkdir(f"{args.model_dir}/{args.model}")
+    if is_main_process():
+        if not os.path.exists(args.model_dir):
+            os.mkdir(args.model_dir)
+        if not os.path.exists(f"{args.model_dir}/{args.model}"):
+            os.mkdir(f"{args.model_dir}/{args.model}")
 
-    json.dump(
-        vars(args),
-        open(f"{args.model_dir}/{args.model}/exp_config.json", "w"),
-        indent=2,
-        ensure_ascii=False,
-    )
+        json.dump(
+            vars(args),
+            open(f"{args.model_dir}/{args.model}/exp_config.json", "w"),
+            indent=2,
+            ensure_ascii=False,
+        )
 
-    json.dump(
-        slot_meta,
-        open(f"{args.model_dir}/{args.model}/slot_meta.json", "w"),
-        indent=2,
-        ensure_ascii=False,
+        json.dump(
+            slot_meta,
+            open(f"{args.model_dir}/{args.model}/slot_meta.json", "w"),
+            indent=2,
+            ensure_ascii=False,
+        )
+    engine = TrainingEngine(
+        model,
+        optimizer,
+        scheduler,
+        device=device,
+        use_amp=args.amp,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        max_grad_norm=args.max_grad_norm,
     )
-    scaler = GradScaler(enabled=use_amp)
+    # checkpoint 저장 / retention은 rank 0만, 재개는 모든 process가 같은 checkpoint에서
+    checkpoint_manager = None
+    if is_main_process():
+        checkpoint_manager = CheckpointManager(
+            f"{args.model_dir}/{args.model}/checkpoints", keep_best=args.keep_best, keep_last=args.keep_last
+        )
     best_score, best_checkpoint = 0, 0
-    for epoch in tqdm(range(n_epochs)):
+    start_epoch, start_step = 0, 0
+    if args.resume:
+        start_epoch, start_step, extra = load_checkpoint(
+            f"{args.model_dir}/{args.model}/checkpoints", args.resume, model, optimizer, scheduler, engine
+        )
+        best_score, best_checkpoint = extra["best_score"], extra["best_checkpoint"]
+        if is_main_process():
+            print(f"Resume from epoch {start_epoch} step {start_step}")
+
+    steps_per_epoch = len(train_loader)
+    for epoch in tqdm(range(start_epoch, n_epochs)):
         batch_loss = []
         model.train()
-        for step, batch in tqdm(enumerate(train_loader), total=len(train_loader)):
-            optimizer.zero_grad()
-            input_ids, segment_ids, input_masks, target_ids, num_turns, guids = \
-                [b.to(device) if not isinstance(b, list) else b for b in batch]
-            with autocast(enabled=use_amp):
+        # 재개한 epoch은 이미 학습한 batch를 건너뜀
+        skip_steps = start_step if epoch == start_epoch else 0
+        train_sampler.set_epoch(epoch, skip_steps * args.train_batch_size)
+        epoch_start, num_samples = time.time(), 0
+        for step, batch in tqdm(enumerate(train_loader, start=skip_steps), total=steps_per_epoch,
+                                initial=skip_steps, disable=not is_main_process()):
+            if args.max_steps is not None and step >= args.max_steps:
+                break
+            batch = [b.to(device) if not isinstance(b, list) else b for b in batch]
+            input_ids, segment_ids, input_masks, target_ids, num_turns, guids = batch[:6]
+            utterance_hidden = batch[6] if args.utterance_cache else None
+            with engine.autocast():
                 if n_gpu == 1:
-                    loss, loss_slot, acc, acc_slot, _ = model(input_ids, segment_ids, input_masks, target_ids, n_gpu)
+                    loss, loss_slot, acc, acc_slot, _ = model(input_ids, segment_ids, input_masks, target_ids, n_gpu,
+                                                              num_turns=num_turns, utterance_hidden=utterance_hidden)
                 else:
-                    loss, _, acc, acc_slot, _ = model(input_ids, segment_ids, input_masks, target_ids, n_gpu)
+                    loss, _, acc, acc_slot, _ = model(input_ids, segment_ids, input_masks, target_ids, n_gpu,
+                                                      num_turns=num_turns, utterance_hidden=utterance_hidden)
             batch_loss.append(loss.item())
-            scaler.scale(loss).backward()
-            scaler.unscale_(optimizer)
-            nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-            scaler.step(optimizer)
+            engine.backward(loss)
+            num_samples += len(guids)
+
+            if step % 50 == 0 and is_main_process():
+                print('[%d/%d] [%d/%d] %f' % (epoch, n_epochs, step, steps_per_epoch, loss.item()))
 
-            scale = scaler.get_scale()
-            scaler.update()
-            step_scheduler = scaler.get_scale() == scale
+            # accumulation 중간이 아닐 때만 (optimizer step 직후) 저장
+            if (
+                args.save_steps
+                and (step + 1) % args.save_steps == 0
+                and engine.num_backward % args.gradient_accumulation_steps == 0
+                and is_main_process()
+            ):
+                checkpoint_manager.save(
+                    f"checkpoint-{epoch}-{step + 1}", model, optimizer, scheduler, engine,
+                    epoch=epoch, step=step + 1,
+                    extra={"best_score": best_score, "best_checkpoint": best_checkpoint},
+                )
+        engine.flush()
 
-            if step_scheduler:
-                scheduler.step()
+        # 모든 process가 처리한 sample 수로 throughput 계산
+        num_samples = all_reduce_sum(num_samples)
+        if is_main_process():
+            print(f"throughput: {num_samples / (time.time() - epoch_start):.1f} samples/s ({world_size} processes)")
 
-            if step % 50 == 0:
-                print('[%d/%d] [%d/%d] %f' % (epoch, n_epochs, step, len(train_loader), loss.item()))
+        # evaluation과 checkpoint 저장은 rank 0만, 나머지 process는 barrier에서 대기
+        if is_main_process():
+            predictions = inference_sumbt(unwrap_model(model), dev_loader, processor, device)
+            eval_result = _evaluation(predictions, dev_labels, slot_meta)
+            for k, v in eval_result.items():
+                print(f"{k}: {v}")
 
-        predictions = inference_sumbt(model, dev_loader, processor, device)
-        eval_result = _evaluation(predictions, dev_labels, slot_meta)
-        for k, v in eval_result.items():
-            print(f"{k}: {v}")
+            best_model_path = None
+            if best_score < eval_result['joint_goal_accuracy']:
+                print("Update Best checkpoint!")
+                best_score = eval_result['joint_goal_accuracy']
+                best_checkpoint = epoch
+                best_model_path = f"{args.model_dir}/{args.model}/best_model.bin"
 
-        if best_score < eval_result['joint_goal_accuracy']:
-            print("Update Best checkpoint!")
-            best_score = eval_result['joint_goal_accuracy']
-            best_checkpoint = epoch
-            torch.save(model.state_dict(), f"{args.model_dir}/{args.model}/best_model.bin")
+            # 파일 쓰기는 background thread에서, 다음 epoch 학습과 겹쳐서 진행
+            checkpoint_manager.save(
+                f"checkpoint-{epoch}", model, optimizer, scheduler, engine,
+                epoch=epoch + 1, step=0,
+                extra={"best_score": best_score, "best_checkpoint": best_checkpoint},
+                model_path=best_model_path,
+            )
+            checkpoint_manager.set_score(f"checkpoint-{epoch}", eval_result['joint_goal_accuracy'])
+        barrier()
 
-    print(f"Best checkpoint: {args.model_dir}/model-{best_checkpoint}.bin")
+    if is_main_process():
+        checkpoint_manager.close()
+        print(f"Best checkpoint: {args.model_dir}/model-{best_checkpoint}.bin")
 
 
 if __name__ == "__main__":
@@ -217,6 +371,20 @@ if __name__ == "__main__":
     parser.add_argument("--max_seq_length", type=int, default=64)
     parser.add_argument("--zero_init_rnn", type=bool, default=False)
     parser.add_argument("--num_rnn_layers", type=int, default=1)
+    parser.add_argument("--amp", action="store_true", help="GPU에서는 fp16, CPU에서는 bfloat16 autocast")
+    parser.add_argument("--gradient_accumulation_steps", type=int, default=1)
+    parser.add_argument("--max_steps", type=int, default=None, help="epoch당 최대 step 수 (throughput 측정용)")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="학습 state checkpoint 경로 또는 latest ({model_dir}/{model}/checkpoints의 최근 checkpoint)")
+    parser.add_argument("--save_steps", type=int, default=None, help="epoch 중간에도 N step마다 학습 state 저장")
+    parser.add_argument("--keep_best", type=int, default=3, help="joint goal accuracy 상위 몇 개의 checkpoint를 남길지")
+    parser.add_argument("--keep_last", type=int, default=2, help="최근 몇 개의 checkpoint를 남길지")
+    parser.add_argument("--utterance_cache", action="store_true",
+                        help="utterance encoder를 고정하고 encoder output cache로 belief tracker만 학습")
+    parser.add_argument("--utterance_cache_dir", type=str, default=None,
+                        help="utterance encoder output cache 경로. 지정하지 않으면 {data_dir}/sumbt_utterance_cache")
+    parser.add_argument("--sv_cache_dir", type=str, default=None,
+                        help="slot/value embedding cache 경로. 지정하지 않으면 {data_dir}/sumbt_sv_cache")
 
     args = parser.parse_args()
     print(args)